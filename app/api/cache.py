@@ -0,0 +1,140 @@
+import datetime
+import threading
+import time
+from typing import Callable, Iterable, Union
+from django.conf import settings
+from django.core.cache import caches
+from .intervals import BUSY_GRACE
+from .matching import EPOCH
+
+
+class ClosestDriverCache:
+    """Read-through cache of the closest-driver searches, backed by Django's cache framework.
+
+    The entries are keyed on the quantized (lat, lng, target_datetime) and expire by the TIMEOUT
+    and MAX_ENTRIES (LRU) of the CLOSEST_DRIVER_CACHE alias. Every key also holds:
+
+    - The generation of the in-memory indexes the result was computed from, so a rebuild (e.g. a
+      write from another process) discards the entries.
+    - The generation of its target_datetime bucket, bumped when an order is written in a window
+      that the search of that target_datetime reads.
+    - For the starting zone search, the drivers generation, bumped when a driver position changes.
+
+    The orders search skips the orders picked up before now, so its entries expire once now passes
+    the pickup_datetime of the first selected order.
+    """
+    # The orders search reads the orders picked up after target - MAX_TIMEDELTA that end by target,
+    # and the starting zone search the ones picked up by target - 1 minute that end at target or later.
+    ORDERS = 'orders'
+    STARTING_ZONE = 'starting_zone'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CLOSEST_DRIVER_CACHE is not None
+
+    @property
+    def cache(self):
+        return caches[settings.CLOSEST_DRIVER_CACHE]
+
+    @staticmethod
+    def _bucket(value: datetime.datetime) -> int:
+        return int(value.timestamp() // settings.CLOSEST_DRIVER_CACHE_BUCKET.total_seconds())
+
+    def _generation(self, name: str) -> int:
+        # A missing (or evicted) generation starts with a new value, so it never matches older entries.
+        return self.cache.get_or_set(f'closest_driver:generation:{name}', time.time_ns, timeout = None)
+
+    def _bump(self, *names: str) -> None:
+        # A single cache write for all the generations.
+        version = time.time_ns()
+        self.cache.set_many({f'closest_driver:generation:{name}': version for name in names}, timeout = None)
+
+    def _target_buckets(self, search: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> Iterable[str]:
+        # A cached entry also answers the targets of its time quantum, so the range is widened by one quantum.
+        time_quantum = settings.CLOSEST_DRIVER_CACHE_TIME_QUANTUM
+        for bucket in range(self._bucket(start_datetime - time_quantum), self._bucket(end_datetime + time_quantum) + 1):
+            yield f'{search}:{bucket}'
+
+    def invalidate_orders(self, intervals: Iterable[tuple[datetime.datetime, datetime.datetime]]) -> None:
+        """Discard the searches whose result may depend on the orders picked up and ended on some (pickup_datetime,
+        end_datetime) intervals. Each target_datetime bucket is bumped once, however many orders overlap it."""
+        if not self.enabled:
+            return
+        names = set()
+        for pickup_datetime, end_datetime in intervals:
+            names.update(self._target_buckets(self.ORDERS, end_datetime, 
+                                              pickup_datetime + settings.MAX_TIMEDELTA_TO_SEARCH_CLOSEST_ORDER))
+            names.update(self._target_buckets(self.STARTING_ZONE, pickup_datetime + BUSY_GRACE, end_datetime))
+        if names:
+            self._bump(*names)
+
+    def invalidate_drivers(self) -> None:
+        """Discard the starting zone searches, after a driver position changed."""
+        if self.enabled:
+            self._bump('drivers')
+
+    def _key(self, search: str, index_generations: tuple, target_datetime: datetime.datetime,
+             lat: int, lng: int) -> str:
+        coordinates_quantum = settings.CLOSEST_DRIVER_CACHE_COORDINATES_QUANTUM
+        time_quantum = settings.CLOSEST_DRIVER_CACHE_TIME_QUANTUM
+        generations = [*index_generations, self._generation(f'{search}:{self._bucket(target_datetime)}')]
+        if search == self.STARTING_ZONE:
+            generations.append(self._generation('drivers'))
+        return ':'.join(map(str, [
+            'closest_driver', search, *generations, lat // coordinates_quantum, lng // coordinates_quantum,
+            (target_datetime - EPOCH) // time_quantum
+        ]))
+
+    def get_or_compute(self, search: str, index_generations: tuple, target_datetime: datetime.datetime, lat: int, lng: int,
+                       compute: Callable[[], tuple[Union[int, None], Union[datetime.datetime, None]]]) -> Union[int, None]:
+        """Returns the cached driver id of a search, or computes and caches it.
+
+        Args:
+        -----
+            search (str): ORDERS or STARTING_ZONE.
+            index_generations (tuple): The generations of the indexes used by the search.
+            target_datetime (datetime.datetime): The requested Order target datetime (aware).
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            compute (Callable): Runs the search. Returns the found driver id and the datetime until the 
+                result is valid (None if it does not expire with time).
+
+        Returns:
+        --------
+            Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        """
+        if not self.enabled:
+            return compute()[0]
+        key = self._key(search, index_generations, target_datetime, lat, lng)
+        # The driver id is cached with its expiration, so a cached None is told apart from a miss.
+        cached = self.cache.get(key)
+        if cached is not None and cached[1] is not None and datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) > cached[1]:
+            cached = None
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if cached is not None:
+            return cached[0]
+        selected_driver_id, valid_until = compute()
+        self.cache.set(key, (selected_driver_id, valid_until))
+        return selected_driver_id
+
+    def stats(self) -> dict:
+        """The hit and miss counters of this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None
+            }
+
+
+closest_driver_cache = ClosestDriverCache()
@@ -0,0 +1,592 @@
+import bisect
+import datetime
+import itertools
+import threading
+import time
+from typing import Iterable, Union
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from core.changes import get_last_table_change_id, get_table_change_batches, get_table_changes
+from core.models import Driver, Order
+from .intervals import BUSY_GRACE, IntervalSchedule
+
+
+# Unique number of each index build, shared by every index. It starts from the clock, so the builds
+# of different processes are told apart too.
+index_generations = itertools.count(time.time_ns())
+
+def to_aware_datetime(value: Union[datetime.datetime, str, None]) -> Union[datetime.datetime, None]:
+    """Normalize a datetime (or a datetime string, as received from the drivers feed) to an aware datetime.
+
+    Args:
+    -----
+        value (Union[datetime.datetime, str, None]): The value to normalize.
+
+    Returns:
+    --------
+        Union[datetime.datetime, None]: The aware datetime. None if the value can not be parsed.
+    """
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = value.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    return value
+
+
+# Sent by an index before it applies the rows changed outside of the signals of this process (written by another
+# process, or rolled back), found on the changes log of the table. The index still holds their previous values.
+# Arguments: sender (the model class), index, instances (the changed rows) and deleted_ids (the ids of the
+# deleted rows).
+index_changing = Signal()
+
+
+class ModelIndex:
+    """Base class of the process-local indexes used by the closest-driver search.
+
+    The indexes are kept in sync by the post_save and post_delete signals of their model (see
+    api.signals), and every write appends its rows to the changes log of the table (see
+    core.models.TableChange). On each lookup, the index applies the rows of the entries appended
+    since the last one it applied: the ones written by other processes are loaded from the database,
+    the ones of this process were already applied by the signals. The entries of this process stay
+    unconfirmed until their transaction commits, and the rolled back ones, missing from the log, are
+    loaded again. The index is only rebuilt after MATCHING_INDEX_MAX_AGE, as the orders that ended
+    are only dropped by a rebuild.
+
+    On SQLite the writes are serialized, so the entries are committed in the order of their ids. On a
+    database with concurrent writers, an entry committed after one with a higher id is only applied by
+    that rebuild.
+    """
+    model = None
+    # The changed rows loaded per query.
+    load_batch_size = 500
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # The last entry of the changes log applied on the index.
+        self._change_id = 0
+        # (Entry id, batch) -> row id of the changes of this process, not known to be committed yet.
+        self._local_changes: dict[tuple[int, int], Union[int, None]] = {}
+        # The (entry id, batch) of the committed changes of this process that the log was not read past yet.
+        self._confirmed_changes: set[tuple[int, int]] = set()
+        self._built_at = None
+        # Changes on every rebuild, so anything derived from a previous build can be discarded.
+        self.generation = None
+
+    def _clear(self) -> None:
+        pass
+
+    def _load(self) -> None:
+        raise NotImplementedError
+
+    def rebuild(self) -> None:
+        """Load the indexed rows from the database and rebuild the index."""
+        with self._lock:
+            self._clear()
+            # Read before the rows, so a write committed in between is applied on the next lookup too.
+            self._change_id = get_last_table_change_id(self.model)
+            self._confirmed_changes = set()
+            self._load()
+            self._built_at = timezone.now()
+            self.generation = next(index_generations)
+
+    def invalidate(self) -> None:
+        """Force a rebuild on the next lookup."""
+        with self._lock:
+            self._built_at = None
+
+    def track_local_changes(self, local_changes: dict[tuple[int, int], Union[int, None]]) -> None:
+        """Remember the entries of the changes log appended by a write of this process that was applied on the 
+        index, so their rows are not loaded again."""
+        with self._lock:
+            self._local_changes.update(local_changes)
+
+    def confirm_local_changes(self, change_keys: Iterable[tuple[int, int]]) -> None:
+        """Mark the entries of a write of this process, by (id, batch), as committed."""
+        with self._lock:
+            for change_key in change_keys:
+                if change_key in self._local_changes:
+                    del self._local_changes[change_key]
+                    if change_key[0] > self._change_id:
+                        self._confirmed_changes.add(change_key)
+
+    def _is_stale(self) -> bool:
+        return self._built_at is None or timezone.now() - self._built_at > settings.MATCHING_INDEX_MAX_AGE
+
+    def _sync_changes(self) -> None:
+        changed_row_ids = set()
+        if self._local_changes:
+            batches = get_table_change_batches(change_id for change_id, _ in self._local_changes)
+            in_transaction = connection.in_atomic_block
+            for (change_id, batch), row_id in list(self._local_changes.items()):
+                if batches.get(change_id) != batch:
+                    # Rolled back (or not committed yet by another thread): the row is loaded again. Its id
+                    # can be reused by another write, so the log is read again from there.
+                    changed_row_ids.add(row_id)
+                    del self._local_changes[(change_id, batch)]
+                    self._change_id = min(self._change_id, change_id - 1)
+                elif not in_transaction:
+                    del self._local_changes[(change_id, batch)]
+        changes = get_table_changes(self.model, self._change_id)
+        for change_id, row_id, batch in changes:
+            if (change_id, batch) in self._confirmed_changes:
+                self._confirmed_changes.discard((change_id, batch))
+            elif (change_id, batch) not in self._local_changes:
+                changed_row_ids.add(row_id)
+        if changes:
+            self._change_id = changes[-1][0]
+        if None in changed_row_ids:
+            # Rows whose ids are unknown were written.
+            self.rebuild()
+        elif changed_row_ids:
+            self._apply_changed_rows(sorted(changed_row_ids))
+
+    def _apply_changed_rows(self, row_ids: list[int]) -> None:
+        raise NotImplementedError
+
+    def ensure_fresh(self) -> None:
+        """Apply the rows changed outside of this process since the last lookup, or rebuild the index if it is too old."""
+        with self._lock:
+            if self._is_stale():
+                self.rebuild()
+            else:
+                self._sync_changes()
+
+    def remove(self, instance_id: int) -> None:
+        """Remove a row from the index."""
+        with self._lock:
+            if self._built_at is not None:
+                self._remove(instance_id)
+
+    def _remove(self, instance_id: int) -> None:
+        raise NotImplementedError
+
+
+class DriverModelIndex(ModelIndex):
+    """Base class of the indexes over the drivers positions."""
+    model = Driver
+
+    def _add(self, driver_id: int, lat: int, lng: int) -> None:
+        raise NotImplementedError
+
+    def indexed_position(self, driver_id: int) -> Union[tuple[int, int], None]:
+        """The (lat, lng) of a driver on the index. None if it is not indexed."""
+        raise NotImplementedError
+
+    def indexed_ids(self) -> list[int]:
+        """The ids of the indexed drivers, sorted."""
+        raise NotImplementedError
+
+    def _insert(self, driver_id: int, lat: int, lng: int) -> None:
+        self._remove(driver_id)
+        self._add(driver_id, lat, lng)
+
+    def _load(self) -> None:
+        for driver_id, lat, lng in Driver.objects.values_list('id', 'lat', 'lng').iterator():
+            self._insert(driver_id, lat, lng)
+
+    def update(self, driver: Driver) -> None:
+        """Insert or move a driver on the index."""
+        with self._lock:
+            if self._built_at is not None:
+                self._insert(driver.id, int(driver.lat), int(driver.lng))
+
+    def _apply_changed_rows(self, row_ids: list[int]) -> None:
+        drivers = []
+        for first in range(0, len(row_ids), self.load_batch_size):
+            drivers.extend(Driver(id = driver_id, lat = lat, lng = lng) for driver_id, lat, lng in 
+                           Driver.objects.filter(id__in = row_ids[first:first + self.load_batch_size]).values_list('id', 'lat', 'lng'))
+        deleted_ids = set(row_ids).difference(driver.id for driver in drivers)
+        # Only the rows whose indexed values change are reported (e.g. a rolled back write of this process
+        # that wrote the same values again is not).
+        drivers = [driver for driver in drivers if self.indexed_position(driver.id) != (int(driver.lat), int(driver.lng))]
+        deleted_ids = {driver_id for driver_id in deleted_ids if self.indexed_position(driver_id) is not None}
+        if not drivers and not deleted_ids:
+            return
+        index_changing.send(sender = Driver, index = self, instances = drivers, deleted_ids = deleted_ids)
+        for driver in drivers:
+            self._insert(driver.id, driver.lat, driver.lng)
+        for driver_id in deleted_ids:
+            self._remove(driver_id)
+
+
+class DriverGridIndex(DriverModelIndex):
+    """Process-local uniform grid over the drivers positions (integer lat and lng)."""
+
+    def __init__(self, cell_size: int = None):
+        super().__init__()
+        self._cell_size = cell_size
+        self._positions: dict[int, tuple[int, int]] = {}
+        self._cells: dict[tuple[int, int], set[int]] = {}
+        self._cell_bounds = None
+
+    @property
+    def cell_size(self) -> int:
+        return self._cell_size or settings.DRIVER_GRID_CELL_SIZE
+
+    def _cell(self, lat: int, lng: int) -> tuple[int, int]:
+        return (lat // self.cell_size, lng // self.cell_size)
+
+    def indexed_position(self, driver_id: int) -> Union[tuple[int, int], None]:
+        return self._positions.get(driver_id)
+
+    def indexed_ids(self) -> list[int]:
+        with self._lock:
+            return sorted(self._positions)
+
+    def _add(self, driver_id: int, lat: int, lng: int) -> None:
+        self._positions[driver_id] = (lat, lng)
+        cell = self._cell(lat, lng)
+        if cell not in self._cells:
+            self._cells[cell] = set()
+            self._cell_bounds = None
+        self._cells[cell].add(driver_id)
+
+    def _remove(self, driver_id: int) -> None:
+        position = self._positions.pop(driver_id, None)
+        if position is None:
+            return
+        cell = self._cell(*position)
+        cell_drivers = self._cells[cell]
+        cell_drivers.discard(driver_id)
+        if not cell_drivers:
+            del self._cells[cell]
+            self._cell_bounds = None
+
+    def _bounds(self) -> tuple[int, int, int, int]:
+        if self._cell_bounds is None:
+            cells_x = [cell[0] for cell in self._cells]
+            cells_y = [cell[1] for cell in self._cells]
+            self._cell_bounds = (min(cells_x), max(cells_x), min(cells_y), max(cells_y))
+        return self._cell_bounds
+
+    def _clear(self) -> None:
+        super()._clear()
+        self._positions = {}
+        self._cells = {}
+        self._cell_bounds = None
+
+    def closest(self, lat: int, lng: int, excluded_ids: Iterable[int] = ()) -> Union[int, None]:
+        """Expanding-ring search of the nearest (Manhattan distance) driver to a point.
+
+        Ties are resolved by the lowest driver id, as the full table scan did.
+
+        Args:
+        -----
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            excluded_ids (Iterable[int]): The ids of the drivers to skip (e.g. busy drivers).
+
+        Returns:
+        --------
+            Union[int, None]: The id of the closest driver. None if there are no selectable drivers.
+        """
+        excluded_ids = set(excluded_ids)
+        with self._lock:
+            if not self._cells:
+                return None
+            cell_size = self.cell_size
+            center_x, center_y = self._cell(lat, lng)
+            min_x, max_x, min_y, max_y = self._bounds()
+            # The farthest ring that can contain an occupied cell.
+            max_ring = max(center_x - min_x, max_x - center_x, center_y - min_y, max_y - center_y, 0)
+            best = None
+            for ring in range(max_ring + 1):
+                if 8 * ring > len(self._cells):
+                    # The ring is larger than the occupied cells, visit the remaining ones directly.
+                    cells = [cell for cell in self._cells
+                             if max(abs(cell[0] - center_x), abs(cell[1] - center_y)) >= ring]
+                else:
+                    cells = self._ring_cells(center_x, center_y, ring)
+                for cell in cells:
+                    for driver_id in self._cells.get(cell, ()):
+                        if driver_id in excluded_ids:
+                            continue
+                        driver_lat, driver_lng = self._positions[driver_id]
+                        candidate = (abs(driver_lat - lat) + abs(driver_lng - lng), driver_id)
+                        if best is None or candidate < best:
+                            best = candidate
+                if 8 * ring > len(self._cells):
+                    break
+                # Every driver out of this ring is at least ring * cell_size + 1 away.
+                if best is not None and best[0] <= ring * cell_size:
+                    break
+            return best[1] if best is not None else None
+
+    def within(self, lat: int, lng: int, max_distance: int) -> list[tuple[int, int]]:
+        """The drivers at a Manhattan distance of a point not greater than max_distance.
+
+        Returns:
+        --------
+            list[tuple[int, int]]: The (distance, id) of the drivers, sorted.
+        """
+        found = []
+        with self._lock:
+            if not self._cells:
+                return found
+            min_x, max_x, min_y, max_y = self._bounds()
+            first_x, first_y = self._cell(lat - max_distance, lng - max_distance)
+            last_x, last_y = self._cell(lat + max_distance, lng + max_distance)
+            for cell_x in range(max(first_x, min_x), min(last_x, max_x) + 1):
+                for cell_y in range(max(first_y, min_y), min(last_y, max_y) + 1):
+                    for driver_id in self._cells.get((cell_x, cell_y), ()):
+                        driver_lat, driver_lng = self._positions[driver_id]
+                        distance = abs(driver_lat - lat) + abs(driver_lng - lng)
+                        if distance <= max_distance:
+                            found.append((distance, driver_id))
+        return sorted(found)
+
+    @staticmethod
+    def _ring_cells(center_x: int, center_y: int, ring: int) -> Iterable[tuple[int, int]]:
+        if ring == 0:
+            yield (center_x, center_y)
+            return
+        for x in range(center_x - ring, center_x + ring + 1):
+            yield (x, center_y - ring)
+            yield (x, center_y + ring)
+        for y in range(center_y - ring + 1, center_y + ring):
+            yield (center_x - ring, y)
+            yield (center_x + ring, y)
+
+
+class OrderModelIndex(ModelIndex):
+    """Base class of the indexes over the upcoming orders.
+
+    Orders that ended before the index was built are never loaded, since they can not be matched
+    and their drivers are not busy anymore.
+    """
+    model = Order
+
+    def _insert(self, order_id: int, driver_id: int, pickup_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                delivery_lat: int, delivery_lng: int) -> None:
+        raise NotImplementedError
+
+    def indexed_interval(self, order_id: int) -> Union[tuple[datetime.datetime, datetime.datetime], None]:
+        """The (pickup_datetime, end_datetime) of an order on the index. None if it is not indexed."""
+        raise NotImplementedError
+
+    @staticmethod
+    def horizon() -> datetime.datetime:
+        """The lowest end_datetime of the indexed orders."""
+        return timezone.now()
+
+    def _load(self) -> None:
+        # The pickup_datetime limit is served by the (pickup_datetime) index, the end_datetime is checked on its rows.
+        horizon = self.horizon()
+        qs_upcoming_orders = Order.objects.filter(pickup_datetime__gte = horizon - settings.MAX_ORDER_DURATION, 
+                                                  end_datetime__gte = horizon).values_list(
+            'id', 'driver_id', 'pickup_datetime', 'end_datetime', 'delivery_lat', 'delivery_lng'
+        )
+        for order_id, driver_id, pickup_datetime, end_datetime, delivery_lat, delivery_lng in qs_upcoming_orders.iterator():
+            self._insert(order_id, driver_id, pickup_datetime, end_datetime, delivery_lat, delivery_lng)
+
+    def update(self, order: Order) -> None:
+        """Insert or move an order on the index."""
+        with self._lock:
+            if self._built_at is not None:
+                self._update(order)
+
+    def _update(self, order: Order) -> None:
+        self._remove(order.id)
+        pickup_datetime = to_aware_datetime(order.pickup_datetime)
+        end_datetime = to_aware_datetime(order.end_datetime)
+        if pickup_datetime is not None and end_datetime is not None and end_datetime >= self.horizon():
+            self._insert(order.id, order.driver_id, pickup_datetime, end_datetime,
+                         int(order.delivery_lat), int(order.delivery_lng))
+
+    def _apply_changed_rows(self, row_ids: list[int]) -> None:
+        fields = ['id', 'driver_id', 'pickup_datetime', 'end_datetime', 'delivery_lat', 'delivery_lng']
+        orders = []
+        for first in range(0, len(row_ids), self.load_batch_size):
+            orders.extend(Order(**dict(zip(fields, row))) for row in 
+                          Order.objects.filter(id__in = row_ids[first:first + self.load_batch_size]).values_list(*fields))
+        deleted_ids = set(row_ids).difference(order.id for order in orders)
+        # Only the rows whose indexed interval changes are reported, as in DriverModelIndex.
+        horizon = self.horizon()
+        orders = [order for order in orders if self.indexed_interval(order.id) != 
+                  ((order.pickup_datetime, order.end_datetime) if order.end_datetime >= horizon else None)]
+        deleted_ids = {order_id for order_id in deleted_ids if self.indexed_interval(order_id) is not None}
+        if not orders and not deleted_ids:
+            return
+        index_changing.send(sender = Order, index = self, instances = orders, deleted_ids = deleted_ids)
+        for order in orders:
+            self._update(order)
+        for order_id in deleted_ids:
+            self._remove(order_id)
+
+
+class OrderTimelineIndex(OrderModelIndex):
+    """Process-local timeline of the upcoming orders.
+
+    The orders are bucketed by pickup hour and, inside each bucket, by the grid cell of their
+    delivery coordinates. Each cell keeps its orders sorted by (pickup_datetime, id).
+    """
+    bucket_seconds = 3600
+
+    def __init__(self, cell_size: int = None):
+        super().__init__()
+        self._cell_size = cell_size
+        # Order id -> (bucket, cell, entry). Entry: (pickup_datetime, id, delivery_lat, delivery_lng, driver_id, end_datetime).
+        self._orders: dict[int, tuple] = {}
+        self._buckets: dict[int, dict[tuple[int, int], list[tuple]]] = {}
+
+    @property
+    def cell_size(self) -> int:
+        return self._cell_size or settings.ORDER_TIMELINE_CELL_SIZE
+
+    def _bucket(self, pickup_datetime: datetime.datetime) -> int:
+        return int(pickup_datetime.timestamp() // self.bucket_seconds)
+
+    def _insert(self, order_id: int, driver_id: int, pickup_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                delivery_lat: int, delivery_lng: int) -> None:
+        bucket = self._bucket(pickup_datetime)
+        cell = (delivery_lat // self.cell_size, delivery_lng // self.cell_size)
+        entry = (pickup_datetime, order_id, delivery_lat, delivery_lng, driver_id, end_datetime)
+        bisect.insort(self._buckets.setdefault(bucket, {}).setdefault(cell, []), entry)
+        self._orders[order_id] = (bucket, cell, entry)
+
+    def indexed_interval(self, order_id: int) -> Union[tuple[datetime.datetime, datetime.datetime], None]:
+        indexed = self._orders.get(order_id)
+        return (indexed[2][0], indexed[2][5]) if indexed is not None else None
+
+    def _remove(self, order_id: int) -> None:
+        indexed = self._orders.pop(order_id, None)
+        if indexed is None:
+            return
+        bucket, cell, entry = indexed
+        cells = self._buckets[bucket]
+        entries = cells[cell]
+        del entries[bisect.bisect_left(entries, entry)]
+        if not entries:
+            del cells[cell]
+            if not cells:
+                del self._buckets[bucket]
+
+    def _clear(self) -> None:
+        self._orders = {}
+        self._buckets = {}
+
+    def earliest(self, start_datetime: datetime.datetime, start_inclusive: bool, end_datetime: datetime.datetime, 
+                 lat: int, lng: int, max_distance: float = float('inf'), 
+                 excluded_driver_ids: Iterable[int] = ()) -> Union[tuple, None]:
+        """Search the earliest order, by (pickup_datetime, id), completed by end_datetime and delivered closer
+        than max_distance to a point.
+
+        Args:
+        -----
+            start_datetime (datetime.datetime): The lower pickup_datetime limit.
+            start_inclusive (bool): If the lower pickup_datetime limit is included.
+            end_datetime (datetime.datetime): The upper end_datetime limit (included).
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            max_distance (float): The Manhattan distance that the delivery coordinates must be under.
+            excluded_driver_ids (Iterable[int]): The ids of the drivers whose orders are skipped.
+
+        Returns:
+        --------
+            Union[tuple, None]: The found order as (pickup_datetime, id, delivery_lat, delivery_lng, driver_id, 
+                end_datetime). None if no order is found.
+        """
+        # (start,) sorts before any entry of that pickup_datetime and (start, inf) after all of them.
+        start_key = (start_datetime,) if start_inclusive else (start_datetime, float('inf'))
+        excluded_driver_ids = set(excluded_driver_ids)
+        cell_size = self.cell_size
+        with self._lock:
+            for bucket in range(self._bucket(start_datetime), self._bucket(end_datetime) + 1):
+                best = None
+                for (cell_x, cell_y), entries in self._buckets.get(bucket, {}).items():
+                    # Lowest distance from the point to the cell.
+                    gap_lat = max(cell_x * cell_size - lat, 0, lat - (cell_x * cell_size + cell_size - 1))
+                    gap_lng = max(cell_y * cell_size - lng, 0, lng - (cell_y * cell_size + cell_size - 1))
+                    if gap_lat + gap_lng >= max_distance:
+                        continue
+                    for position in range(bisect.bisect_left(entries, start_key), len(entries)):
+                        entry = entries[position]
+                        # An order that ends by end_datetime is picked up before it.
+                        if entry[0] > end_datetime or (best is not None and entry[:2] >= best[:2]):
+                            break
+                        if (abs(entry[2] - lat) + abs(entry[3] - lng) < max_distance and entry[5] <= end_datetime 
+                                and entry[4] not in excluded_driver_ids):
+                            best = entry
+                            break
+                # The buckets are visited in time order, so the first match is the earliest.
+                if best is not None:
+                    return best
+        return None
+
+
+class DriverAvailabilityIndex(OrderModelIndex):
+    """Process-local schedule of the upcoming orders of each driver.
+
+    The orders are kept twice: on a timeline sorted by (pickup_datetime, id), which answers the
+    drivers that are busy at a datetime, and on an IntervalSchedule per driver, which answers the
+    overlap, busy and free slots checks of a driver. Both are bisect lookups.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Order id -> (pickup_datetime, end_datetime, driver_id).
+        self._orders: dict[int, tuple[datetime.datetime, datetime.datetime, int]] = {}
+        # Entries: (pickup_datetime, id, driver_id, end_datetime).
+        self._timeline: list[tuple] = []
+        self._schedules: dict[int, IntervalSchedule] = {}
+        # The longest indexed order, which bounds the timeline range of the busy drivers lookup.
+        self._longest_duration = datetime.timedelta(0)
+
+    def _insert(self, order_id: int, driver_id: int, pickup_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                delivery_lat: int, delivery_lng: int) -> None:
+        self._orders[order_id] = (pickup_datetime, end_datetime, driver_id)
+        bisect.insort(self._timeline, (pickup_datetime, order_id, driver_id, end_datetime))
+        self._schedules.setdefault(driver_id, IntervalSchedule()).add(pickup_datetime, end_datetime, order_id)
+        self._longest_duration = max(self._longest_duration, end_datetime - pickup_datetime)
+
+    def indexed_interval(self, order_id: int) -> Union[tuple[datetime.datetime, datetime.datetime], None]:
+        indexed = self._orders.get(order_id)
+        return indexed[:2] if indexed is not None else None
+
+    def _remove(self, order_id: int) -> None:
+        indexed = self._orders.pop(order_id, None)
+        if indexed is None:
+            return
+        pickup_datetime, end_datetime, driver_id = indexed
+        del self._timeline[bisect.bisect_left(self._timeline, (pickup_datetime, order_id, driver_id, end_datetime))]
+        schedule = self._schedules[driver_id]
+        schedule.remove(pickup_datetime, end_datetime, order_id)
+        if not schedule:
+            del self._schedules[driver_id]
+
+    def _clear(self) -> None:
+        self._orders = {}
+        self._timeline = []
+        self._schedules = {}
+        self._longest_duration = datetime.timedelta(0)
+
+    def busy_driver_ids(self, target_datetime: datetime.datetime) -> set[int]:
+        """The ids of the drivers with an order picked up BUSY_GRACE or more before a datetime that has not ended."""
+        with self._lock:
+            first = bisect.bisect_left(self._timeline, (target_datetime - self._longest_duration,))
+            last = bisect.bisect_right(self._timeline, (target_datetime - BUSY_GRACE, float('inf')))
+            return {entry[2] for entry in self._timeline[first:last] if entry[3] >= target_datetime}
+
+    def next_free_datetime(self, driver_id: int, target_datetime: datetime.datetime) -> datetime.datetime:
+        """The first datetime, from target_datetime, when a driver is not busy (see IntervalSchedule.next_free_datetime)."""
+        with self._lock:
+            schedule = self._schedules.get(driver_id)
+            return schedule.next_free_datetime(target_datetime) if schedule is not None else target_datetime
+
+    def free_slots(self, driver_id: int, start_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                   duration: datetime.timedelta) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        """The pickup_datetime ranges of a driver where an order of a duration overlaps no other order
+        (see IntervalSchedule.free_slots)."""
+        with self._lock:
+            schedule = self._schedules.get(driver_id)
+            if schedule is None:
+                return [(start_datetime, end_datetime)] if start_datetime <= end_datetime else []
+            return schedule.free_slots(start_datetime, end_datetime, duration)
+
+
+driver_index = DriverGridIndex()
+order_index = OrderTimelineIndex()
+availability_index = DriverAvailabilityIndex()
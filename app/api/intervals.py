@@ -0,0 +1,113 @@
+import bisect
+import datetime
+import operator
+from typing import Iterable, Union
+from django.conf import settings
+
+
+# An order picked up in the last minute does not keep its driver busy yet.
+BUSY_GRACE = datetime.timedelta(minutes = 1)
+# The datetimes have seconds precision, so the nearest datetime after an interval is one second later.
+RESOLUTION = datetime.timedelta(seconds = 1)
+
+def get_busy_window(target_datetime: datetime.datetime) -> tuple[datetime.datetime, datetime.datetime]:
+    """The pickup_datetime limits (both included) of the orders that can keep a driver busy at a datetime.
+    Only the ones that end at target_datetime or later do."""
+    return target_datetime - settings.MAX_ORDER_DURATION, target_datetime - BUSY_GRACE
+
+
+class IntervalSchedule:
+    """Sorted-interval overlap index of the orders of a driver.
+
+    The intervals [start, end] (both included) are kept sorted by (start, key), next to the running
+    max of their ends. As the running max never decreases, "is there an interval that starts at or
+    before a datetime and ends at or after another one" is a bisect and a lookup: O(log n) once the
+    running max is up to date. A write is a bisect and a list insert or delete, O(n), and marks the
+    running max as outdated from its position: the next lookup recomputes it from there, O(n) too.
+    The schedule of a driver holds a few orders, so these lists stay short.
+    """
+
+    def __init__(self, intervals: Iterable[tuple[datetime.datetime, datetime.datetime, int]] = ()):
+        # Entries: (start, key, end).
+        self._entries = sorted((start, key, end) for start, end, key in intervals)
+        self._max_ends: list[datetime.datetime] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, start: datetime.datetime, end: datetime.datetime, key: int) -> None:
+        """Add the interval [start, end] of the order with id key."""
+        position = bisect.bisect_left(self._entries, (start, key))
+        self._entries.insert(position, (start, key, end))
+        del self._max_ends[position:]
+
+    def remove(self, start: datetime.datetime, end: datetime.datetime, key: int) -> None:
+        """Remove the interval [start, end] of the order with id key."""
+        position = bisect.bisect_left(self._entries, (start, key, end))
+        if position < len(self._entries) and self._entries[position] == (start, key, end):
+            del self._entries[position]
+            del self._max_ends[position:]
+
+    def _running_max_ends(self) -> list[datetime.datetime]:
+        max_ends = self._max_ends
+        for position in range(len(max_ends), len(self._entries)):
+            end = self._entries[position][2]
+            max_ends.append(max(max_ends[-1], end) if max_ends else end)
+        return max_ends
+
+    def latest_end(self, max_start: Union[datetime.datetime, None] = None) -> Union[datetime.datetime, None]:
+        """The latest end of the intervals that start at max_start or before (all of them by default).
+        None if there is no such interval."""
+        max_ends = self._running_max_ends()
+        count = len(max_ends) if max_start is None else bisect.bisect_right(self._entries, max_start, key = operator.itemgetter(0))
+        return max_ends[count - 1] if count else None
+
+    def covers(self, max_start: datetime.datetime, min_end: datetime.datetime) -> bool:
+        """If an interval starts at max_start or before and ends at min_end or after."""
+        latest_end = self.latest_end(max_start)
+        return latest_end is not None and latest_end >= min_end
+
+    def overlaps(self, start: datetime.datetime, end: datetime.datetime) -> bool:
+        """If an interval intersects [start, end] (both included)."""
+        return self.covers(end, start)
+
+    def is_busy(self, target_datetime: datetime.datetime) -> bool:
+        """If an interval started BUSY_GRACE or more before target_datetime and has not ended."""
+        return self.covers(target_datetime - BUSY_GRACE, target_datetime)
+
+    def next_free_datetime(self, target_datetime: datetime.datetime) -> datetime.datetime:
+        """The first datetime, from target_datetime, when is_busy is False."""
+        free_datetime = target_datetime
+        while (latest_end := self.latest_end(free_datetime - BUSY_GRACE)) is not None and latest_end >= free_datetime:
+            free_datetime = latest_end + RESOLUTION
+        return free_datetime
+
+    def free_slots(self, start_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                   duration: datetime.timedelta) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        """The ranges of starts, between two datetimes, of the new intervals of a duration that overlap no interval.
+
+        Args:
+        -----
+            start_datetime (datetime.datetime): The lower start limit (included).
+            end_datetime (datetime.datetime): The upper start limit (included).
+            duration (datetime.timedelta): The duration of the new interval.
+
+        Returns:
+        --------
+            list[tuple[datetime.datetime, datetime.datetime]]: The earliest and latest starts (both included)
+                of each range, in order.
+        """
+        slots = []
+        slot_start_datetime = start_datetime
+        # The intervals before the first running max that reaches start_datetime end before it.
+        first = bisect.bisect_left(self._running_max_ends(), start_datetime)
+        for interval_start, _, interval_end in self._entries[first:]:
+            if slot_start_datetime > end_datetime:
+                break
+            latest_start_datetime = interval_start - duration - RESOLUTION
+            if latest_start_datetime >= slot_start_datetime:
+                slots.append((slot_start_datetime, min(latest_start_datetime, end_datetime)))
+            slot_start_datetime = max(slot_start_datetime, interval_end + RESOLUTION)
+        if slot_start_datetime <= end_datetime:
+            slots.append((slot_start_datetime, end_datetime))
+        return slots
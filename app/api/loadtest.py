@@ -0,0 +1,258 @@
+import asyncio
+import datetime
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from core.models import Driver, DriverDailyOrderStats, DriverState, Order
+from core.signals import bulk_deleted, bulk_saved
+import requests
+from .metrics import percentile
+
+
+def is_error(response_status: Union[int, None]) -> bool:
+    """If a response is a failure. The API answers 500 when no driver is found or the driver is busy, 
+    so only the other 4xx and 5xx statuses are counted."""
+    return response_status is None or (response_status >= 400 and response_status != 500)
+
+def summarize(latencies: list[float], errors: int, elapsed_time: float) -> dict:
+    """The throughput and latency percentiles (in milliseconds) of a scenario."""
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / elapsed_time, 1) if elapsed_time else None,
+        'p50_ms': to_ms(percentile(latencies, 0.5)),
+        'p90_ms': to_ms(percentile(latencies, 0.9)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_ms': to_ms(latencies[-1] if latencies else None)
+    }
+
+
+class SyntheticDataset:
+    """A synthetic fleet and order book, written to the database and removed afterwards.
+
+    The orders are spread over the next `days` days, so the closest-driver searches and the
+    orders of a day have realistic sizes.
+    """
+
+    def __init__(self, drivers: int, orders: int, days: int = 7, seed: int = 0):
+        self.drivers = drivers
+        self.orders = orders
+        self.days = days
+        self.generator = random.Random(seed)
+        self.start_datetime = (datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+                               + datetime.timedelta(hours = 1))
+        self.feed_datetime = self.start_datetime
+        self.driver_ids: list[int] = []
+        self.order_ids: list[int] = []
+
+    def create(self, batch_size: int = 2000) -> None:
+        """Write the drivers and orders with bulk operations, one batch in memory at a time."""
+        generator = self.generator
+        for start in range(0, self.drivers, batch_size):
+            drivers = Driver.objects.bulk_create([
+                Driver(lat = generator.randint(0, 1000), lng = generator.randint(0, 1000), last_update = self.start_datetime)
+                for _ in range(min(batch_size, self.drivers - start))
+            ])
+            bulk_saved.send(sender = Driver, instances = drivers)
+            self.driver_ids.extend(driver.id for driver in drivers)
+        for start in range(0, self.orders, batch_size):
+            orders = Order.objects.bulk_create([
+                Order(driver_id = generator.choice(self.driver_ids), pickup_datetime = self.random_datetime(),
+                      pickup_lat = generator.randint(0, 1000), pickup_lng = generator.randint(0, 1000),
+                      delivery_lat = generator.randint(0, 1000), delivery_lng = generator.randint(0, 1000))
+                for _ in range(min(batch_size, self.orders - start))
+            ])
+            bulk_saved.send(sender = Order, instances = orders, created = True)
+            self.order_ids.extend(order.id for order in orders)
+
+    def delete(self, batch_size: int = 2000) -> None:
+        """Remove the drivers and every order assigned to them (also the ones scheduled by the scenarios).
+        Each batch is removed with one DELETE per table, without the per-row signals of QuerySet.delete, 
+        and a single bulk_deleted per model keeps the indexes, states and stats in sync."""
+        for start in range(0, len(self.driver_ids), batch_size):
+            driver_ids = self.driver_ids[start:start + batch_size]
+            with transaction.atomic():
+                orders = Order.objects.filter(driver_id__in = driver_ids)
+                deleted_orders = [Order(**row) for row in orders.values('id', 'driver_id', 'pickup_datetime', 'end_datetime')]
+                orders._raw_delete(orders.db)
+                bulk_deleted.send(sender = Order, instances = deleted_orders)
+                # The rows of the drivers on the tables without signals, deleted by the cascade otherwise.
+                DriverState.objects.filter(driver_id__in = driver_ids).delete()
+                DriverDailyOrderStats.objects.filter(driver_id__in = driver_ids).delete()
+                drivers = Driver.objects.filter(id__in = driver_ids)
+                drivers._raw_delete(drivers.db)
+                bulk_deleted.send(sender = Driver, instances = [Driver(id = driver_id) for driver_id in driver_ids])
+
+    def random_datetime(self) -> datetime.datetime:
+        return self.start_datetime + datetime.timedelta(minutes = self.generator.randint(0, self.days * 24 * 60))
+
+    def closest_driver_request(self) -> tuple[str, str, dict]:
+        """A random get_closest_driver request: (method, path, JSON body)."""
+        target_datetime = self.random_datetime().strftime(settings.DEFAULT_DATETIME_FORMAT)
+        return 'POST', 'get_closest_driver/', {
+            'target_datetime': target_datetime, 'lat': self.generator.randint(0, 1000), 'lng': self.generator.randint(0, 1000)
+        }
+
+    def schedule_order_request(self) -> tuple[str, str, dict]:
+        """A random schedule_order request: (method, path, JSON body). Some of them hit a busy driver."""
+        generator = self.generator
+        return 'POST', 'schedule_order/', {
+            'driver': generator.choice(self.driver_ids),
+            'pickup_datetime': self.random_datetime().strftime(settings.DEFAULT_DATETIME_FORMAT),
+            'pickup_lat': generator.randint(0, 1000), 'pickup_lng': generator.randint(0, 1000),
+            'delivery_lat': generator.randint(0, 1000), 'delivery_lng': generator.randint(0, 1000)
+        }
+
+    def drivers_feed(self, moved_fraction: float = 0.5) -> str:
+        """A drivers location feed (JSON text) of the synthetic fleet, where a fraction of the drivers moved.
+        The moved drivers are one second newer on every call, so they are saved; the others are unchanged."""
+        generator = self.generator
+        self.feed_datetime += datetime.timedelta(seconds = 1)
+        drivers = []
+        for driver_id in self.driver_ids:
+            if generator.random() < moved_fraction:
+                drivers.append({'id': driver_id, 'lat': generator.randint(0, 1000), 'lng': generator.randint(0, 1000),
+                                'lastUpdate': self.feed_datetime.isoformat()})
+            else:
+                drivers.append({'id': driver_id, 'lat': 0, 'lng': 0, 'lastUpdate': self.start_datetime.isoformat()})
+        return json.dumps({'alfreds': drivers})
+
+    def filter_orders_request(self) -> tuple[str, str, dict]:
+        """A random filter_orders request of a day, first page: (method, path, query parameters)."""
+        date_str = self.random_datetime().strftime(settings.DEFAULT_DATE_FORMAT)
+        return 'GET', f'filter_orders/{date_str}/', {'page_size': 100}
+
+
+async def call_asgi(application, method: str, path: str, data: dict) -> int:
+    """Run a request through an ASGI application, in process. Returns the response status."""
+    body = json.dumps(data).encode() if method == 'POST' else b''
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method, 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': urlencode(data).encode() if method == 'GET' else b'',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80)
+    }
+    response_status = None
+
+    async def receive() -> dict:
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message: dict) -> None:
+        nonlocal response_status
+        if message['type'] == 'http.response.start':
+            response_status = message['status']
+
+    await application(scope, receive, send)
+    return response_status
+
+async def run_asgi_scenario(application, make_request: Callable[[], tuple[str, str, dict]], path_prefix: str,
+                            total_requests: int, concurrency: int) -> dict:
+    """Send total_requests requests through an ASGI application, concurrency at a time.
+
+    Args:
+    -----
+        application: The ASGI application.
+        make_request (Callable[[], tuple[str, str, dict]]): Returns the (method, path, data) of a request.
+        path_prefix (str): The prefix of the request paths (e.g. '/api/' or '/api/async/').
+        total_requests (int): The requests of the scenario.
+        concurrency (int): The requests in flight at once.
+
+    Returns:
+    --------
+        dict: The throughput and latency percentiles.
+    """
+    requests_to_send = [make_request() for _ in range(total_requests)]
+    latencies = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        while requests_to_send:
+            method, path, data = requests_to_send.pop()
+            start_time = time.perf_counter()
+            response_status = await call_asgi(application, method, path_prefix + path, data)
+            latencies.append(time.perf_counter() - start_time)
+            errors += is_error(response_status)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start_time)
+
+def run_http_scenario(base_url: str, make_request: Callable[[], tuple[str, str, dict]], path_prefix: str,
+                      total_requests: int, concurrency: int) -> dict:
+    """Send total_requests requests to a running server, concurrency at a time (one thread each).
+
+    Args:
+    -----
+        base_url (str): The server url (e.g. 'http://localhost:8080').
+        make_request (Callable[[], tuple[str, str, dict]]): Returns the (method, path, data) of a request.
+        path_prefix (str): The prefix of the request paths (e.g. '/api/' or '/api/async/').
+        total_requests (int): The requests of the scenario.
+        concurrency (int): The requests in flight at once.
+
+    Returns:
+    --------
+        dict: The throughput and latency percentiles.
+    """
+    requests_to_send = [make_request() for _ in range(total_requests)]
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize = concurrency))
+
+    def send(request: tuple[str, str, dict]) -> tuple[float, bool]:
+        method, path, data = request
+        start_time = time.perf_counter()
+        try:
+            if method == 'POST':
+                response = session.post(base_url + path_prefix + path, json = data)
+            else:
+                response = session.get(base_url + path_prefix + path, params = data)
+            failed = is_error(response.status_code)
+        except requests.RequestException:
+            failed = True
+        return time.perf_counter() - start_time, failed
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        results = list(executor.map(send, requests_to_send))
+    return summarize([latency for latency, _ in results], sum(failed for _, failed in results),
+                     time.perf_counter() - start_time)
+
+def run_measured_scenario(call: Callable[[], bool], total_runs: int) -> dict:
+    """Run a call total_runs times, one at a time in this thread, measuring its latency and database queries.
+
+    Args:
+    -----
+        call (Callable[[], bool]): Runs the measured operation once. Returns if it failed.
+        total_runs (int): The runs of the scenario.
+
+    Returns:
+    --------
+        dict: The throughput, latency percentiles and queries per run.
+    """
+    latencies = []
+    query_counts = []
+    errors = 0
+    start_time = time.perf_counter()
+    for _ in range(total_runs):
+        with CaptureQueriesContext(connection) as queries:
+            call_start_time = time.perf_counter()
+            errors += call()
+            latencies.append(time.perf_counter() - call_start_time)
+        query_counts.append(len(queries))
+    summary = summarize(latencies, errors, time.perf_counter() - start_time)
+    summary.update({
+        'queries_total': sum(query_counts),
+        'queries_per_run': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+        'queries_max': max(query_counts, default = None)
+    })
+    return summary
@@ -0,0 +1,89 @@
+import json
+import platform
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from api.loadtest import SyntheticDataset, is_error, run_measured_scenario
+from core.cron import sync_drivers_location_in_chunks
+from core.feed import iter_feed_drivers
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the API endpoints and the drivers location sync on a synthetic fleet and order book. "
+            "Reports the throughput, latency percentiles and database queries of each scenario as JSON, "
+            "so the results of two revisions can be compared. The synthetic rows are removed afterwards.")
+
+    SCENARIOS = ('schedule_order', 'filter_orders', 'get_closest_driver', 'sync_drivers_location')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type = int, default = 1000, help = "Drivers of the synthetic fleet.")
+        parser.add_argument('--orders', type = int, default = 10000, 
+                            help = "Orders of the synthetic order book (e.g. 10000 to 1000000).")
+        parser.add_argument('--days', type = int, default = 7, help = "Days the orders are spread over.")
+        parser.add_argument('--requests', type = int, default = 500, help = "Requests of each endpoint scenario.")
+        parser.add_argument('--syncs', type = int, default = 5, help = "Runs of the drivers location sync scenario.")
+        parser.add_argument('--moved-fraction', type = float, default = 0.5, 
+                            help = "Fraction of the drivers that moved on each synced feed.")
+        parser.add_argument('--scenarios', nargs = '+', choices = self.SCENARIOS, default = list(self.SCENARIOS),
+                            help = "Scenarios to run.")
+        parser.add_argument('--seed', type = int, default = 0, help = "Seed of the dataset and the requests.")
+        parser.add_argument('--output', help = "File where the JSON report is also written.")
+        parser.add_argument('--keep', action = 'store_true', help = "Keep the synthetic rows on the database.")
+
+    def endpoint_call(self, client: Client, make_request):
+        """A call that sends a random request of an endpoint through the Django test client."""
+        def call() -> bool:
+            method, path, data = make_request()
+            if method == 'POST':
+                response = client.post('/api/' + path, data, content_type = 'application/json')
+            else:
+                response = client.get('/api/' + path, data)
+            return is_error(response.status_code)
+        return call
+
+    def sync_call(self, dataset: SyntheticDataset, moved_fraction: float):
+        """A call that syncs a synthetic drivers location feed, as the cron job does."""
+        def call() -> bool:
+            feed = dataset.drivers_feed(moved_fraction)
+            read_size = settings.DRIVERS_FEED_READ_SIZE
+            chunks = (feed[start:start + read_size] for start in range(0, len(feed), read_size))
+            sync_drivers_location_in_chunks(iter_feed_drivers(chunks))
+            return False
+        return call
+
+    def handle(self, *args, **options):
+        if options['drivers'] < 1 or options['orders'] < 0:
+            raise CommandError("At least one driver is needed.")
+        dataset = SyntheticDataset(options['drivers'], options['orders'], days = options['days'], seed = options['seed'])
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'closest_driver_engine': settings.CLOSEST_DRIVER_ENGINE,
+                'closest_driver_cache': settings.CLOSEST_DRIVER_CACHE
+            },
+            'dataset': {name: options[name] for name in ('drivers', 'orders', 'days', 'seed')},
+            'scenarios': {}
+        }
+        client = Client()
+        calls = {
+            'schedule_order': (self.endpoint_call(client, dataset.schedule_order_request), options['requests']),
+            'filter_orders': (self.endpoint_call(client, dataset.filter_orders_request), options['requests']),
+            'get_closest_driver': (self.endpoint_call(client, dataset.closest_driver_request), options['requests']),
+            'sync_drivers_location': (self.sync_call(dataset, options['moved_fraction']), options['syncs'])
+        }
+        dataset.create()
+        try:
+            for name in self.SCENARIOS:
+                if name in options['scenarios']:
+                    call, total_runs = calls[name]
+                    report['scenarios'][name] = run_measured_scenario(call, total_runs)
+        finally:
+            if not options['keep']:
+                dataset.delete()
+        content = json.dumps(report, indent = 2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(content)
+        self.stdout.write(content)
@@ -0,0 +1,66 @@
+import datetime
+import json
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from core.models import Driver, Order
+from api.serializers import DriverSerializer, OrderSerializer
+from api.serializers import driver_values_serializer, order_values_serializer
+
+
+class Command(BaseCommand):
+    help = ("Measure the rows per second of the list serializers against the values fast path. "
+            "The synthetic rows are written in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type = int, default = 10000, help = "Orders (and drivers) to serialize.")
+        parser.add_argument('--repeat', type = int, default = 3, help = "Runs of each serializer, the best one is kept.")
+        parser.add_argument('--seed', type = int, default = 0, help = "Seed of the synthetic rows.")
+
+    def measure(self, serialize, repeat: int) -> tuple[float, bytes]:
+        """The best time of a serialization, rendered to JSON, and its output."""
+        best_time = float('inf')
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            content = JSONRenderer().render(serialize())
+            best_time = min(best_time, time.perf_counter() - start_time)
+        return best_time, content
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        generator = random.Random(options['seed'])
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        results = {}
+        with transaction.atomic():
+            drivers = Driver.objects.bulk_create([
+                Driver(lat = generator.randint(0, 100), lng = generator.randint(0, 100), 
+                       last_update = now - datetime.timedelta(seconds = generator.randint(0, 3600)))
+                for _ in range(rows)
+            ])
+            Order.objects.bulk_create([
+                Order(driver = generator.choice(drivers), 
+                      pickup_datetime = now + datetime.timedelta(minutes = generator.randint(0, 60 * 24 * 30)), 
+                      pickup_lat = generator.randint(0, 100), pickup_lng = generator.randint(0, 100), 
+                      delivery_lat = generator.randint(0, 100), delivery_lng = generator.randint(0, 100))
+                for _ in range(rows)
+            ])
+            benchmarks = {
+                'drivers': (Driver.objects.order_by('id'), DriverSerializer, driver_values_serializer),
+                'orders': (Order.objects.order_by('id'), OrderSerializer, order_values_serializer)
+            }
+            for name, (queryset, serializer_class, values_serializer) in benchmarks.items():
+                serializer_time, serializer_content = self.measure(
+                    lambda: serializer_class(queryset.all(), many = True).data, repeat)
+                values_time, values_content = self.measure(lambda: values_serializer.data(queryset.all()), repeat)
+                results[name] = {
+                    'rows': rows,
+                    'serializer_rows_per_second': round(rows / serializer_time),
+                    'values_rows_per_second': round(rows / values_time),
+                    'speedup': round(serializer_time / values_time, 2),
+                    'identical_json': serializer_content == values_content
+                }
+            transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results))
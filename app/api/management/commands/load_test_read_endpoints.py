@@ -0,0 +1,41 @@
+import asyncio
+import json
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from api.loadtest import SyntheticDataset, run_asgi_scenario, run_http_scenario
+
+
+class Command(BaseCommand):
+    help = ("Compare the throughput and latency percentiles of the sync and async versions of the read "
+            "endpoints (get_closest_driver and filter_orders) on the same synthetic dataset. By default the "
+            "requests run in process through the ASGI application; with --base-url, against a running server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type = int, default = 1000, help = "Drivers of the synthetic dataset.")
+        parser.add_argument('--orders', type = int, default = 20000, help = "Orders of the synthetic dataset.")
+        parser.add_argument('--requests', type = int, default = 1000, help = "Requests of each scenario.")
+        parser.add_argument('--concurrency', type = int, default = 32, help = "Requests in flight at once.")
+        parser.add_argument('--seed', type = int, default = 0, help = "Seed of the dataset and the requests.")
+        parser.add_argument('--base-url', help = "Url of a running server (e.g. http://localhost:8080).")
+        parser.add_argument('--keep', action = 'store_true', help = "Keep the synthetic dataset on the database.")
+
+    def handle(self, *args, **options):
+        dataset = SyntheticDataset(options['drivers'], options['orders'], seed = options['seed'])
+        dataset.create()
+        results = {}
+        try:
+            application = get_asgi_application()
+            for endpoint, make_request in (('get_closest_driver', dataset.closest_driver_request),
+                                           ('filter_orders', dataset.filter_orders_request)):
+                for mode, path_prefix in (('sync', '/api/'), ('async', '/api/async/')):
+                    if options['base_url']:
+                        summary = run_http_scenario(options['base_url'], make_request, path_prefix, 
+                                                    options['requests'], options['concurrency'])
+                    else:
+                        summary = asyncio.run(run_asgi_scenario(application, make_request, path_prefix, 
+                                                                options['requests'], options['concurrency']))
+                    results[f'{endpoint}:{mode}'] = summary
+        finally:
+            if not options['keep']:
+                dataset.delete()
+        self.stdout.write(json.dumps(results))
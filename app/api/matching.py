@@ -0,0 +1,344 @@
+import datetime
+from typing import Iterable, Union
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, QuerySet
+from django.db.models.functions import Abs
+from core.models import DriverState, Order
+from core.states import EPOCH, to_microseconds
+from .indexes import DriverModelIndex, OrderModelIndex
+from .intervals import BUSY_GRACE, get_busy_window
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+class DriverArrays(DriverModelIndex):
+    """The drivers positions as contiguous NumPy arrays, sorted by driver id.
+
+    The rows are kept on a dict by the signals and the arrays are rebuilt from it on the
+    next lookup after a change.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._rows: dict[int, tuple[int, int]] = {}
+        self._arrays = None
+
+    def indexed_position(self, driver_id: int) -> Union[tuple[int, int], None]:
+        return self._rows.get(driver_id)
+
+    def indexed_ids(self) -> list[int]:
+        with self._lock:
+            return sorted(self._rows)
+
+    def _add(self, driver_id: int, lat: int, lng: int) -> None:
+        self._rows[driver_id] = (lat, lng)
+        self._arrays = None
+
+    def _remove(self, driver_id: int) -> None:
+        if self._rows.pop(driver_id, None) is not None:
+            self._arrays = None
+
+    def _clear(self) -> None:
+        super()._clear()
+        self._rows = {}
+        self._arrays = None
+
+    def arrays(self) -> tuple:
+        """Returns the (ids, lats, lngs) arrays."""
+        with self._lock:
+            if self._arrays is None:
+                driver_ids = sorted(self._rows)
+                positions = np.array([self._rows[driver_id] for driver_id in driver_ids], dtype = np.int64).reshape(-1, 2)
+                self._arrays = (np.array(driver_ids, dtype = np.int64), positions[:, 0].copy(), positions[:, 1].copy())
+            return self._arrays
+
+
+class OrderArrays(OrderModelIndex):
+    """The upcoming orders as contiguous NumPy arrays, sorted by (pickup_datetime, id).
+
+    The pickup and end datetimes are stored as microseconds from the epoch.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._rows: dict[int, tuple[int, int, int, int, int]] = {}
+        self._arrays = None
+
+    def _insert(self, order_id: int, driver_id: int, pickup_datetime: datetime.datetime, end_datetime: datetime.datetime,
+                delivery_lat: int, delivery_lng: int) -> None:
+        self._rows[order_id] = (to_microseconds(pickup_datetime), delivery_lat, delivery_lng, driver_id, 
+                                to_microseconds(end_datetime))
+        self._arrays = None
+
+    def indexed_interval(self, order_id: int) -> Union[tuple[datetime.datetime, datetime.datetime], None]:
+        row = self._rows.get(order_id)
+        if row is None:
+            return None
+        return EPOCH + datetime.timedelta(microseconds = row[0]), EPOCH + datetime.timedelta(microseconds = row[4])
+
+    def _remove(self, order_id: int) -> None:
+        if self._rows.pop(order_id, None) is not None:
+            self._arrays = None
+
+    def _clear(self) -> None:
+        super()._clear()
+        self._rows = {}
+        self._arrays = None
+
+    def arrays(self) -> tuple:
+        """Returns the (pickups, delivery_lats, delivery_lngs, driver_ids, ends) arrays."""
+        with self._lock:
+            if self._arrays is None:
+                order_ids = np.fromiter(self._rows.keys(), dtype = np.int64, count = len(self._rows))
+                rows = np.array(list(self._rows.values()), dtype = np.int64).reshape(-1, 5)
+                order = np.lexsort((order_ids, rows[:, 0]))
+                rows = rows[order]
+                self._arrays = tuple(rows[:, column].copy() for column in range(5))
+            return self._arrays
+
+
+class NumpyMatchingEngine:
+    """Vectorized closest-driver selection over the drivers and orders arrays.
+
+    It implements the same rules as api.utils, so both engines return the same driver ids.
+    """
+
+    def __init__(self):
+        self.drivers = DriverArrays()
+        self.orders = OrderArrays()
+
+    def closest_driver_by_orders(self, start_datetime: datetime.datetime, start_inclusive: bool,
+                                 end_datetime: datetime.datetime, lat: int, lng: int, 
+                                 excluded_driver_ids: Iterable[int] = (), refresh: bool = True) -> Union[int, None]:
+        """Search nearby drivers by orders coordinates and datetime.
+
+        Args:
+        -----
+            start_datetime (datetime.datetime): The lower pickup_datetime limit of the first selected order.
+            start_inclusive (bool): If the lower pickup_datetime limit is included.
+            end_datetime (datetime.datetime): The upper end_datetime limit (included).
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            excluded_driver_ids (Iterable[int]): The ids of the drivers whose orders are skipped.
+            refresh (bool): If the arrays must be checked against the database first.
+
+        Returns:
+        --------
+            Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        """
+        if refresh:
+            self.orders.ensure_fresh()
+        pickups, delivery_lats, delivery_lngs, driver_ids, ends = self.orders.arrays()
+        first, last = self._window(pickups, start_datetime, start_inclusive, end_datetime)
+        distances = np.abs(delivery_lats[first:last] - lat) + np.abs(delivery_lngs[first:last] - lng)
+        window_pickups = pickups[first:last]
+        # The orders that end after end_datetime are skipped, as the ones of the excluded drivers.
+        skipped = ends[first:last] > to_microseconds(end_datetime)
+        if excluded_driver_ids:
+            skipped |= np.isin(driver_ids[first:last], list(excluded_driver_ids))
+        distances[skipped] = np.iinfo(np.int64).max
+        # Each step selects the first (by pickup_datetime, id) order closer than the last selected one,
+        # then moves after every order that shares its pickup_datetime.
+        selected = None
+        position = 0
+        while position < len(distances):
+            closer = distances[position:] < (distances[selected] if selected is not None else np.iinfo(np.int64).max)
+            if not closer.any():
+                break
+            selected = position + int(np.argmax(closer))
+            position = int(np.searchsorted(window_pickups, window_pickups[selected], side = 'right'))
+        return int(driver_ids[first + selected]) if selected is not None else None
+
+    def closest_driver_by_starting_zone(self, lat: int, lng: int, target_datetime: datetime.datetime,
+                                        excluded_driver_ids: Iterable[int] = (), refresh: bool = True) -> Union[int, None]:
+        """Search for a driver by initial zone coordinates excluding busy drivers.
+
+        Args:
+        -----
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            target_datetime (datetime.datetime): The datetime when the drivers must not be busy.
+            excluded_driver_ids (Iterable[int]): The ids of other drivers to skip.
+            refresh (bool): If the arrays must be checked against the database first.
+
+        Returns:
+        --------
+            Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        """
+        if refresh:
+            self.orders.ensure_fresh()
+            self.drivers.ensure_fresh()
+        pickups, _, _, order_driver_ids, ends = self.orders.arrays()
+        busy_start_datetime, busy_end_datetime = get_busy_window(target_datetime)
+        first, last = self._window(pickups, busy_start_datetime, True, busy_end_datetime)
+        # The active orders are the ones of the window that have not ended.
+        active = ends[first:last] >= to_microseconds(target_datetime)
+        driver_ids, lats, lngs = self.drivers.arrays()
+        available = ~np.isin(driver_ids, order_driver_ids[first:last][active])
+        if excluded_driver_ids:
+            available &= ~np.isin(driver_ids, list(excluded_driver_ids))
+        if not available.any():
+            return None
+        distances = np.abs(lats - lat) + np.abs(lngs - lng)
+        distances[~available] = np.iinfo(np.int64).max
+        # The drivers are sorted by id, so argmin resolves the ties by the lowest id.
+        return int(driver_ids[int(np.argmin(distances))])
+
+    @staticmethod
+    def _window(pickups, start_datetime: datetime.datetime, start_inclusive: bool, 
+                end_datetime: datetime.datetime) -> tuple[int, int]:
+        # The positions of the orders picked up from start_datetime to end_datetime (included).
+        side = 'left' if start_inclusive else 'right'
+        first = int(np.searchsorted(pickups, to_microseconds(start_datetime), side = side))
+        last = int(np.searchsorted(pickups, to_microseconds(end_datetime), side = 'right'))
+        return first, last
+
+    def earliest_pickup_datetime(self, start_datetime: datetime.datetime, start_inclusive: bool,
+                                 end_datetime: datetime.datetime) -> Union[datetime.datetime, None]:
+        """The earliest pickup_datetime of the orders picked up after start_datetime and completed by end_datetime. 
+        None if there is no order."""
+        pickups, _, _, _, ends = self.orders.arrays()
+        first, last = self._window(pickups, start_datetime, start_inclusive, end_datetime)
+        completed = np.flatnonzero(ends[first:last] <= to_microseconds(end_datetime))
+        if not len(completed):
+            return None
+        return EPOCH + datetime.timedelta(microseconds = int(pickups[first + int(completed[0])]))
+
+    def ensure_fresh(self) -> None:
+        """Check the drivers and orders arrays against the database."""
+        self.drivers.ensure_fresh()
+        self.orders.ensure_fresh()
+
+
+class DatabaseMatchingEngine:
+    """Closest-driver selection ranked by the database: the Manhattan distance is annotated with ORM expressions
+    and each lookup returns one row, so nothing is kept in memory.
+
+    It implements the same rules as api.utils, so both engines return the same driver ids.
+    """
+
+    @staticmethod
+    def _distance(lat_field: str, lng_field: str, lat: int, lng: int):
+        return Abs(F(lat_field) - lat) + Abs(F(lng_field) - lng)
+
+    def _window(self, start_datetime: datetime.datetime, start_inclusive: bool, 
+                end_datetime: datetime.datetime, excluded_driver_ids: Iterable[int]) -> QuerySet:
+        # The orders completed by end_datetime, served by the (pickup_datetime) index: they are picked up before it.
+        start_lookup = 'pickup_datetime__gte' if start_inclusive else 'pickup_datetime__gt'
+        queryset = Order.objects.filter(**{start_lookup: start_datetime}, pickup_datetime__lte = end_datetime, 
+                                        end_datetime__lte = end_datetime)
+        if excluded_driver_ids:
+            queryset = queryset.exclude(driver_id__in = set(excluded_driver_ids))
+        return queryset
+
+    @staticmethod
+    def is_busy(schedule: Union[list, None], target_datetime: datetime.datetime) -> bool:
+        """If a driver is busy at a datetime, read from the schedule of its DriverState: one of its orders
+        was picked up BUSY_GRACE or more before target_datetime and has not ended."""
+        target = to_microseconds(target_datetime)
+        last_pickup = target - BUSY_GRACE // datetime.timedelta(microseconds = 1)
+        for pickup, end in schedule or ():
+            if pickup > last_pickup:
+                return False
+            if end >= target:
+                return True
+        return False
+
+    def closest_driver_by_orders(self, start_datetime: datetime.datetime, start_inclusive: bool,
+                                 end_datetime: datetime.datetime, lat: int, lng: int, 
+                                 excluded_driver_ids: Iterable[int] = ()) -> Union[int, None]:
+        """Search nearby drivers by orders coordinates and datetime.
+
+        The closest order is selected, the earliest one on ties. Like the sequential selection of api.utils,
+        it is skipped when an order picked up at the same time, with a lower id, comes first: that case is 
+        checked on the same query and answered by stepping through the selected orders.
+
+        Args:
+        -----
+            start_datetime (datetime.datetime): The lower pickup_datetime limit of the first selected order.
+            start_inclusive (bool): If the lower pickup_datetime limit is included.
+            end_datetime (datetime.datetime): The upper end_datetime limit (included).
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            excluded_driver_ids (Iterable[int]): The ids of the drivers whose orders are skipped.
+
+        Returns:
+        --------
+            Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        """
+        window = self._window(start_datetime, start_inclusive, end_datetime, excluded_driver_ids)
+        distance = self._distance('delivery_lat', 'delivery_lng', lat, lng)
+        closest = window.annotate(
+            distance = distance,
+            preceded = Exists(window.filter(pickup_datetime = OuterRef('pickup_datetime'), id__lt = OuterRef('id')))
+        ).order_by('distance', 'pickup_datetime', 'id').values_list('driver_id', 'preceded').first()
+        if closest is None or not closest[1]:
+            return closest[0] if closest is not None else None
+        # Each step selects the first (by pickup_datetime, id) order closer than the last selected one,
+        # then moves after every order that shares its pickup_datetime.
+        selected_driver_id = None
+        closest_distance = None
+        while True:
+            queryset = window.annotate(distance = distance)
+            if closest_distance is not None:
+                queryset = queryset.filter(distance__lt = closest_distance)
+            order = queryset.order_by('pickup_datetime', 'id').values_list('pickup_datetime', 'distance', 'driver_id').first()
+            if order is None:
+                return selected_driver_id
+            pickup_datetime, closest_distance, selected_driver_id = order
+            window = self._window(pickup_datetime, False, end_datetime, excluded_driver_ids)
+
+    def closest_driver_by_starting_zone(self, lat: int, lng: int, target_datetime: datetime.datetime,
+                                        excluded_driver_ids: Iterable[int] = ()) -> Union[int, None]:
+        """Search for a driver by initial zone coordinates excluding busy drivers, on the DriverState table.
+
+        The drivers are first searched on a square of DATABASE_ENGINE_SEARCH_RADIUS around the point, served
+        by the (lat, lng) index. A driver found at that distance or closer is the closest one, otherwise the
+        search is repeated without the square. The drivers are read by distance until one is not busy on the
+        schedule of its state.
+
+        Args:
+        -----
+            lat (int): Latitude coordinates.
+            lng (int): Longitude coordinates.
+            target_datetime (datetime.datetime): The datetime when the drivers must not be busy.
+            excluded_driver_ids (Iterable[int]): The ids of other drivers to skip.
+
+        Returns:
+        --------
+            Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        """
+        queryset = DriverState.objects.all()
+        if excluded_driver_ids:
+            queryset = queryset.exclude(driver_id__in = set(excluded_driver_ids))
+        queryset = queryset.annotate(distance = self._distance('lat', 'lng', lat, lng)).order_by('distance', 'driver_id')
+
+        def first_free(queryset: QuerySet) -> Union[tuple[int, int], None]:
+            for driver_id, distance, schedule in queryset.values_list('driver_id', 'distance', 'schedule').iterator():
+                if not self.is_busy(schedule, target_datetime):
+                    return driver_id, distance
+            return None
+
+        radius = settings.DATABASE_ENGINE_SEARCH_RADIUS
+        closest = first_free(queryset.filter(lat__gte = lat - radius, lat__lte = lat + radius, 
+                                             lng__gte = lng - radius, lng__lte = lng + radius))
+        if closest is not None and closest[1] <= radius:
+            return closest[0]
+        closest = first_free(queryset)
+        return closest[0] if closest is not None else None
+
+
+numpy_engine = NumpyMatchingEngine() if np is not None else None
+database_engine = DatabaseMatchingEngine()
+
+def use_numpy_engine() -> bool:
+    """If the closest-driver search must use the NumPy matching engine (CLOSEST_DRIVER_ENGINE setting)."""
+    return numpy_engine is not None and settings.CLOSEST_DRIVER_ENGINE == 'numpy'
+
+def use_database_engine() -> bool:
+    """If the closest-driver search must use the database matching engine (CLOSEST_DRIVER_ENGINE setting)."""
+    return settings.CLOSEST_DRIVER_ENGINE == 'database'
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from typing import Union
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+
+class RequestMetrics:
+    """The database queries and time of the request being served."""
+
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# The metrics of the current request. The context is copied to the threads of sync_to_async, so the
+# queries of the async views are also recorded.
+current_request_metrics: contextvars.ContextVar[Union[RequestMetrics, None]] = contextvars.ContextVar(
+    'current_request_metrics', default = None)
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that adds the query and its time to the metrics of the current request.
+    It is installed on every database connection (api.apps)."""
+    request_metrics = current_request_metrics.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.db_time += time.perf_counter() - start_time
+        request_metrics.queries += 1
+
+def install_query_recorder(sender, connection, **kwargs) -> None:
+    """connection_created receiver: record the queries of the new connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def percentile(sorted_values: list, fraction: float) -> Union[float, None]:
+    """Nearest-rank percentile of sorted values. None if there are no values."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+class EndpointMetrics:
+    """Totals of an endpoint since the process started, and its last REQUEST_METRICS_SAMPLES requests."""
+
+    def __init__(self, samples: int):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        # (total ms, db ms, python ms, queries, response bytes) of the last requests.
+        self.samples = deque(maxlen = samples)
+
+    def add(self, total_time: float, request_metrics: RequestMetrics, response_size: Union[int, None],
+            status_code: int) -> None:
+        self.requests += 1
+        self.errors += status_code >= 500
+        self.total_time += total_time
+        self.db_time += request_metrics.db_time
+        self.queries += request_metrics.queries
+        self.samples.append((total_time * 1000, request_metrics.db_time * 1000,
+                             (total_time - request_metrics.db_time) * 1000, request_metrics.queries, response_size))
+
+    def summary(self) -> dict:
+        columns = list(zip(*self.samples)) or [()] * 5
+        window = {}
+        for name, values in zip(('total_ms', 'db_ms', 'python_ms', 'queries', 'response_bytes'), columns):
+            values = sorted(value for value in values if value is not None)
+            window[name] = {
+                'p50': percentile(values, 0.5),
+                'p90': percentile(values, 0.9),
+                'p99': percentile(values, 0.99),
+                'max': values[-1] if values else None
+            }
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avg_total_ms': self.total_time * 1000 / self.requests if self.requests else None,
+            'avg_db_ms': self.db_time * 1000 / self.requests if self.requests else None,
+            'avg_queries': self.queries / self.requests if self.requests else None,
+            'window_requests': len(self.samples),
+            'window': window
+        }
+
+
+class MetricsRegistry:
+    """The per-endpoint request metrics of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, EndpointMetrics] = {}
+
+    def add(self, endpoint: str, total_time: float, request_metrics: RequestMetrics,
+            response_size: Union[int, None], status_code: int) -> None:
+        with self._lock:
+            endpoint_metrics = self._endpoints.get(endpoint)
+            if endpoint_metrics is None:
+                endpoint_metrics = self._endpoints[endpoint] = EndpointMetrics(settings.REQUEST_METRICS_SAMPLES)
+            endpoint_metrics.add(total_time, request_metrics, response_size, status_code)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {endpoint: endpoint_metrics.summary() for endpoint, endpoint_metrics in sorted(self._endpoints.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints = {}
+
+
+metrics_registry = MetricsRegistry()
+
+def get_endpoint(request: HttpRequest) -> str:
+    """The method and url pattern of a request, e.g. 'GET api/filter_orders/<str:date>/'."""
+    resolver_match = getattr(request, 'resolver_match', None)
+    route = resolver_match.route if resolver_match is not None else '<unmatched>'
+    return f'{request.method} {route}'
+
+def finish_request(request: HttpRequest, response: HttpResponse, request_metrics: RequestMetrics,
+                   start_time: float) -> None:
+    """Record the metrics of a served request and add its Server-Timing header."""
+    total_time = time.perf_counter() - start_time
+    # The size of a streaming response is unknown until it is sent.
+    response_size = None if response.streaming else len(response.content)
+    metrics_registry.add(get_endpoint(request), total_time, request_metrics, response_size, response.status_code)
+    if settings.REQUEST_METRICS_SERVER_TIMING:
+        response['Server-Timing'] = (
+            f'db;dur={request_metrics.db_time * 1000:.2f};desc="{request_metrics.queries} queries", '
+            f'app;dur={(total_time - request_metrics.db_time) * 1000:.2f}, '
+            f'total;dur={total_time * 1000:.2f}'
+        )
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """Records the queries, database time, Python time and response size of every request, per endpoint,
+    and reports them on the Server-Timing header. Disabled with REQUEST_METRICS_ENABLED = False.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest) -> HttpResponse:
+            if not settings.REQUEST_METRICS_ENABLED:
+                return await get_response(request)
+            request_metrics = RequestMetrics()
+            token = current_request_metrics.set(request_metrics)
+            start_time = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                current_request_metrics.reset(token)
+            finish_request(request, response, request_metrics, start_time)
+            return response
+    else:
+        def middleware(request: HttpRequest) -> HttpResponse:
+            if not settings.REQUEST_METRICS_ENABLED:
+                return get_response(request)
+            request_metrics = RequestMetrics()
+            token = current_request_metrics.set(request_metrics)
+            start_time = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                current_request_metrics.reset(token)
+            finish_request(request, response, request_metrics, start_time)
+            return response
+    return middleware
@@ -0,0 +1,63 @@
+from typing import Union
+from django.conf import settings
+from django.db.models import QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .utils import get_error_dict, get_orders_page
+
+
+def get_page_size(request: Request) -> int:
+    """The 'page_size' query parameter, API_PAGE_SIZE by default.
+
+    Raises:
+    -------
+        ValidationError: When the page_size is not an integer between 1 and API_MAX_PAGE_SIZE.
+    """
+    page_size_str = request.query_params.get('page_size')
+    try:
+        page_size = int(page_size_str) if page_size_str is not None else settings.API_PAGE_SIZE
+        if not 0 < page_size <= settings.API_MAX_PAGE_SIZE:
+            raise ValueError()
+    except ValueError:
+        raise ValidationError(get_error_dict(f"The page_size must be between 1 and {settings.API_MAX_PAGE_SIZE}."))
+    return page_size
+
+
+class DriverCursorPagination(CursorPagination):
+    """Cursor pagination of the drivers by id."""
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request: Request) -> int:
+        return get_page_size(request)
+
+
+class OrderCursorPagination(BasePagination):
+    """Keyset pagination of the orders, most recent first, by (pickup_datetime, id).
+    See api.utils.get_orders_page.
+    """
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view = None) -> list:
+        self.request = request
+        page_size = get_page_size(request)
+        try:
+            orders, self.next_cursor = get_orders_page(queryset, request.query_params.get(self.cursor_query_param), page_size)
+        except Exception as error:
+            raise ValidationError(get_error_dict(error))
+        return orders
+
+    def get_next_link(self) -> Union[str, None]:
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data: list) -> Response:
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data
+        })
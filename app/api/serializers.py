@@ -1,4 +1,11 @@
+import datetime
+import operator
+from typing import Callable, Iterable, Iterator, Union
+from django.conf import settings
+from django.db.models import QuerySet
 from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+from core.archive import is_archived_date
 from core.models import Driver, Order
 
 class DriverSerializer(serializers.ModelSerializer):
@@ -22,5 +29,122 @@ class OrderSerializer(serializers.ModelSerializer):
             "pickup_lat", 
             "pickup_lng", 
             "delivery_lat", 
-            "delivery_lng"
+            "delivery_lng",
+            "duration",
+            "end_datetime"
         ]
+
+    def validate_duration(self, value: datetime.timedelta) -> datetime.timedelta:
+        # The overlap and busy checks only look MAX_ORDER_DURATION back, so no order can be longer.
+        if not datetime.timedelta(0) < value <= settings.MAX_ORDER_DURATION:
+            raise serializers.ValidationError(f"The duration must be positive and not longer than {settings.MAX_ORDER_DURATION}.")
+        return value
+
+    def validate_pickup_datetime(self, value: datetime.datetime) -> datetime.datetime:
+        # The archived days are read-only: filter_orders would not return a new order of one of them.
+        if is_archived_date(value.astimezone(settings.TIME_ZONE_PYTZ).date()):
+            raise serializers.ValidationError("The orders of this day are archived.")
+        return value
+
+
+def get_datetime_formatter(field: serializers.DateTimeField) -> Callable[[Union[datetime.datetime, None]], Union[str, None]]:
+    """Precompile DateTimeField.to_representation for the aware datetimes read from the database.
+
+    Args:
+    -----
+        field (serializers.DateTimeField): The serializer field.
+
+    Returns:
+    --------
+        Callable[[Union[datetime.datetime, None]], Union[str, None]]: The formatter of the field values.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return lambda value: value
+    field_timezone = getattr(field, 'timezone', None) or field.default_timezone()
+
+    def format_datetime(value: Union[datetime.datetime, None]) -> Union[str, None]:
+        if not value:
+            return None
+        if field_timezone is not None:
+            value = value.astimezone(field_timezone)
+        if output_format.lower() != ISO_8601:
+            return value.strftime(output_format)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return format_datetime
+
+def get_field_formatter(field: serializers.Field) -> Union[Callable, None]:
+    """The formatter of the raw database values of a serializer field. None if the values are returned as is."""
+    if isinstance(field, serializers.DateTimeField):
+        return get_datetime_formatter(field)
+    if isinstance(field, serializers.IntegerField) or (
+        isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None):
+        # The database returns the integers and the related ids as they are represented.
+        return None
+    return lambda value: None if value is None else field.to_representation(value)
+
+
+class ValuesSerializer:
+    """Read-only fast path of a ModelSerializer for list responses.
+
+    The output is built from .values_list() tuples with a formatter per field, precompiled from the
+    fields of the ModelSerializer, instead of running DRF's fields machinery per instance. The
+    rendered JSON is the same, byte by byte.
+    """
+
+    def __init__(self, serializer_class: type[serializers.ModelSerializer]):
+        self.serializer_class = serializer_class
+        model = serializer_class.Meta.model
+        model_fields = [model._meta.get_field(field.source) for field in serializer_class().fields.values()]
+        self.names = list(serializer_class().fields)
+        # The model fields to load with .only() and the attributes (or columns) to read.
+        self.field_names = [model_field.name for model_field in model_fields]
+        self.sources = [model_field.attname for model_field in model_fields]
+
+    def _format_rows(self, rows: Iterable[tuple]) -> Iterator[dict]:
+        # The formatters are compiled on each call, as the current timezone may change between requests.
+        formatters = [get_field_formatter(field) for field in self.serializer_class().fields.values()]
+        names = self.names
+        if not any(formatters):
+            for row in rows:
+                yield dict(zip(names, row))
+            return
+        formatted = [(position, formatter) for position, formatter in enumerate(formatters) if formatter is not None]
+        for row in rows:
+            row = list(row)
+            for position, formatter in formatted:
+                row[position] = formatter(row[position])
+            yield dict(zip(names, row))
+
+    def iter_data(self, queryset: QuerySet, chunk_size: Union[int, None] = None) -> Iterator[dict]:
+        """Serialize the rows of a queryset, one by one.
+
+        Args:
+        -----
+            queryset (QuerySet): The rows to serialize. Its ordering is kept.
+            chunk_size (Union[int, None]): If given, the rows are read with .iterator() in chunks of this size.
+
+        Yields:
+        -------
+            Iterator[dict]: The serialized rows.
+        """
+        rows = queryset.values_list(*self.sources)
+        if chunk_size is not None:
+            rows = rows.iterator(chunk_size = chunk_size)
+        yield from self._format_rows(rows)
+
+    def data(self, queryset: QuerySet) -> list[dict]:
+        """Serialize the rows of a queryset."""
+        return list(self.iter_data(queryset))
+
+    def instances_data(self, instances: Iterable) -> list[dict]:
+        """Serialize already loaded instances (e.g. a page), reading the same attributes."""
+        get_row = operator.attrgetter(*self.sources)
+        rows = map(get_row, instances) if len(self.sources) > 1 else ((get_row(instance),) for instance in instances)
+        return list(self._format_rows(rows))
+
+
+driver_values_serializer = ValuesSerializer(DriverSerializer)
+order_values_serializer = ValuesSerializer(OrderSerializer)
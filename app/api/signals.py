@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from core.changes import record_table_changes
+from core.models import Driver, Order
+from core.signals import bulk_deleted, bulk_saved
+from .cache import closest_driver_cache
+from .indexes import availability_index, driver_index, index_changing, order_index, to_aware_datetime
+from .matching import numpy_engine
+
+
+def get_indexes(model) -> list:
+    """The in-memory indexes (and NumPy arrays) kept in sync with a model."""
+    if model is Driver:
+        indexes = [driver_index, numpy_engine.drivers if numpy_engine is not None else None]
+    elif model is Order:
+        indexes = [order_index, availability_index, numpy_engine.orders if numpy_engine is not None else None]
+    else:
+        indexes = []
+    return [index for index in indexes if index is not None]
+
+def invalidate_closest_driver_cache(sender, instances: list, deleted: bool = False) -> None:
+    """Discard the cached closest-driver searches that the written (or deleted) instances can change.
+    It must run before the indexes are updated, as the previous values are read from them.
+    """
+    # The indexes that were never built hold no previous values.
+    indexes = [index for index in get_indexes(sender) if index.generation is not None]
+    if sender is Driver:
+        # Only a new position changes a search, the last_update alone does not.
+        if deleted or not indexes or any(index.indexed_position(instance.id) != (int(instance.lat), int(instance.lng))
+                          for index in indexes for instance in instances):
+            closest_driver_cache.invalidate_drivers()
+    elif sender is Order:
+        intervals = set()
+        for instance in instances:
+            intervals.update(index.indexed_interval(instance.id) for index in indexes)
+            intervals.add((to_aware_datetime(instance.pickup_datetime), to_aware_datetime(instance.end_datetime)))
+        # Bumped once per batch, however many written orders share a target_datetime bucket.
+        closest_driver_cache.invalidate_orders((pickup_datetime, end_datetime) for pickup_datetime, end_datetime 
+                                               in intervals - {None} if pickup_datetime is not None and end_datetime is not None)
+
+def record_changes(sender, row_ids: list) -> None:
+    """Append the written rows to the changes log of their table (in the transaction of the write), after they
+    were applied on the indexes of this process, which skip them when they read the log."""
+    if sender is not Driver and sender is not Order:
+        return
+    local_changes = record_table_changes(sender, row_ids)
+    indexes = get_indexes(sender)
+    for index in indexes:
+        index.track_local_changes(local_changes)
+
+    def confirm_local_changes():
+        for index in indexes:
+            index.confirm_local_changes(local_changes)
+
+    transaction.on_commit(confirm_local_changes)
+
+@receiver(post_save, sender = Driver)
+@receiver(post_save, sender = Order)
+def update_indexes(sender, instance, **kwargs):
+    """Keep the indexes in sync with the saved Driver or Order."""
+    invalidate_closest_driver_cache(sender, [instance])
+    for index in get_indexes(sender):
+        index.update(instance)
+    record_changes(sender, [instance.id])
+
+@receiver(post_delete, sender = Driver)
+@receiver(post_delete, sender = Order)
+def remove_from_indexes(sender, instance, **kwargs):
+    """Remove the deleted Driver or Order from the indexes."""
+    invalidate_closest_driver_cache(sender, [instance], deleted = True)
+    for index in get_indexes(sender):
+        index.remove(instance.id)
+    record_changes(sender, [instance.id])
+
+@receiver(bulk_saved)
+def update_indexes_on_bulk_save(sender, instances, **kwargs):
+    """Keep the indexes in sync with the rows written by bulk_create or bulk_update."""
+    invalidate_closest_driver_cache(sender, instances)
+    for index in get_indexes(sender):
+        if any(instance.pk is None for instance in instances):
+            # The database backend did not return the ids of the created rows, rebuild on the next lookup.
+            index.invalidate()
+            continue
+        for instance in instances:
+            index.update(instance)
+    record_changes(sender, [instance.pk for instance in instances])
+
+@receiver(bulk_deleted)
+def remove_from_indexes_on_bulk_delete(sender, instances, **kwargs):
+    """Remove the rows deleted in bulk (e.g. the archived orders) from the indexes."""
+    invalidate_closest_driver_cache(sender, instances, deleted = True)
+    for index in get_indexes(sender):
+        for instance in instances:
+            index.remove(instance.id)
+    record_changes(sender, [instance.id for instance in instances])
+
+@receiver(index_changing)
+def invalidate_closest_driver_cache_on_index_change(sender, instances, deleted_ids, **kwargs):
+    """Discard the cached searches that the rows changed outside of this process can change, before an index
+    applies them."""
+    if instances:
+        invalidate_closest_driver_cache(sender, instances)
+    if deleted_ids:
+        invalidate_closest_driver_cache(sender, [sender(id = row_id) for row_id in deleted_ids], deleted = True)
@@ -1,3 +1,705 @@
-from django.test import TestCase
+import datetime
+import json
+import random
+from io import StringIO
+from unittest import skipUnless
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from core import tests as core_tests
+from core.changes import record_table_changes
+from core.models import Driver, DriverState, Order
+from core.signals import bulk_saved
+from .cache import closest_driver_cache
+from .metrics import metrics_registry
+from .serializers import DriverSerializer, OrderSerializer
+from .serializers import driver_values_serializer, order_values_serializer
+from .loadtest import SyntheticDataset
+from .indexes import DriverAvailabilityIndex, DriverGridIndex, availability_index, driver_index, order_index
+from .intervals import IntervalSchedule
+from .utils import get_closest_driver_by_orders_and_coordinates, get_closest_driver_by_driver_starting_zone
+from .utils import get_orders_between, get_orders_on_date, get_orders_overlapping, get_schedule_conflicts
+from .utils import get_busy_driver_ids, get_busy_window, get_next_free_datetime, get_free_slots
 
-# Create your tests here.
+
+class DriverGridIndexTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        Driver.objects.create(last_update = now, lat = 15, lng = 25)
+        Driver.objects.create(last_update = now, lat = 5, lng = 63)
+        Driver.objects.create(last_update = now, lat = 98, lng = 98)
+        Driver.objects.create(last_update = now, lat = 25, lng = 15)
+        self.index = DriverGridIndex(cell_size = 7)
+        self.index.rebuild()
+
+    def brute_force_closest(self, lat: int, lng: int, excluded_ids = ()) -> int:
+        candidates = [(abs(driver.lat - lat) + abs(driver.lng - lng), driver.id) 
+                      for driver in Driver.objects.all() if driver.id not in excluded_ids]
+        return min(candidates)[1] if candidates else None
+
+    def test_closest_matches_full_scan(self):
+        """Test the expanding-ring search returns the same driver as the full table scan"""
+        for lat in range(-10, 111, 9):
+            for lng in range(-10, 111, 9):
+                self.assertEqual(self.index.closest(lat, lng), self.brute_force_closest(lat, lng))
+
+    def test_closest_ties_resolved_by_lowest_id(self):
+        """Test that drivers at the same distance are resolved by the lowest id"""
+        self.assertEqual(self.index.closest(20, 20), 1)
+
+    def test_closest_skips_excluded_drivers(self):
+        """Test busy drivers are skipped"""
+        self.assertEqual(self.index.closest(90, 93, excluded_ids = {3}), 
+                         self.brute_force_closest(90, 93, excluded_ids = {3}))
+        self.assertIsNone(self.index.closest(90, 93, excluded_ids = {1, 2, 3, 4}))
+
+    def test_index_follows_driver_writes(self):
+        """Test the shared index is updated when a driver is saved or deleted"""
+        driver_index.rebuild()
+        driver = Driver.objects.get(id = 3)
+        driver.lat, driver.lng = 0, 0
+        driver.save()
+        self.assertEqual(driver_index.closest(97, 97), 2)
+        self.assertEqual(driver_index.closest(1, 1), 3)
+        Driver.objects.filter(id = 3).delete()
+        driver_index.ensure_fresh()
+        self.assertEqual(driver_index.closest(1, 1), 1)
+
+    def test_index_detects_external_writes(self):
+        """Test the index is rebuilt after a write of another process, even when the driver moves with an older last_update"""
+        # self.index is not kept in sync by the signals, as the indexes of another process.
+        driver = Driver.objects.get(id = 3)
+        driver.lat, driver.lng = 0, 0
+        driver.last_update -= datetime.timedelta(hours = 1)
+        driver.save()
+        self.index.ensure_fresh()
+        self.assertEqual(self.index.closest(1, 1), 3)
+        Driver.objects.get(id = 3).delete()
+        self.index.ensure_fresh()
+        self.assertEqual(self.index.closest(1, 1), 1)
+
+    def test_index_follows_its_own_writes_without_rebuilds(self):
+        """Test the writes applied on the index keep it fresh, and a rolled back write is loaded again"""
+        driver_index.ensure_fresh()
+        generation = driver_index.generation
+        driver = Driver.objects.get(id = 3)
+        driver.lat, driver.lng = 0, 0
+        driver.save()
+        driver_index.ensure_fresh()
+        self.assertEqual(driver_index.generation, generation)
+        try:
+            with transaction.atomic():
+                driver.lat, driver.lng = 50, 50
+                driver.save()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        driver_index.ensure_fresh()
+        self.assertEqual(driver_index.generation, generation)
+        self.assertEqual(driver_index.indexed_position(3), (0, 0))
+
+    def test_index_applies_the_writes_of_other_processes(self):
+        """Test the rows logged by another process are applied on the index without a rebuild"""
+        driver_index.ensure_fresh()
+        generation = driver_index.generation
+        # A write of another process: no signal, only the changes log.
+        Driver.objects.filter(id = 3).update(lat = 60, lng = 60)
+        record_table_changes(Driver, [3])
+        driver_index.ensure_fresh()
+        self.assertEqual(driver_index.generation, generation)
+        self.assertEqual(driver_index.indexed_position(3), (60, 60))
+
+
+class OrderTimelineIndexTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        drivers = [Driver.objects.create(last_update = now, lat = 0, lng = 0) for _ in range(5)]
+        generator = random.Random(7)
+        for _ in range(300):
+            # Quarter hour pickups, so several orders share the same pickup_datetime.
+            pickup_datetime = now + datetime.timedelta(minutes = 15 * generator.randint(1, 60))
+            Order.objects.create(driver = generator.choice(drivers), pickup_datetime = pickup_datetime, 
+                                 duration = datetime.timedelta(minutes = 15 * generator.randint(1, 12)), pickup_lat = 0, pickup_lng = 0, 
+                                 delivery_lat = generator.randint(0, 100), delivery_lng = generator.randint(0, 100))
+        order_index.rebuild()
+
+    def scan_closest_driver(self, target_datetime: datetime.datetime, lat: int, lng: int) -> int:
+        """The linear scan over the orders that the timeline index replaces."""
+        qs_orders_completed_to_date = Order.objects.filter(
+            end_datetime__lte = target_datetime,
+            pickup_datetime__gte = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        ).order_by('pickup_datetime', 'id')
+        closest_distance = float('inf')
+        closest_timedelta = settings.MAX_TIMEDELTA_TO_SEARCH_CLOSEST_ORDER
+        selected_driver_id = None
+        for order in qs_orders_completed_to_date:
+            driver_distance = abs(order.delivery_lat - lat) + abs(order.delivery_lng - lng)
+            datetime_diff = target_datetime - order.pickup_datetime
+            if driver_distance < closest_distance and datetime_diff < closest_timedelta:
+                closest_distance = driver_distance
+                closest_timedelta = datetime_diff
+                selected_driver_id = order.driver_id
+        return selected_driver_id
+
+    def test_closest_driver_matches_linear_scan(self):
+        """Test the timeline index search returns the same driver as the linear scan"""
+        now = datetime.datetime.now().replace(microsecond = 0)
+        generator = random.Random(11)
+        found_drivers = 0
+        for _ in range(100):
+            target_datetime = now + datetime.timedelta(minutes = 5 * generator.randint(0, 200))
+            lat, lng = generator.randint(-10, 110), generator.randint(-10, 110)
+            expected_driver_id = self.scan_closest_driver(target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ), lat, lng)
+            self.assertEqual(get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng), expected_driver_id)
+            found_drivers += expected_driver_id is not None
+        self.assertGreater(found_drivers, 50)
+
+    def test_index_follows_order_writes(self):
+        """Test the index is updated when an order is saved or deleted"""
+        target_datetime = datetime.datetime.now() + datetime.timedelta(days = 3)
+        driver = Driver.objects.first()
+        order = Order.objects.create(driver = driver, pickup_datetime = (target_datetime - datetime.timedelta(hours = 2)).replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                                     pickup_lat = 0, pickup_lng = 0, delivery_lat = 500, delivery_lng = 500)
+        self.assertEqual(get_closest_driver_by_orders_and_coordinates(target_datetime, 500, 500), driver.id)
+        order.delete()
+        self.assertIsNone(get_closest_driver_by_orders_and_coordinates(target_datetime, 500, 500))
+
+
+class IntervalScheduleTestCase(TestCase):
+    def setUp(self):
+        self.start_datetime = datetime.datetime(2030, 1, 1, tzinfo = settings.TIME_ZONE_PYTZ)
+        generator = random.Random(17)
+        self.intervals = []
+        for key in range(200):
+            start = self.start_datetime + datetime.timedelta(minutes = generator.randint(0, 5000))
+            self.intervals.append((start, start + datetime.timedelta(minutes = generator.randint(1, 300)), key))
+        self.schedule = IntervalSchedule(self.intervals)
+        # Write after the first lookup, so the running max ends are recomputed.
+        self.schedule.covers(self.start_datetime, self.start_datetime)
+        for interval in self.intervals[::3]:
+            self.schedule.remove(*interval)
+        self.intervals = [interval for position, interval in enumerate(self.intervals) if position % 3]
+
+    def test_overlaps_match_brute_force(self):
+        """Test the overlap and busy lookups return the same as checking every interval"""
+        generator = random.Random(19)
+        for _ in range(300):
+            start = self.start_datetime + datetime.timedelta(minutes = generator.randint(-300, 5300))
+            end = start + datetime.timedelta(minutes = generator.randint(0, 300))
+            self.assertEqual(self.schedule.overlaps(start, end), 
+                             any(interval_start <= end and start <= interval_end for interval_start, interval_end, _ in self.intervals))
+            self.assertEqual(self.schedule.is_busy(start), 
+                             any(interval_start <= start - datetime.timedelta(minutes = 1) and start <= interval_end 
+                                 for interval_start, interval_end, _ in self.intervals))
+
+    def test_schedule_conflicts_of_different_durations(self):
+        """Test a new order conflicts with the orders that overlap its whole duration"""
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        driver = Driver.objects.create(last_update = now, lat = 0, lng = 0)
+        Order.objects.create(driver = driver, pickup_datetime = now + datetime.timedelta(hours = 5), duration = datetime.timedelta(hours = 3), 
+                             pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+        self.assertEqual(get_schedule_conflicts([
+            (driver.id, now + datetime.timedelta(hours = 7), datetime.timedelta(minutes = 30)),
+            (driver.id, now + datetime.timedelta(hours = 8, seconds = 1), datetime.timedelta(minutes = 30)),
+            (driver.id, now + datetime.timedelta(hours = 2), datetime.timedelta(hours = 3)),
+            (driver.id, now + datetime.timedelta(hours = 1), datetime.timedelta(hours = 3, minutes = 59, seconds = 59)),
+            (driver.id, now + datetime.timedelta(hours = 8, minutes = 20), datetime.timedelta(minutes = 30)),
+        ]), [True, False, True, False, True])
+
+
+class DriverAvailabilityIndexTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.now = now
+        self.drivers = [Driver.objects.create(last_update = now, lat = 0, lng = 0) for _ in range(5)]
+        generator = random.Random(5)
+        for _ in range(100):
+            Order.objects.create(driver = generator.choice(self.drivers), 
+                                 pickup_datetime = now + datetime.timedelta(minutes = 10 * generator.randint(1, 100)), 
+                                 duration = datetime.timedelta(minutes = 10 * generator.randint(1, 18)), 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+        availability_index.rebuild()
+
+    def scan_busy_driver_ids(self, target_datetime: datetime.datetime) -> set[int]:
+        """The busy drivers read from the database."""
+        return set(get_orders_between(*get_busy_window(target_datetime)).filter(
+            end_datetime__gte = target_datetime).values_list('driver_id', flat = True))
+
+    def test_busy_drivers_match_database(self):
+        """Test the busy drivers of the index are the ones of the database"""
+        generator = random.Random(9)
+        for _ in range(100):
+            target_datetime = self.now + datetime.timedelta(minutes = generator.randint(0, 1100))
+            self.assertEqual(get_busy_driver_ids(target_datetime), self.scan_busy_driver_ids(target_datetime))
+
+    def test_next_free_datetime(self):
+        """Test the next free datetime of a driver is free, and the second before it is busy"""
+        generator = random.Random(13)
+        for _ in range(100):
+            driver = generator.choice(self.drivers)
+            target_datetime = self.now + datetime.timedelta(minutes = generator.randint(0, 1100))
+            free_datetime = get_next_free_datetime(driver.id, target_datetime)
+            self.assertGreaterEqual(free_datetime, target_datetime)
+            self.assertNotIn(driver.id, self.scan_busy_driver_ids(free_datetime))
+            if free_datetime > target_datetime:
+                self.assertIn(driver.id, self.scan_busy_driver_ids(free_datetime - datetime.timedelta(seconds = 1)))
+
+    def test_index_follows_order_writes(self):
+        """Test the index is updated when an order is saved, moved or deleted"""
+        target_datetime = self.now + datetime.timedelta(days = 3)
+        driver = self.drivers[0]
+        order = Order.objects.create(driver = driver, pickup_datetime = target_datetime - datetime.timedelta(minutes = 30), 
+                                     pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+        self.assertEqual(get_busy_driver_ids(target_datetime), {driver.id})
+        self.assertEqual(get_next_free_datetime(driver.id, target_datetime), 
+                         target_datetime + datetime.timedelta(minutes = 30, seconds = 1))
+        order.duration = datetime.timedelta(hours = 2)
+        order.save()
+        self.assertEqual(get_next_free_datetime(driver.id, target_datetime), 
+                         target_datetime + datetime.timedelta(minutes = 90, seconds = 1))
+        order.pickup_datetime = target_datetime + datetime.timedelta(hours = 2)
+        order.save()
+        self.assertEqual(get_busy_driver_ids(target_datetime), set())
+        order_id = order.id
+        order.delete()
+        self.assertIsNone(availability_index.indexed_interval(order_id))
+
+    def test_index_detects_external_order_writes(self):
+        """Test an index is rebuilt after an order of another process is updated or deleted"""
+        # The index is not kept in sync by the signals, as the indexes of another process.
+        index = DriverAvailabilityIndex()
+        index.rebuild()
+        target_datetime = self.now + datetime.timedelta(days = 3)
+        order = Order.objects.filter(pickup_datetime__gte = self.now).earliest('id')
+        order.pickup_datetime = target_datetime - datetime.timedelta(minutes = 30)
+        order.save()
+        index.ensure_fresh()
+        self.assertEqual(index.busy_driver_ids(target_datetime), {order.driver_id})
+        order.delete()
+        index.ensure_fresh()
+        self.assertEqual(index.busy_driver_ids(target_datetime), set())
+
+
+class FreeSlotsTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.start_datetime = now + datetime.timedelta(hours = 1)
+        self.end_datetime = now + datetime.timedelta(days = 1)
+        self.driver = Driver.objects.create(last_update = now, lat = 0, lng = 0)
+        generator = random.Random(3)
+        for _ in range(15):
+            Order.objects.create(driver = self.driver, 
+                                 pickup_datetime = now + datetime.timedelta(minutes = generator.randint(0, 26 * 60)), 
+                                 duration = datetime.timedelta(minutes = generator.randint(10, 120)), 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+        availability_index.rebuild()
+
+    def is_accepted(self, pickup_datetime: datetime.datetime, duration: datetime.timedelta) -> bool:
+        """The overlap rule of schedule_order."""
+        return not get_orders_overlapping(pickup_datetime, pickup_datetime + duration, driver_ids = self.driver.id).exists()
+
+    def test_slots_follow_schedule_order_rule(self):
+        """Test every pickup datetime of the range is accepted by schedule_order if and only if it is on a slot"""
+        for duration in (settings.DEFAULT_ORDER_DURATION, datetime.timedelta(minutes = 20)):
+            slots = get_free_slots(self.driver.id, self.start_datetime, self.end_datetime, duration = duration)
+            self.assertTrue(slots)
+            pickup_datetime = self.start_datetime
+            while pickup_datetime <= self.end_datetime:
+                on_slot = any(earliest <= pickup_datetime <= latest for earliest, latest in slots)
+                self.assertEqual(on_slot, self.is_accepted(pickup_datetime, duration), pickup_datetime)
+                pickup_datetime += datetime.timedelta(seconds = 59)
+            for earliest, latest in slots:
+                self.assertTrue(self.is_accepted(earliest, duration) and self.is_accepted(latest, duration))
+                if earliest > self.start_datetime:
+                    self.assertFalse(self.is_accepted(earliest - datetime.timedelta(seconds = 1), duration))
+                if latest < self.end_datetime:
+                    self.assertFalse(self.is_accepted(latest + datetime.timedelta(seconds = 1), duration))
+
+    def test_driver_without_orders(self):
+        """Test a driver without orders is free on the whole range"""
+        driver = Driver.objects.create(last_update = self.start_datetime, lat = 0, lng = 0)
+        self.assertEqual(get_free_slots(driver.id, self.start_datetime, self.end_datetime), 
+                         [(self.start_datetime, self.end_datetime)])
+
+
+@override_settings(CLOSEST_DRIVER_ENGINE = 'numpy')
+class NumpySearchClosestDriverTestCaseRestframework(core_tests.SearchClosestDriverTestCaseRestframework):
+    """The closest driver endpoint scenarios, using the NumPy matching engine."""
+
+@override_settings(CLOSEST_DRIVER_ENGINE = 'numpy')
+class NumpySearchClosestDriverSpecialTestCaseRestframework(core_tests.SearchClosestDriverSpecialTestCaseRestframework):
+    """The closest driver endpoint special scenarios, using the NumPy matching engine."""
+
+class NumpyMatchingEngineTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        generator = random.Random(3)
+        drivers = [Driver.objects.create(last_update = now, lat = generator.randint(0, 100), lng = generator.randint(0, 100)) 
+                   for _ in range(30)]
+        for _ in range(300):
+            pickup_datetime = now + datetime.timedelta(minutes = 15 * generator.randint(1, 60))
+            Order.objects.create(driver = generator.choice(drivers), pickup_datetime = pickup_datetime, 
+                                 duration = datetime.timedelta(minutes = 15 * generator.randint(1, 12)), pickup_lat = 0, pickup_lng = 0, 
+                                 delivery_lat = generator.randint(0, 100), delivery_lng = generator.randint(0, 100))
+
+    def test_engines_return_the_same_drivers(self):
+        """Test the NumPy matching engine returns the same drivers as the index engine"""
+        now = datetime.datetime.now().replace(microsecond = 0)
+        generator = random.Random(5)
+        for _ in range(100):
+            target_datetime = now + datetime.timedelta(minutes = 5 * generator.randint(12, 200))
+            lat, lng = generator.randint(-10, 110), generator.randint(-10, 110)
+            expected = (get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng), 
+                        get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime))
+            with self.settings(CLOSEST_DRIVER_ENGINE = 'numpy'):
+                found = (get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng), 
+                         get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime))
+            self.assertEqual(found, expected)
+
+@override_settings(CLOSEST_DRIVER_ENGINE = 'database')
+class DatabaseSearchClosestDriverTestCaseRestframework(core_tests.SearchClosestDriverTestCaseRestframework):
+    """The closest driver endpoint scenarios, using the database matching engine."""
+
+@override_settings(CLOSEST_DRIVER_ENGINE = 'database')
+class DatabaseSearchClosestDriverSpecialTestCaseRestframework(core_tests.SearchClosestDriverSpecialTestCaseRestframework):
+    """The closest driver endpoint special scenarios, using the database matching engine."""
+
+class DatabaseMatchingEngineTestCase(NumpyMatchingEngineTestCase):
+    def test_engines_return_the_same_drivers(self):
+        """Test the database matching engine returns the same drivers as the index engine"""
+        now = datetime.datetime.now().replace(microsecond = 0)
+        generator = random.Random(5)
+        for _ in range(150):
+            target_datetime = now + datetime.timedelta(minutes = 5 * generator.randint(12, 200))
+            lat, lng = generator.randint(-10, 110), generator.randint(-10, 110)
+            excluded_driver_ids = set(generator.sample(range(1, 31), generator.choice([0, 3])))
+            expected = (get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng, excluded_driver_ids), 
+                        get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime, excluded_driver_ids))
+            with self.settings(CLOSEST_DRIVER_ENGINE = 'database'):
+                found = (get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng, excluded_driver_ids), 
+                         get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime, excluded_driver_ids))
+            self.assertEqual(found, expected)
+
+    @override_settings(CLOSEST_DRIVER_ENGINE = 'database', DATABASE_ENGINE_SEARCH_RADIUS = 200)
+    def test_one_query_per_search(self):
+        """Test each search of the database engine runs a single query"""
+        target_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(hours = 8)
+        # The closest order shares its pickup_datetime with no other order, so no step is needed.
+        Order.objects.create(driver = Driver.objects.first(), pickup_lat = 0, pickup_lng = 0, delivery_lat = 500, delivery_lng = 500, 
+                             pickup_datetime = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ) - datetime.timedelta(hours = 2, seconds = 7))
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(get_closest_driver_by_orders_and_coordinates(target_datetime, 500, 500))
+        with self.assertNumQueries(1):
+            get_closest_driver_by_driver_starting_zone(50, 50, target_datetime)
+
+    @override_settings(CLOSEST_DRIVER_ENGINE = 'database')
+    def test_starting_zone_reads_the_driver_states(self):
+        """Test the starting zone search reads the busy drivers from DriverState, not from the orders"""
+        target_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 2)
+        driver = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                                       lat = 500, lng = 500)
+        self.assertEqual(get_closest_driver_by_driver_starting_zone(500, 500, target_datetime), driver.id)
+        Order.objects.create(driver = driver, pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0, 
+                             pickup_datetime = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ) - datetime.timedelta(minutes = 30))
+        with CaptureQueriesContext(connection) as queries:
+            found = get_closest_driver_by_driver_starting_zone(500, 500, target_datetime)
+        self.assertNotEqual(found, driver.id)
+        self.assertFalse(any(Order._meta.db_table in query['sql'] for query in queries.captured_queries))
+
+    @override_settings(CLOSEST_DRIVER_ENGINE = 'database', DATABASE_ENGINE_SEARCH_RADIUS = 1)
+    def test_drivers_out_of_the_search_square(self):
+        """Test the drivers out of the first search square are found"""
+        target_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 30)
+        found = get_closest_driver_by_driver_starting_zone(500, 500, target_datetime)
+        self.assertIsNotNone(found)
+        with self.settings(CLOSEST_DRIVER_ENGINE = 'index'):
+            self.assertEqual(get_closest_driver_by_driver_starting_zone(500, 500, target_datetime), found)
+
+class ClosestDriverCacheTestCase(TestCase):
+    def setUp(self):
+        caches[settings.CLOSEST_DRIVER_CACHE].clear()
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.target_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 2)
+        self.near_driver = Driver.objects.create(last_update = now, lat = 10, lng = 10)
+        self.far_driver = Driver.objects.create(last_update = now, lat = 90, lng = 90)
+        Order.objects.create(driver = self.far_driver, 
+                             pickup_datetime = (self.target_datetime - datetime.timedelta(hours = 3)).replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                             pickup_lat = 0, pickup_lng = 0, delivery_lat = 50, delivery_lng = 50)
+
+    def search(self, *args) -> tuple:
+        """Both searches and the hits and misses they add."""
+        stats = closest_driver_cache.stats()
+        found = (get_closest_driver_by_orders_and_coordinates(self.target_datetime, *args), 
+                 get_closest_driver_by_driver_starting_zone(*args, self.target_datetime))
+        new_stats = closest_driver_cache.stats()
+        return found, new_stats['hits'] - stats['hits'], new_stats['misses'] - stats['misses']
+
+    def test_repeated_searches_are_hits(self):
+        """Test the repeated searches are read from the cache"""
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 0, 2))
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 2, 0))
+
+    def test_overlapping_order_write_invalidates(self):
+        """Test an order written on the searched window discards the cached results"""
+        self.search(10, 10)
+        order = Order.objects.create(driver = self.near_driver, 
+                                     pickup_datetime = (self.target_datetime - datetime.timedelta(minutes = 30)).replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                                     pickup_lat = 0, pickup_lng = 0, delivery_lat = 10, delivery_lng = 10)
+        # The order makes the near driver busy for the starting zone search. It is out of the orders search window.
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.far_driver.id), 1, 1))
+        order.pickup_datetime = (self.target_datetime - datetime.timedelta(hours = 2)).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        order.save()
+        self.assertEqual(self.search(10, 10), ((self.near_driver.id, self.near_driver.id), 0, 2))
+        order.delete()
+        # The deleted order ended before the target, so the starting zone result is kept.
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 1, 1))
+
+    def test_bulk_order_write_bumps_each_bucket_once(self):
+        """Test the orders written in bulk bump each target_datetime bucket once, with a single cache write"""
+        self.search(10, 10)
+        bumps = []
+        bump = closest_driver_cache._bump
+        closest_driver_cache._bump = lambda *names: (bumps.append(names), bump(*names))
+        try:
+            orders = Order.objects.bulk_create([
+                Order(driver = self.near_driver, pickup_lat = 0, pickup_lng = 0, delivery_lat = 10, delivery_lng = 10,
+                      pickup_datetime = (self.target_datetime - datetime.timedelta(minutes = 30 + minutes)).replace(tzinfo = settings.TIME_ZONE_PYTZ))
+                for minutes in range(20)
+            ])
+            bulk_saved.send(sender = Order, instances = orders, created = True)
+        finally:
+            closest_driver_cache._bump = bump
+        self.assertEqual(len(bumps), 1)
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.far_driver.id), 1, 1))
+
+    def test_unrelated_order_write_keeps_results(self):
+        """Test an order written far from the searched window keeps the cached results"""
+        self.search(10, 10)
+        Order.objects.create(driver = self.near_driver, 
+                             pickup_datetime = (self.target_datetime + datetime.timedelta(days = 1)).replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                             pickup_lat = 0, pickup_lng = 0, delivery_lat = 10, delivery_lng = 10)
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 2, 0))
+
+    def test_driver_position_change_invalidates(self):
+        """Test a new driver position discards the starting zone results, and a new last_update alone does not"""
+        self.search(10, 10)
+        self.near_driver.last_update += datetime.timedelta(minutes = 1)
+        self.near_driver.save()
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 2, 0))
+        self.near_driver.lat = self.near_driver.lng = 80
+        self.near_driver.save()
+        self.assertEqual(self.search(90, 90), ((self.far_driver.id, self.far_driver.id), 0, 2))
+        self.assertEqual(self.search(10, 10), ((self.far_driver.id, self.near_driver.id), 1, 1))
+
+    def test_searches_with_excluded_drivers_skip_the_cache(self):
+        """Test the searches with excluded drivers are neither read nor saved on the cache"""
+        stats = closest_driver_cache.stats()
+        found = get_closest_driver_by_driver_starting_zone(10, 10, self.target_datetime, excluded_driver_ids = {self.near_driver.id})
+        self.assertEqual(found, self.far_driver.id)
+        self.assertEqual(closest_driver_cache.stats(), stats)
+
+    def test_cache_stats_endpoint(self):
+        """Test the cache stats endpoint returns the hits and misses counters"""
+        self.search(10, 10)
+        self.search(10, 10)
+        response = APIClient().get('/api/closest_driver_cache_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), closest_driver_cache.stats())
+        self.assertGreaterEqual(response.json()['hits'], 2)
+
+@skipUnless(connection.vendor == 'sqlite', "The expected query plans are the SQLite ones.")
+class OrderQueryPlanTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        driver = Driver.objects.create(last_update = now, lat = 0, lng = 0)
+        Order.objects.bulk_create([
+            Order(driver = driver, pickup_datetime = now + datetime.timedelta(hours = hours), 
+                  pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0) 
+            for hours in range(100)
+        ])
+        self.now = now
+
+    def assertUsesIndex(self, queryset, index_name: str):
+        """Assert the query plan searches the orders by an index, and sorts them by it."""
+        plan = queryset.explain()
+        self.assertRegex(plan, rf"SEARCH core_order USING (COVERING )?INDEX {index_name} ")
+        self.assertNotIn("SCAN core_order", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_driver_schedule_overlap_uses_index(self):
+        """Test the overlap check of a driver schedule uses the (driver, end_datetime) index"""
+        queryset = get_orders_overlapping(self.now, self.now + datetime.timedelta(hours = 2), driver_ids = 1)
+        self.assertUsesIndex(queryset, 'order_driver_end_idx')
+        queryset = get_orders_overlapping(self.now, self.now + datetime.timedelta(hours = 2), driver_ids = [1, 2])
+        self.assertUsesIndex(queryset.values_list('driver_id', 'pickup_datetime', 'end_datetime'), 'order_driver_end_idx')
+
+    def test_time_window_uses_index(self):
+        """Test the busy drivers time window query uses the (pickup_datetime) index"""
+        queryset = get_orders_between(self.now, self.now + datetime.timedelta(hours = 1))
+        self.assertUsesIndex(queryset.values_list('driver_id', flat = True), 'order_pickup_idx')
+
+    def test_orders_on_date_use_index(self):
+        """Test the orders of a day, of every driver or of one, use the pickup_datetime indexes"""
+        self.assertUsesIndex(get_orders_on_date(self.now.date()).order_by('-pickup_datetime'), 'order_pickup_idx')
+        self.assertUsesIndex(get_orders_on_date(self.now.date(), driver_id = 1).order_by('-pickup_datetime'), 
+                             'order_driver_pickup_idx')
+
+    def test_orders_on_date_match_date_lookup(self):
+        """Test the pickup_datetime range of a day returns the same orders as the __date lookup"""
+        for days in range(5):
+            filter_date = (self.now + datetime.timedelta(days = days)).date()
+            self.assertEqual(list(get_orders_on_date(filter_date).order_by('id')), 
+                             list(Order.objects.filter(pickup_datetime__date = filter_date).order_by('id')))
+
+    def test_update_and_bulk_update_keep_end_datetime(self):
+        """Test QuerySet.update and bulk_update recompute the end_datetime served by the (driver, end_datetime) index"""
+        def assertEndDatetimes():
+            for pickup_datetime, duration, end_datetime in Order.objects.values_list('pickup_datetime', 'duration', 'end_datetime'):
+                self.assertEqual(end_datetime, pickup_datetime + duration)
+
+        Order.objects.filter(pickup_datetime__lt = self.now + datetime.timedelta(hours = 10)).update(
+            pickup_datetime = F('pickup_datetime') - datetime.timedelta(minutes = 30), duration = datetime.timedelta(hours = 2))
+        Order.objects.filter(pickup_datetime__gte = self.now + datetime.timedelta(hours = 50)).update(
+            duration = datetime.timedelta(minutes = 10))
+        Order.objects.filter(pickup_datetime = self.now + datetime.timedelta(hours = 20)).update(pickup_datetime = self.now)
+        assertEndDatetimes()
+        orders = list(Order.objects.filter(pickup_datetime__gte = self.now + datetime.timedelta(hours = 90)))
+        for order in orders:
+            order.pickup_datetime -= datetime.timedelta(hours = 1)
+            order.duration = datetime.timedelta(hours = 3)
+        Order.objects.bulk_update(orders, ['pickup_datetime', 'duration'])
+        assertEndDatetimes()
+
+class ValuesSerializerTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        drivers = [Driver.objects.create(last_update = now - datetime.timedelta(microseconds = microseconds), lat = 1, lng = -2) 
+                   for microseconds in (0, 1, 1000000)]
+        for position, driver in enumerate(drivers):
+            Order.objects.create(driver = driver, pickup_datetime = now.replace(microsecond = 0) + datetime.timedelta(hours = position), 
+                                 pickup_lat = position, pickup_lng = 0, delivery_lat = -position, delivery_lng = 7)
+
+    def test_values_serializers_render_the_same_json(self):
+        """Test the values fast path renders the same JSON, byte by byte, as the model serializers"""
+        for queryset, serializer_class, values_serializer in (
+            (Driver.objects.order_by('id'), DriverSerializer, driver_values_serializer),
+            (Order.objects.order_by('-pickup_datetime'), OrderSerializer, order_values_serializer)):
+            self.assertEqual(JSONRenderer().render(values_serializer.data(queryset)), 
+                             JSONRenderer().render(serializer_class(queryset, many = True).data))
+
+    def test_list_routes_use_the_same_json(self):
+        """Test the drivers and orders list routes return the model serializers output"""
+        client = APIClient()
+        self.assertEqual(client.get('/api/drivers/').json()['results'], 
+                         DriverSerializer(Driver.objects.order_by('id'), many = True).data)
+        self.assertEqual(client.get('/api/orders/').json()['results'], 
+                         OrderSerializer(Order.objects.order_by('-pickup_datetime', '-id'), many = True).data)
+
+    def test_benchmark_serializers_command(self):
+        """Test the serializers benchmark reports identical outputs and leaves no rows behind"""
+        output = StringIO()
+        call_command('benchmark_serializers', rows = 50, repeat = 1, stdout = output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(set(results), {'drivers', 'orders'})
+        self.assertTrue(all(result['identical_json'] for result in results.values()))
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class LoadTestCommandTestCase(TransactionTestCase):
+    # The load test and benchmark commands commit their synthetic rows (the sync views of the
+    # ASGI handler run on another thread and database connection) and remove them afterwards.
+
+    def test_load_test_read_endpoints_command(self):
+        """Test the load test reports the sync and async scenarios without errors and leaves no rows behind"""
+        output = StringIO()
+        call_command('load_test_read_endpoints', drivers = 20, orders = 100, requests = 10, concurrency = 4, stdout = output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(set(results), {'get_closest_driver:sync', 'get_closest_driver:async',
+                                        'filter_orders:sync', 'filter_orders:async'})
+        for result in results.values():
+            self.assertEqual(result['requests'], 10)
+            self.assertEqual(result['errors'], 0)
+        self.assertEqual(Driver.objects.count(), 0)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_benchmark_api_command(self):
+        """Test the API benchmark reports every scenario with its query counts and leaves no rows behind"""
+        output = StringIO()
+        call_command('benchmark_api', drivers = 20, orders = 100, requests = 5, syncs = 2, stdout = output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['dataset']['orders'], 100)
+        self.assertEqual(set(report['scenarios']), 
+                         {'schedule_order', 'filter_orders', 'get_closest_driver', 'sync_drivers_location'})
+        for result in report['scenarios'].values():
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries_total'], 0)
+        self.assertEqual(report['scenarios']['sync_drivers_location']['requests'], 2)
+        self.assertEqual(Driver.objects.count(), 0)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_dataset_delete_skips_the_per_row_signals(self):
+        """Test the synthetic dataset is removed with a DELETE per table, and also from the indexes and states"""
+        dataset = SyntheticDataset(20, 100)
+        dataset.create()
+        driver_index.ensure_fresh()
+        order_index.ensure_fresh()
+        with CaptureQueriesContext(connection) as queries:
+            dataset.delete()
+        self.assertLessEqual(sum(query['sql'].startswith('DELETE') for query in queries.captured_queries), 5)
+        self.assertEqual((Driver.objects.count(), Order.objects.count(), DriverState.objects.count()), (0, 0, 0))
+        self.assertFalse(set(driver_index.indexed_ids()).intersection(dataset.driver_ids))
+        self.assertFalse(any(order_index.indexed_interval(order_id) for order_id in dataset.order_ids))
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        metrics_registry.reset()
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        driver = Driver.objects.create(last_update = now, lat = 10, lng = 10)
+        self.pickup_datetime = now + datetime.timedelta(days = 1)
+        Order.objects.create(driver = driver, pickup_datetime = self.pickup_datetime, 
+                             pickup_lat = 0, pickup_lng = 0, delivery_lat = 50, delivery_lng = 50)
+        self.path = f"/api/filter_orders/{self.pickup_datetime.strftime(settings.DEFAULT_DATE_FORMAT)}/"
+
+    def test_server_timing_header(self):
+        """Test the responses report the queries and the database, app and total durations"""
+        with self.assertNumQueries(1):
+            response = APIClient().get(self.path)
+        self.assertRegex(response['Server-Timing'], 
+                         r'^db;dur=[0-9.]+;desc="1 queries", app;dur=[0-9.]+, total;dur=[0-9.]+$')
+
+    def test_metrics_endpoint(self):
+        """Test the metrics endpoint groups the requests by method and url pattern"""
+        client = APIClient()
+        for _ in range(3):
+            response = client.get(self.path)
+        metrics = client.get('/api/metrics/').json()
+        endpoint_metrics = metrics['GET api/filter_orders/<str:date>/']
+        self.assertEqual(endpoint_metrics['requests'], 3)
+        self.assertEqual(endpoint_metrics['avg_queries'], 1)
+        self.assertEqual(endpoint_metrics['window']['queries']['p99'], 1)
+        self.assertEqual(endpoint_metrics['window']['response_bytes']['max'], len(response.content))
+        self.assertGreater(endpoint_metrics['window']['total_ms']['max'], 0)
+
+    def test_metrics_endpoint_is_local(self):
+        """Test the metrics endpoint rejects the remote clients"""
+        response = APIClient(REMOTE_ADDR = '10.0.0.1').get('/api/metrics/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_async_views_queries_are_recorded(self):
+        """Test the queries that the async views run through sync_to_async are recorded"""
+        response = await AsyncClient().get('/api/async/filter_orders/2000-01-01/')
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9][0-9]* queries"')
+
+    @override_settings(REQUEST_METRICS_ENABLED = False)
+    def test_disabled_metrics(self):
+        """Test no metrics are recorded when they are disabled"""
+        response = APIClient().get(self.path)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(metrics_registry.summary(), {})
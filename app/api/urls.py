@@ -10,8 +10,22 @@ api_router.register('orders', OrdersViewSet)
 urlpatterns = [
     path('', include(api_router.urls)),
     path('schedule_order/', schedule_order),
+    path('schedule_orders/', schedule_orders),
     path('filter_orders/', filter_orders),
     path('filter_orders/<str:date>/', filter_orders),
     path('filter_orders/<str:date>/<int:driver_id>/', filter_orders),
-    path('get_closest_driver/', get_closest_driver)
+    path('order_stats/<str:date>/', order_stats),
+    path('order_stats/<str:date>/<int:driver_id>/', order_stats),
+    path('get_closest_driver/', get_closest_driver),
+    path('get_closest_drivers/', get_closest_drivers),
+    path('availability/<str:target_datetime>/', driver_availability),
+    path('availability/<str:target_datetime>/<int:driver_id>/', driver_availability),
+    path('free_slots/', free_slots),
+    path('free_slots/<int:driver_id>/', free_slots),
+    path('closest_driver_cache_stats/', closest_driver_cache_stats),
+    path('metrics/', request_metrics),
+    path('async/filter_orders/', async_filter_orders),
+    path('async/filter_orders/<str:date>/', async_filter_orders),
+    path('async/filter_orders/<str:date>/<int:driver_id>/', async_filter_orders),
+    path('async/get_closest_driver/', async_get_closest_driver)
 ]
\ No newline at end of file
@@ -1,79 +1,568 @@
+import base64
 import datetime
-from typing import Union
-from core.models import Driver, Order
+from typing import Iterable, Union
+from core.archive import is_archived_date
+from core.models import ArchivedOrder, Driver, Order
 from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from .cache import ClosestDriverCache, closest_driver_cache
+from .indexes import availability_index, driver_index, order_index
+from .intervals import IntervalSchedule, get_busy_window
+from .matching import database_engine, numpy_engine, use_database_engine, use_numpy_engine
 
 
 def get_error_dict(error_msg: Union[Exception, str]) -> dict[str, str]:
     """Returns a default error dict for a given error message or exception."""
     return {'error': str(error_msg)}
 
-def get_closest_driver_by_orders_and_coordinates(target_datetime: datetime.datetime, 
-                                                 lat: int, lng: int) -> Union[int, None]:
-    """Search nearby drivers by orders coordinates and datetime.
+def get_orders_between(start_datetime: datetime.datetime, end_datetime: datetime.datetime, 
+                       driver_ids: Union[Iterable[int], int, None] = None) -> QuerySet:
+    """The orders picked up between two datetimes (both included), optionally of some drivers.
+    The filter is served by the (pickup_datetime) and (driver, pickup_datetime) indexes.
+
+    Args:
+    -----
+        start_datetime (datetime.datetime): The lower pickup_datetime limit.
+        end_datetime (datetime.datetime): The upper pickup_datetime limit.
+        driver_ids (Union[Iterable[int], int, None]): The id (or ids) of the drivers. All drivers by default.
+
+    Returns:
+    --------
+        QuerySet: The filtered orders.
+    """
+    queryset = Order.objects.filter(pickup_datetime__gte = start_datetime, pickup_datetime__lte = end_datetime)
+    if isinstance(driver_ids, (int, str)):
+        queryset = queryset.filter(driver_id = driver_ids)
+    elif driver_ids is not None:
+        queryset = queryset.filter(driver_id__in = set(driver_ids))
+    return queryset
+
+def get_orders_overlapping(start_datetime: datetime.datetime, end_datetime: datetime.datetime, 
+                           driver_ids: Union[Iterable[int], int, None] = None) -> QuerySet:
+    """The orders whose [pickup_datetime, end_datetime] intersects a range (both limits included), optionally of 
+    some drivers. The orders of some drivers are served by the (driver, end_datetime) index: only their orders 
+    that end from start_datetime on are read. For all the drivers, no order being longer than MAX_ORDER_DURATION 
+    also bounds the pickup_datetime range, served by the (pickup_datetime) index.
+
+    Args:
+    -----
+        start_datetime (datetime.datetime): The start of the range.
+        end_datetime (datetime.datetime): The end of the range.
+        driver_ids (Union[Iterable[int], int, None]): The id (or ids) of the drivers. All drivers by default.
+
+    Returns:
+    --------
+        QuerySet: The filtered orders.
+    """
+    queryset = Order.objects.filter(end_datetime__gte = start_datetime, pickup_datetime__lte = end_datetime)
+    if isinstance(driver_ids, (int, str)):
+        queryset = queryset.filter(driver_id = driver_ids)
+    elif driver_ids is not None:
+        queryset = queryset.filter(driver_id__in = set(driver_ids))
+    else:
+        queryset = queryset.filter(pickup_datetime__gte = start_datetime - settings.MAX_ORDER_DURATION)
+    return queryset
+
+def get_orders_on_date(filter_date: datetime.date, driver_id: Union[int, None] = None) -> QuerySet:
+    """The orders picked up on a day, optionally of a driver.
+    The day is filtered as a pickup_datetime range instead of a __date lookup, so the indexes can be used.
+    The archived days (core.archive) are read from the ArchivedOrder table, which has the same fields.
+
+    Args:
+    -----
+        filter_date (datetime.date): The day of the orders.
+        driver_id (Union[int, None]): The id of the driver. All drivers by default.
+
+    Returns:
+    --------
+        QuerySet: The filtered orders.
+    """
+    start_datetime = datetime.datetime.combine(filter_date, datetime.time.min).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    model = ArchivedOrder if is_archived_date(filter_date) else Order
+    queryset = model.objects.filter(pickup_datetime__gte = start_datetime, 
+                                    pickup_datetime__lt = start_datetime + datetime.timedelta(days = 1))
+    if driver_id is not None:
+        queryset = queryset.filter(driver_id = driver_id)
+    return queryset
+
+def parse_query_filters(query_params, int_names: Iterable[str] = (), datetime_names: Iterable[str] = ()) -> dict:
+    """Parse the received filters of a list route.
+
+    Args:
+    -----
+        query_params: The request query parameters.
+        int_names (Iterable[str]): The names of the integer filters.
+        datetime_names (Iterable[str]): The names of the datetime (DEFAULT_DATETIME_FORMAT) filters.
+
+    Raises:
+    -------
+        Exception: When a received filter is not valid.
+
+    Returns:
+    --------
+        dict: The parsed value of each received filter.
+    """
+    filters = {}
+    for name in int_names:
+        if (value := query_params.get(name)) is not None:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise Exception(f"The {name} filter must be an integer.")
+    for name in datetime_names:
+        if (value := query_params.get(name)) is not None:
+            try:
+                filters[name] = datetime.datetime.strptime(value, settings.DEFAULT_DATETIME_FORMAT
+                                                           ).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+            except ValueError:
+                raise Exception(f"The {name} filter must match the format {settings.DEFAULT_DATETIME_FORMAT}.")
+    return filters
+
+def filter_drivers_list(queryset: QuerySet, query_params) -> QuerySet:
+    """Filter the drivers by bounding box (min_lat, max_lat, min_lng, max_lng) and last_update range 
+    (updated_from, updated_to), all included. Served by the (lat, lng) and (last_update) indexes.
+
+    Raises:
+    -------
+        Exception: When a received filter is not valid.
+    """
+    lookups = {
+        'min_lat': 'lat__gte', 'max_lat': 'lat__lte', 'min_lng': 'lng__gte', 'max_lng': 'lng__lte',
+        'updated_from': 'last_update__gte', 'updated_to': 'last_update__lte'
+    }
+    filters = parse_query_filters(query_params, int_names = list(lookups)[:4], datetime_names = list(lookups)[4:])
+    return queryset.filter(**{lookups[name]: value for name, value in filters.items()})
+
+def filter_orders_list(queryset: QuerySet, query_params) -> QuerySet:
+    """Filter the orders by driver, pickup_datetime range (pickup_from, pickup_to) and pickup bounding box 
+    (min_lat, max_lat, min_lng, max_lng), all included. The driver and pickup_datetime range are served by 
+    the (driver, pickup_datetime) and (pickup_datetime) indexes, the bounding box is checked on their rows.
+
+    Raises:
+    -------
+        Exception: When a received filter is not valid.
+    """
+    lookups = {
+        'driver': 'driver_id', 'min_lat': 'pickup_lat__gte', 'max_lat': 'pickup_lat__lte', 
+        'min_lng': 'pickup_lng__gte', 'max_lng': 'pickup_lng__lte',
+        'pickup_from': 'pickup_datetime__gte', 'pickup_to': 'pickup_datetime__lte'
+    }
+    filters = parse_query_filters(query_params, int_names = list(lookups)[:5], datetime_names = list(lookups)[5:])
+    return queryset.filter(**{lookups[name]: value for name, value in filters.items()})
+
+def encode_orders_cursor(order: Order) -> str:
+    """The opaque cursor that points to an order on the (pickup_datetime, id) descending sequence."""
+    position = f"{order.pickup_datetime.isoformat()}|{order.id}"
+    # The padding is dropped, so the cursor is safe on a query string as is.
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_orders_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    """Decode a cursor returned by encode_orders_cursor.
+
+    Raises:
+    -------
+        Exception: When the cursor is not valid.
+
+    Returns:
+    --------
+        tuple[datetime.datetime, int]: The pickup_datetime and id of the pointed order.
+    """
+    try:
+        pickup_datetime_str, order_id_str = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        pickup_datetime = parse_datetime(pickup_datetime_str)
+        order_id = int(order_id_str)
+    except Exception:
+        pickup_datetime = None
+    if pickup_datetime is None:
+        raise Exception("Invalid cursor.")
+    return pickup_datetime, order_id
+
+def get_orders_page(queryset: QuerySet, cursor: Union[str, None], page_size: int) -> tuple[list[Order], Union[str, None]]:
+    """Keyset pagination of orders, most recent first, by (pickup_datetime, id).
+    Each page starts after the last order of the previous one, so no order is skipped or repeated
+    and every page is an index range, whatever its depth.
+
+    Args:
+    -----
+        queryset (QuerySet): The filtered orders.
+        cursor (Union[str, None]): The cursor of the last order of the previous page. None for the first page.
+        page_size (int): The max orders of the page.
+
+    Raises:
+    -------
+        Exception: When the cursor is not valid.
+
+    Returns:
+    --------
+        tuple[list[Order], Union[str, None]]: The orders of the page and the cursor of the next page 
+            (None on the last page).
+    """
+    queryset = queryset.order_by('-pickup_datetime', '-id')
+    if cursor is not None:
+        pickup_datetime, order_id = decode_orders_cursor(cursor)
+        # The pickup_datetime upper limit alone makes the page an index range, the rest skips the ties.
+        queryset = queryset.filter(Q(pickup_datetime__lte = pickup_datetime), 
+                                   Q(pickup_datetime__lt = pickup_datetime) | Q(id__lt = order_id))
+    # One more order is loaded to know if there is a next page.
+    orders = list(queryset[:page_size + 1])
+    if len(orders) <= page_size:
+        return orders, None
+    orders = orders[:page_size]
+    return orders, encode_orders_cursor(orders[-1])
+
+def refresh_matching_state() -> None:
+    """Check the in-memory state used by the closest-driver search against the database."""
+    if use_database_engine():
+        return
+    if use_numpy_engine():
+        numpy_engine.ensure_fresh()
+    else:
+        order_index.ensure_fresh()
+        availability_index.ensure_fresh()
+        driver_index.ensure_fresh()
+
+def get_busy_driver_ids(target_datetime: datetime.datetime) -> set[int]:
+    """The ids of the drivers that are busy at a datetime (aware), from the fresh in-memory state: the drivers with
+    an order picked up a minute or more before it that has not ended. The availability index only keeps the orders 
+    that can still be active, so older datetimes are answered by the database.
+    """
+    if target_datetime >= availability_index.horizon():
+        return availability_index.busy_driver_ids(target_datetime)
+    qs_active_orders = get_orders_between(*get_busy_window(target_datetime)).filter(end_datetime__gte = target_datetime)
+    return set(qs_active_orders.values_list('driver_id', flat = True))
+
+def get_next_free_datetime(driver_id: int, target_datetime: datetime.datetime) -> datetime.datetime:
+    """The first datetime, from target_datetime (aware, not in the past), when a driver is not busy.
+
+    Args:
+    -----
+        driver_id (int): The driver id.
+        target_datetime (datetime.datetime): The datetime from which the driver is checked.
+
+    Returns:
+    --------
+        datetime.datetime: The target_datetime if the driver is free then. Otherwise, one second after 
+            the end of the busy period that contains it.
+    """
+    return availability_index.next_free_datetime(driver_id, target_datetime)
+
+def get_free_slots(driver_id: int, start_datetime: datetime.datetime, end_datetime: datetime.datetime, 
+                   duration: Union[datetime.timedelta, None] = None) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """The free slots of a driver between two datetimes (aware, not in the past): the ranges of pickup datetimes 
+    that schedule_order accepts for an order of the driver. An order is rejected when it overlaps another order 
+    of the driver, so each slot has room for an order of the duration. The orders of the driver are visited once, 
+    in pickup_datetime order, from the availability index.
+
+    Args:
+    -----
+        driver_id (int): The driver id.
+        start_datetime (datetime.datetime): The lower pickup_datetime limit (included).
+        end_datetime (datetime.datetime): The upper pickup_datetime limit (included).
+        duration (Union[datetime.timedelta, None]): The duration of the order. DEFAULT_ORDER_DURATION by default.
+
+    Returns:
+    --------
+        list[tuple[datetime.datetime, datetime.datetime]]: The earliest and latest pickup datetimes (both included) 
+            of each slot, in order.
+    """
+    return availability_index.free_slots(driver_id, start_datetime, end_datetime, 
+                                         duration or settings.DEFAULT_ORDER_DURATION)
+
+def get_zone_free_slots(lat: int, lng: int, max_distance: int, start_datetime: datetime.datetime, 
+                        end_datetime: datetime.datetime, limit: int, 
+                        duration: Union[datetime.timedelta, None] = None) -> list[tuple[int, int, list]]:
+    """The free slots of the drivers around a point, the drivers with the earliest slot first.
 
     Args:
     -----
-        target_datetime (datetime.datetime): The requested Order target datetime.
         lat (int): Latitude coordinates.
         lng (int): Longitude coordinates.
+        max_distance (int): The max Manhattan distance of the drivers to the point.
+        start_datetime (datetime.datetime): The lower pickup_datetime limit (included).
+        end_datetime (datetime.datetime): The upper pickup_datetime limit (included).
+        limit (int): The max drivers returned.
+        duration (Union[datetime.timedelta, None]): The duration of the order. DEFAULT_ORDER_DURATION by default.
 
     Returns:
     --------
-        Union[int, None]: The id of the found closest driver. None if no close driver is found.
+        list[tuple[int, int, list]]: The id, distance and free slots of each driver with a free slot. 
+            Sorted by the earliest slot, then by distance and id.
+    """
+    drivers_slots = []
+    for distance, driver_id in driver_index.within(lat, lng, max_distance):
+        slots = get_free_slots(driver_id, start_datetime, end_datetime, duration = duration)
+        if slots:
+            drivers_slots.append((slots[0][0], distance, driver_id, slots))
+    drivers_slots.sort(key = lambda driver_slots: driver_slots[:3])
+    return [(driver_id, distance, slots) for _, distance, driver_id, slots in drivers_slots[:limit]]
+
+def _search_closest_driver_by_orders(target_datetime: datetime.datetime, lat: int, lng: int, 
+                                     excluded_driver_ids: Iterable[int] = ()) -> tuple[Union[int, None], Union[datetime.datetime, None]]:
+    """Search nearby drivers by orders coordinates and datetime, on the fresh in-memory state.
+
+    Returns:
+    --------
+        tuple[Union[int, None], Union[datetime.datetime, None]]: The id of the found closest driver (None if no 
+            close driver is found) and the pickup_datetime of the first selected order. The result is the same 
+            until now passes that pickup_datetime.
     """
-    # Get the nearest (in time) completed orders up to the requested time and order by pickup_datetime (asc)
-    # This way the most recent order will be checked last.
-    last_selectable_order_start_datetime = target_datetime - settings.DEFAULT_ORDER_DURATION
-    qs_orders_completed_to_date = Order.objects.filter(
-        pickup_datetime__lte = last_selectable_order_start_datetime,
-        pickup_datetime__gte = datetime.datetime.now()
-    ).order_by('pickup_datetime')
+    # The orders that must be completed to date (end_datetime not after the target_datetime) are checked by 
+    # pickup_datetime (asc), so the most recent order is checked last. An order is selected when it is closer 
+    # (in distance) than the last selected order and nearer (in time) to the target_datetime, starting from 
+    # MAX_TIMEDELTA_TO_SEARCH_CLOSEST_ORDER.
+    # The orders timeline index returns directly the next order that will be selected, so only the selected
+    # orders are visited.
+    now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    # The first selectable order must be picked up after (strictly) the max timedelta and not before now.
+    start_datetime = target_datetime - settings.MAX_TIMEDELTA_TO_SEARCH_CLOSEST_ORDER
+    start_inclusive = now > start_datetime
+    if start_inclusive:
+        start_datetime = now
+    if use_database_engine():
+        return database_engine.closest_driver_by_orders(start_datetime, start_inclusive, target_datetime, 
+                                                        lat, lng, excluded_driver_ids = excluded_driver_ids), None
+    if use_numpy_engine():
+        selected_driver_id = numpy_engine.closest_driver_by_orders(start_datetime, start_inclusive, 
+                                                                   target_datetime, lat, lng, 
+                                                                   excluded_driver_ids = excluded_driver_ids, refresh = False)
+        if selected_driver_id is None or excluded_driver_ids:
+            return selected_driver_id, None
+        # Without excluded drivers, the first selected order is the earliest one.
+        return selected_driver_id, numpy_engine.earliest_pickup_datetime(start_datetime, start_inclusive, target_datetime)
     # Define a positive infinity value to the shortest distance and initialize the selected_driver_id.
     closest_distance = float('inf')
-    closest_timedelta = settings.MAX_TIMEDELTA_TO_SEARCH_CLOSEST_ORDER
     selected_driver_id = None
-    # Iterate over the orders that n=must be completed to date and find the nearest (in distance) driver.
-    for order in qs_orders_completed_to_date:
-        driver_distance = abs(order.delivery_lat - lat) + abs(order.delivery_lng - lng)
-        datetime_diff = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ) - order.pickup_datetime
-        if driver_distance < closest_distance and datetime_diff < closest_timedelta:
-            closest_distance = driver_distance
-            closest_timedelta = datetime_diff
-            selected_driver_id = order.driver.id
-    return selected_driver_id
+    first_pickup_datetime = None
+    while True:
+        order = order_index.earliest(start_datetime, start_inclusive, target_datetime, 
+                                     lat, lng, max_distance = closest_distance, excluded_driver_ids = excluded_driver_ids)
+        if order is None:
+            return selected_driver_id, first_pickup_datetime
+        pickup_datetime, _, delivery_lat, delivery_lng, selected_driver_id, _ = order
+        first_pickup_datetime = first_pickup_datetime or pickup_datetime
+        closest_distance = abs(delivery_lat - lat) + abs(delivery_lng - lng)
+        # The next selected order must be picked up after (strictly) this one.
+        start_datetime, start_inclusive = pickup_datetime, False
 
-def get_closest_driver_by_driver_starting_zone(lat: int, lng: int, target_datetime: datetime.datetime) -> Union[int, None]:
+def get_closest_driver_by_orders_and_coordinates(target_datetime: datetime.datetime, lat: int, lng: int, 
+                                                 excluded_driver_ids: Iterable[int] = (), 
+                                                 refresh: bool = True) -> Union[int, None]:
+    """Search nearby drivers by orders coordinates and datetime.
+    The searches without excluded drivers are read through the closest-driver cache.
+
+    Args:
+    -----
+        target_datetime (datetime.datetime): The requested Order target datetime.
+        lat (int): Latitude coordinates.
+        lng (int): Longitude coordinates.
+        excluded_driver_ids (Iterable[int]): The ids of the drivers that can not be selected.
+        refresh (bool): If the in-memory state must be checked against the database first.
+
+    Returns:
+    --------
+        Union[int, None]: The id of the found closest driver. None if no close driver is found.
+    """
+    target_datetime = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    orders = numpy_engine.orders if use_numpy_engine() else order_index
+    if refresh and not use_database_engine():
+        orders.ensure_fresh()
+    # The database engine reads the committed state on every search, so its results are not cached.
+    if excluded_driver_ids or use_database_engine():
+        return _search_closest_driver_by_orders(target_datetime, lat, lng, excluded_driver_ids = excluded_driver_ids)[0]
+    return closest_driver_cache.get_or_compute(ClosestDriverCache.ORDERS, (orders.generation,), target_datetime, lat, lng, 
+                                               lambda: _search_closest_driver_by_orders(target_datetime, lat, lng))
+
+def _search_closest_driver_by_starting_zone(lat: int, lng: int, target_datetime: datetime.datetime, 
+                                            excluded_driver_ids: Iterable[int] = ()) -> tuple[Union[int, None], None]:
+    """Search for a driver by initial zone coordinates excluding busy drivers, on the fresh in-memory state.
+
+    Returns:
+    --------
+        tuple[Union[int, None], None]: The id of the found closest driver (None if no driver is found). 
+            The result does not expire with time.
+    """
+    if use_database_engine():
+        return database_engine.closest_driver_by_starting_zone(lat, lng, target_datetime, 
+                                                               excluded_driver_ids = excluded_driver_ids), None
+    if use_numpy_engine():
+        return numpy_engine.closest_driver_by_starting_zone(lat, lng, target_datetime, 
+                                                            excluded_driver_ids = excluded_driver_ids, refresh = False), None
+    # Gets the busy drivers at requested datetime from the drivers availability index.
+    busy_drivers = get_busy_driver_ids(target_datetime)
+    # Search the nearest (in distance) not busy driver on the drivers grid index.
+    return driver_index.closest(lat, lng, excluded_ids = busy_drivers.union(excluded_driver_ids)), None
+
+def get_closest_driver_by_driver_starting_zone(lat: int, lng: int, target_datetime: datetime.datetime, 
+                                               excluded_driver_ids: Iterable[int] = (), 
+                                               refresh: bool = True) -> Union[int, None]:
     """Search for a driver by initial zone coordinates using target_datetime to exclude busy drivers.
+    The searches without excluded drivers are read through the closest-driver cache.
 
     Args:
     -----
         lat (int): Latitude coordinates.
         lng (int): Longitude coordinates.
         target_datetime (datetime.datetime): The requested Order target datetime.
+        excluded_driver_ids (Iterable[int]): The ids of the drivers that can not be selected.
+        refresh (bool): If the in-memory state must be checked against the database first.
 
     Returns:
     --------
         Union[int, None]: The id of the found closest driver. None if no close driver is found.
     """
-    # Gets the active orders at requested datetime.
-    last_active_order_start_datetime = target_datetime - settings.DEFAULT_ORDER_DURATION
-    last_active_order_end_datetime = target_datetime - datetime.timedelta(minutes = 1)
-    qs_active_orders_to_date = Order.objects.filter(
-        pickup_datetime__gte = last_active_order_start_datetime,
-        pickup_datetime__lte = last_active_order_end_datetime
-    )
-    # Gets the busy drivers at requested datetime.
-    busy_drivers = [order.driver.id for order in qs_active_orders_to_date]
-    all_drivers = Driver.objects.all()
-    # Define a positive infinity value to the shortest distance and initialize the selected_driver_id.
-    closest_distance = float('inf')
-    selected_driver_id = None
-    # Iterate over the drivers and find the nearest (in distance).
-    for driver in all_drivers:
-        if driver.id not in busy_drivers:
-            driver_distance = abs(driver.lat - lat) + abs(driver.lng - lng)
-            if driver_distance < closest_distance:
-                closest_distance = driver_distance
-                selected_driver_id = driver.id
+    target_datetime = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    if use_numpy_engine():
+        orders, drivers = numpy_engine.orders, numpy_engine.drivers
+    else:
+        orders, drivers = availability_index, driver_index
+    if refresh and not use_database_engine():
+        orders.ensure_fresh()
+        drivers.ensure_fresh()
+    # The database engine reads the committed state on every search, so its results are not cached.
+    if excluded_driver_ids or use_database_engine():
+        return _search_closest_driver_by_starting_zone(lat, lng, target_datetime, excluded_driver_ids = excluded_driver_ids)[0]
+    return closest_driver_cache.get_or_compute(ClosestDriverCache.STARTING_ZONE, (orders.generation, drivers.generation), 
+                                               target_datetime, lat, lng, 
+                                               lambda: _search_closest_driver_by_starting_zone(lat, lng, target_datetime))
+
+def get_closest_driver_id(target_datetime: datetime.datetime, lat: int, lng: int, 
+                          excluded_driver_ids: Iterable[int] = (), refresh: bool = True) -> Union[int, None]:
+    """Search for the driver that is closest to a geographical point on a date and time.
+    First by the orders coordinates and datetime, then by the drivers initial zone.
+
+    Args:
+    -----
+        target_datetime (datetime.datetime): The requested Order target datetime.
+        lat (int): Latitude coordinates.
+        lng (int): Longitude coordinates.
+        excluded_driver_ids (Iterable[int]): The ids of the drivers that can not be selected.
+        refresh (bool): If the in-memory state must be checked against the database first.
+
+    Returns:
+    --------
+        Union[int, None]: The id of the found closest driver. None if no close driver is found.
+    """
+    selected_driver_id = get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng, 
+                                                                      excluded_driver_ids = excluded_driver_ids, 
+                                                                      refresh = refresh)
+    if selected_driver_id is None:
+        selected_driver_id = get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime, 
+                                                                        excluded_driver_ids = excluded_driver_ids, 
+                                                                        refresh = refresh)
     return selected_driver_id
+
+def parse_closest_driver_point(data: dict) -> tuple[datetime.datetime, int, int]:
+    """Parse and validate the target_datetime, lat and lng of a closest driver search.
+
+    Args:
+    -----
+        data (dict): The received point.
+
+    Raises:
+    -------
+        Exception: When a field is missing or invalid, or the target_datetime is a past time.
+
+    Returns:
+    --------
+        tuple[datetime.datetime, int, int]: The target_datetime, lat and lng.
+    """
+    target_datetime_str = data.get('target_datetime')
+    lat_str = data.get('lat')
+    lng_str = data.get('lng')
+    if target_datetime_str is None or lat_str is None or lng_str is None:
+        needed_fields = ['target_datetime', 'lat', 'lng']
+        raise  Exception(f"Missing parameters. Fields {needed_fields} needed.")
+    # Every exception parsing the target_datetime or the lat and lng will be catched. 
+    target_datetime = datetime.datetime.strptime(target_datetime_str, settings.DEFAULT_DATETIME_FORMAT)
+    lat = int(lat_str)
+    lng = int(lng_str)
+    # If the order's pickup_datetime is lower than current datetime, raise an exception. 
+    if target_datetime < datetime.datetime.now():
+        raise Exception("It is not possible to search a closest driver an order for a past time.")
+    return target_datetime, lat, lng
+
+def get_closest_driver_ids(points: list[tuple[datetime.datetime, int, int]], 
+                           consistent_assignment: bool = False) -> list[Union[int, None]]:
+    """Search the closest driver of many points, checking the in-memory state against the database once.
+
+    Args:
+    -----
+        points (list[tuple[datetime.datetime, int, int]]): The target_datetime, lat and lng of each point.
+        consistent_assignment (bool): If a driver can not be returned for two points whose target datetimes 
+            are closer than DEFAULT_ORDER_DURATION. The points are assigned in the received order.
+
+    Returns:
+    --------
+        list[Union[int, None]]: The id of the found closest driver of each point. None if no driver is found.
+    """
+    refresh_matching_state()
+    assigned: list[tuple[datetime.datetime, int]] = []
+    selected_driver_ids = []
+    for target_datetime, lat, lng in points:
+        excluded_driver_ids = set()
+        if consistent_assignment:
+            # The overlap rule used to schedule an order, for orders of DEFAULT_ORDER_DURATION.
+            excluded_driver_ids = {driver_id for assigned_datetime, driver_id in assigned 
+                                   if abs(assigned_datetime - target_datetime) <= settings.DEFAULT_ORDER_DURATION}
+        selected_driver_id = get_closest_driver_id(target_datetime, lat, lng, 
+                                                   excluded_driver_ids = excluded_driver_ids, refresh = False)
+        if selected_driver_id is not None:
+            assigned.append((target_datetime, selected_driver_id))
+        selected_driver_ids.append(selected_driver_id)
+    return selected_driver_ids
+
+def lock_drivers(driver_ids: Iterable[int]) -> None:
+    """Lock the schedule of some drivers until the end of the current transaction, so the overlap check 
+    and the insert of their new orders can not interleave with other schedulings of the same drivers.
+    It must be called inside transaction.atomic(), before the overlap check.
+
+    Args:
+    -----
+        driver_ids (Iterable[int]): The ids of the drivers to lock.
+    """
+    # Sorted, so two transactions that lock the same drivers never wait for each other crosswise.
+    driver_ids = sorted(set(driver_ids))
+    if connection.features.has_select_for_update:
+        # Row locks on the drivers: the schedulings of different drivers run in parallel.
+        list(Driver.objects.select_for_update().filter(pk__in = driver_ids).order_by('id').values_list('id', flat = True))
+    else:
+        # SQLite has no row locks. A no-op write takes the database write lock before the overlap check,
+        # so the schedulings are serialized instead of failing when the check is upgraded to a write.
+        Driver.objects.filter(pk__in = driver_ids).update(lat = F('lat'))
+
+def get_schedule_conflicts(new_orders: list[tuple[int, datetime.datetime, datetime.timedelta]]) -> list[bool]:
+    """Detect, in a single pass, the new orders that overlap another order of their driver.
+    Each order is checked against the scheduled orders and the previous accepted new orders.
+
+    Args:
+    -----
+        new_orders (list[tuple[int, datetime.datetime, datetime.timedelta]]): The driver id, pickup_datetime 
+            and duration of each new order.
+
+    Returns:
+    --------
+        list[bool]: If each new order is in conflict (True) or can be scheduled (False).
+    """
+    if not new_orders:
+        return []
+    # Load the scheduled orders of the requested drivers that overlap the requested range with a single query.
+    qs_scheduled_orders = get_orders_overlapping(
+        min(pickup_datetime for _, pickup_datetime, _ in new_orders),
+        max(pickup_datetime + duration for _, pickup_datetime, duration in new_orders),
+        driver_ids = [driver_id for driver_id, _, _ in new_orders]
+    ).values_list('driver_id', 'pickup_datetime', 'end_datetime', 'id')
+    schedules: dict[int, IntervalSchedule] = {}
+    for driver_id, pickup_datetime, end_datetime, order_id in qs_scheduled_orders:
+        schedules.setdefault(driver_id, IntervalSchedule()).add(pickup_datetime, end_datetime, order_id)
+    conflicts = []
+    for position, (driver_id, pickup_datetime, duration) in enumerate(new_orders):
+        schedule = schedules.setdefault(driver_id, IntervalSchedule())
+        # The orders overlap when their [pickup_datetime, end_datetime] ranges intersect, limits included.
+        conflict = schedule.overlaps(pickup_datetime, pickup_datetime + duration)
+        if not conflict:
+            # The new orders have no id yet, they are told apart by negative keys.
+            schedule.add(pickup_datetime, pickup_datetime + duration, -position - 1)
+        conflicts.append(conflict)
+    return conflicts
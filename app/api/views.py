@@ -1,32 +1,156 @@
 import datetime
+import json
+from typing import Union
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from urllib.request import Request
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.db import connections, transaction
 from rest_framework import viewsets
 from rest_framework import status
 from rest_framework import permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from core.models import Driver, Order
+from core.signals import bulk_saved
+from core.stats import get_order_stats
+from .cache import closest_driver_cache
+from .indexes import availability_index, driver_index
+from .metrics import metrics_registry
+from .pagination import DriverCursorPagination, OrderCursorPagination, get_page_size
 from .serializers import DriverSerializer, OrderSerializer
+from .serializers import driver_values_serializer, order_values_serializer
 from .utils import get_error_dict
-from .utils import get_closest_driver_by_orders_and_coordinates
-from .utils import get_closest_driver_by_driver_starting_zone
+from .utils import get_closest_driver_id
+from .utils import get_closest_driver_ids
+from .utils import parse_closest_driver_point
+from .utils import get_schedule_conflicts
+from .utils import lock_drivers
+from .utils import get_orders_on_date
+from .utils import filter_drivers_list
+from .utils import filter_orders_list
+from .utils import get_busy_driver_ids
+from .utils import get_next_free_datetime
+from .utils import get_free_slots
+from .utils import get_zone_free_slots
+from .utils import parse_query_filters
 
 
 ########## MODEL VIEW SETS ##########
 
-class DriversViewSet(viewsets.ModelViewSet):
+class AtomicWritesMixin:
+    """Run the writes of a model view set in a transaction, so the drivers states (core.states)
+    are committed with the written row."""
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+
+class DriversViewSet(AtomicWritesMixin, viewsets.ModelViewSet):
     queryset = Driver.objects.all()
     permission_classes = [permissions.AllowAny]
     serializer_class = DriverSerializer
+    pagination_class = DriverCursorPagination
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return queryset
+        try:
+            queryset = filter_drivers_list(queryset, self.request.query_params)
+        except Exception as error:
+            raise ValidationError(get_error_dict(error))
+        # Only the serialized columns are loaded.
+        return queryset.only(*driver_values_serializer.field_names)
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        # Read-only fast path, the same output of DriverSerializer(many = True), one query per page.
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(driver_values_serializer.instances_data(page))
 
-class OrdersViewSet(viewsets.ModelViewSet):
+class OrdersViewSet(AtomicWritesMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     permission_classes = [permissions.AllowAny]
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return queryset
+        try:
+            queryset = filter_orders_list(queryset, self.request.query_params)
+        except Exception as error:
+            raise ValidationError(get_error_dict(error))
+        # Only the serialized columns are loaded. The serializer exposes the driver id, so the
+        # drivers are never queried (no select_related needed).
+        return queryset.only(*order_values_serializer.field_names)
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        # Read-only fast path, the same output of OrderSerializer(many = True), one query per page.
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(order_values_serializer.instances_data(page))
 
 ########## API VIEWS ##########
 
+def parse_filter_date(date_str: Union[str, None]) -> datetime.date:
+    """Parse the date of filter_orders.
+
+    Raises:
+    -------
+        Exception: When the date filter is missing or when the received date does not match with a valid format.
+    """
+    if date_str is None:
+        needed_fields = ['date']
+        raise  Exception(f"Missing parameters. Fields {needed_fields} needed.")
+    return datetime.datetime.strptime(date_str, settings.DEFAULT_DATE_FORMAT).date()
+
+def parse_boolean_field(value, field_name: str) -> bool:
+    """Parse a boolean field of a request body: a JSON boolean, 0 or 1, or one of the strings 'true', 'false', 
+    '1' and '0' (form data).
+
+    Raises:
+    -------
+        Exception: When the value is not a boolean.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ('true', '1', 'false', '0'):
+        return value.lower() in ('true', '1')
+    raise Exception(f"The field '{field_name}' must be a boolean.")
+
+def get_filtered_orders_data(request: Request, filter_date: datetime.date, driver_id: Union[int, None]) -> Union[list, dict]:
+    """The serialized orders of a day (and a driver): all of them, or a page with the 'page_size' or 'cursor'
+    query parameters.
+
+    Raises:
+    -------
+        ValidationError: When the page_size or cursor are not valid.
+    """
+    # Filter by pickup_datetime and, if received, driver id.
+    # Order By: Most recent first (desc).
+    queryset = get_orders_on_date(filter_date, driver_id = driver_id)
+    if 'cursor' in request.query_params or 'page_size' in request.query_params:
+        paginator = OrderCursorPagination()
+        orders = paginator.paginate_queryset(queryset.only(*order_values_serializer.field_names), request)
+        return {
+            'next': paginator.get_next_link(),
+            'next_cursor': paginator.next_cursor,
+            'results': order_values_serializer.instances_data(orders)
+        }
+    return order_values_serializer.data(queryset.order_by('-pickup_datetime'))
+
 @api_view(['POST'])
 @permission_classes((permissions.AllowAny,))
 def schedule_order(request: Request) -> Response:
@@ -53,30 +177,86 @@ def schedule_order(request: Request) -> Response:
         except Exception as error:
             error_dict = get_error_dict(str(error))
             return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
-        # Obtains the orders of the driver that, for the requested moment, intersect with other orders.
-        lower_datetime_limit = new_order_pickup_datetime - settings.DEFAULT_ORDER_DURATION
-        upper_datetime_limit = new_order_pickup_datetime + settings.DEFAULT_ORDER_DURATION
-        qs_cross_orders_count = Order.objects.filter(
-            driver_id = request.data["driver"],
-            pickup_datetime__lte = upper_datetime_limit,
-            pickup_datetime__gte = lower_datetime_limit
-        ).count()
-        # If it finds that there are more orders that intersect with the orders previously 
-        # scheduled for the requested driver, it raise an error.
-        if qs_cross_orders_count > 0:
-            error_dict = get_error_dict("The driver is busy at the requested time. Please try another time.")
-            return Response(error_dict, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
-        # Otherwise save it.
-        order_serializer.save()
+        # The driver schedule is locked until the order is saved, so parallel requests can not both pass the check.
+        with transaction.atomic():
+            driver_id = order_serializer.validated_data['driver'].id
+            lock_drivers([driver_id])
+            # Checks if the new order, from its pickup_datetime to its end, intersects with the orders 
+            # previously scheduled for the requested driver. If it does, it raise an error.
+            new_order_duration = order_serializer.validated_data.get('duration', settings.DEFAULT_ORDER_DURATION)
+            if get_schedule_conflicts([(driver_id, order_serializer.validated_data['pickup_datetime'], new_order_duration)])[0]:
+                error_dict = get_error_dict("The driver is busy at the requested time. Please try another time.")
+                return Response(error_dict, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Otherwise save it.
+            order_serializer.save()
         return Response(order_serializer.data, status = status.HTTP_201_CREATED)
     return Response(order_serializer.errors, status = status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes((permissions.AllowAny,))
+def schedule_orders(request: Request) -> Response:
+    """Schedule many orders at once. Each order is checked against the scheduled orders 
+    and the previous orders of the request, then the accepted orders are saved in a single transaction.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Returns:
+    --------
+        Response: The result of each order: the created Order object or the errors.
+    """
+    orders_data = request.data.get('orders')
+    if not isinstance(orders_data, list):
+        error_dict = get_error_dict("Missing parameters. Field 'orders' (list) needed.")
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    if len(orders_data) > settings.API_MAX_PAGE_SIZE:
+        error_dict = get_error_dict(f"Too many orders. {settings.API_MAX_PAGE_SIZE} orders at most per request.")
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    results: list = [None] * len(orders_data)
+    # Validate every order, keeping the errors of the invalid ones.
+    valid_orders = []
+    for position, order_data in enumerate(orders_data):
+        order_serializer = OrderSerializer(data = order_data)
+        if not order_serializer.is_valid():
+            results[position] = {'accepted': False, 'errors': order_serializer.errors}
+        elif order_serializer.validated_data['pickup_datetime'] < now:
+            error_dict = get_error_dict("It is not possible to schedule an order for a past time.")
+            results[position] = {'accepted': False, 'errors': error_dict}
+        else:
+            valid_orders.append((position, order_serializer.validated_data))
+    new_orders = []
+    # The drivers schedules are locked until the orders are saved, so parallel requests can not both pass the check.
+    with transaction.atomic():
+        lock_drivers(validated_data['driver'].id for _, validated_data in valid_orders)
+        # Detect the orders whose driver is busy, against the database and the previous orders of the request.
+        conflicts = get_schedule_conflicts([(validated_data['driver'].id, validated_data['pickup_datetime'], 
+                                             validated_data.get('duration', settings.DEFAULT_ORDER_DURATION)) 
+                                            for _, validated_data in valid_orders])
+        for (position, validated_data), conflict in zip(valid_orders, conflicts):
+            if conflict:
+                error_dict = get_error_dict("The driver is busy at the requested time. Please try another time.")
+                results[position] = {'accepted': False, 'errors': error_dict}
+            else:
+                new_orders.append((position, Order(**validated_data)))
+        created_orders = Order.objects.bulk_create([order for _, order in new_orders])
+        # Sent inside the transaction, so the drivers states are committed with the orders.
+        bulk_saved.send(sender = Order, instances = created_orders, created = True)
+    for position, order in new_orders:
+        results[position] = {'accepted': True, 'order': OrderSerializer(order).data}
+    return Response(results, status = status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes((permissions.AllowAny,))
 def filter_orders(request: Request, *args, **kwargs) -> Response:
     """Consult all the orders assigned on a specific day ordered by time.
     Consult all the orders of a driver on a specific day ordered by time.
 
+    The orders are returned at once by default. With the 'page_size' or 'cursor' query parameters
+    they are returned in pages, with the cursor of the next page. With the 'stream' query parameter
+    they are streamed as NDJSON (one order per line), keeping the memory constant.
+
     Args:
     -----
         request (Request): The API request object.
@@ -84,7 +264,8 @@ def filter_orders(request: Request, *args, **kwargs) -> Response:
     Raises:
     -------
         Exception: When the date filter is missing
-            or when the received date does not match with a valid format.
+            or when the received date does not match with a valid format
+            or when the page_size or cursor are not valid.
 
     Returns:
     --------
@@ -92,28 +273,51 @@ def filter_orders(request: Request, *args, **kwargs) -> Response:
     """
     date_str = kwargs.get("date")
     driver_id_int = kwargs.get("driver_id")
+    stream = request.query_params.get('stream', '').lower() in ('1', 'true')
     try:
-        if date_str is None:
-            needed_fields = ['date']
-            raise  Exception(f"Missing parameters. Fields {needed_fields} needed.")
-        filter_date = datetime.datetime.strptime(date_str, settings.DEFAULT_DATE_FORMAT).date()
+        filter_date = parse_filter_date(date_str)
     except Exception as error:
         error_dict = get_error_dict(str(error))
         return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
-    else:
-        if driver_id_int is not None:
-            # Filter by pickup_datetime and driver id.
-            # Order By: Most recent first (desc).
-            queryset = Order.objects.filter(pickup_datetime__date = filter_date, 
-                                        driver_id = driver_id_int
-                                        ).order_by('-pickup_datetime')
-        else:
-            # Filter by pickup_datetime.
-            # Order By: Most recent first (desc).
-            queryset = Order.objects.filter(pickup_datetime__date = filter_date).order_by('-pickup_datetime')
-        serlalized_obj = OrderSerializer(queryset, many = True).data
+    if stream:
+        # Filter by pickup_datetime and, if received, driver id.
+        # Order By: Most recent first (desc).
+        queryset = get_orders_on_date(filter_date, driver_id = driver_id_int).order_by('-pickup_datetime', '-id')
+        lines = (json.dumps(order, cls = JSONEncoder) + '\n' for order in order_values_serializer.iter_data(
+            queryset, chunk_size = settings.FILTER_ORDERS_STREAM_CHUNK_SIZE))
+        return StreamingHttpResponse(lines, content_type = 'application/x-ndjson')
+    # An invalid page_size or cursor raise a ValidationError (400).
+    serlalized_obj = get_filtered_orders_data(request, filter_date, driver_id_int)
     return Response(serlalized_obj, status = status.HTTP_200_OK)
 
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def order_stats(request: Request, *args, **kwargs) -> Response:
+    """Consult the number of orders of a day, per hour and per driver.
+    Consult the number of orders of a driver on a day.
+    They are read from the stats tables (core.stats), so the orders themselves are never loaded.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Raises:
+    -------
+        Exception: When the date is missing or when the received date does not match with a valid format.
+
+    Returns:
+    --------
+        Response: The orders of the day, per hour and per driver, or the orders of the driver.
+    """
+    date_str = kwargs.get("date")
+    try:
+        filter_date = parse_filter_date(date_str)
+    except Exception as error:
+        error_dict = get_error_dict(str(error))
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    response = {'date': date_str, **get_order_stats(filter_date, driver_id = kwargs.get("driver_id"))}
+    return Response(response, status = status.HTTP_200_OK)
+
 @api_view(['POST'])
 @permission_classes((permissions.AllowAny,))
 def get_closest_driver(request: Request) -> Response:
@@ -128,33 +332,299 @@ def get_closest_driver(request: Request) -> Response:
     -------
         Response: The nearest (about distance and time) found driver.
     """
-    target_datetime_str = request.data.get('target_datetime')
-    lat_str = request.data.get('lat')
-    lng_str = request.data.get('lng')
     try:
-        if target_datetime_str is None or lat_str is None or lng_str is None:
-            needed_fields = ['target_datetime', 'lat', 'lng']
-            raise  Exception(f"Missing parameters. Fields {needed_fields} needed.")
-        # Every exception parsing the target_datetime or the lat and lng will be catched. 
-        target_datetime = datetime.datetime.strptime(target_datetime_str, settings.DEFAULT_DATETIME_FORMAT)
-        lat = int(lat_str)
-        lng = int(lng_str)
-        # If the order's pickup_datetime is lower than current datetime, raise an exception. 
-        if target_datetime < datetime.datetime.now():
-            raise Exception("It is not possible to search a closest driver an order for a past time.")
+        target_datetime, lat, lng = parse_closest_driver_point(request.data)
     except Exception as error:
         error_dict = get_error_dict(str(error))
         return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
     else:
         # Search nearby drivers by orders coordinates and datetime.
-        selected_driver_id = get_closest_driver_by_orders_and_coordinates(target_datetime, lat, lng)
         # If no nearby drivers are found by orders, search for a driver by initial zone coordinates.
+        selected_driver_id = get_closest_driver_id(target_datetime, lat, lng)
         if selected_driver_id is None:
-            selected_driver_id = get_closest_driver_by_driver_starting_zone(lat, lng, target_datetime)
-            if selected_driver_id is None:
-                error_dict = get_error_dict("Active drivers not found.")
-                return Response(error_dict, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
+            error_dict = get_error_dict("Active drivers not found.")
+            return Response(error_dict, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     selected_driver = Driver.objects.get(pk = selected_driver_id)
     response = DriverSerializer(selected_driver).data
     return Response(response, status = status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes((permissions.AllowAny,))
+def get_closest_drivers(request: Request) -> Response:
+    """Search for the closest driver of many geographical points on a date and time at once. 
+    Optionally, a driver is not returned for two points whose times overlap.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Returns:
+    -------
+        Response: The nearest (about distance and time) found driver of each point, 
+            or the error of the point.
+    """
+    points_data = request.data.get('points')
+    if not isinstance(points_data, list):
+        error_dict = get_error_dict("Missing parameters. Field 'points' (list) needed.")
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    if len(points_data) > settings.API_MAX_PAGE_SIZE:
+        error_dict = get_error_dict(f"Too many points. {settings.API_MAX_PAGE_SIZE} points at most per request.")
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    try:
+        consistent_assignment = parse_boolean_field(request.data.get('consistent_assignment', False), 'consistent_assignment')
+    except Exception as error:
+        return Response(get_error_dict(str(error)), status = status.HTTP_400_BAD_REQUEST)
+    # Parse every point, keeping the error of the invalid ones.
+    points = []
+    results: list = [None] * len(points_data)
+    for position, point_data in enumerate(points_data):
+        try:
+            if not isinstance(point_data, dict):
+                raise Exception("Each point must be an object.")
+            points.append((position, parse_closest_driver_point(point_data)))
+        except Exception as error:
+            results[position] = get_error_dict(str(error))
+    selected_driver_ids = get_closest_driver_ids([point for _, point in points], consistent_assignment)
+    # Load every selected driver with a single query.
+    selected_drivers = Driver.objects.in_bulk(set(filter(None, selected_driver_ids)))
+    for (position, _), selected_driver_id in zip(points, selected_driver_ids):
+        if selected_driver_id is None:
+            results[position] = get_error_dict("Active drivers not found.")
+        else:
+            results[position] = DriverSerializer(selected_drivers[selected_driver_id]).data
+    return Response(results, status = status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def driver_availability(request: Request, *args, **kwargs) -> Response:
+    """Consult the drivers that are free (not busy with an order) on a date and time.
+    Consult if a driver is free on a date and time, and when it is free next.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Raises:
+    -------
+        Exception: When the received datetime does not match with a valid format or it is a past time.
+
+    Returns:
+    --------
+        Response: The free and busy drivers ids, or the availability of the driver.
+    """
+    target_datetime_str = kwargs.get("target_datetime")
+    driver_id = kwargs.get("driver_id")
+    try:
+        target_datetime = datetime.datetime.strptime(target_datetime_str, settings.DEFAULT_DATETIME_FORMAT)
+        # If the target_datetime is lower than current datetime, raise an exception. 
+        if target_datetime < datetime.datetime.now():
+            raise Exception("It is not possible to consult the availability for a past time.")
+    except Exception as error:
+        error_dict = get_error_dict(str(error))
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    target_datetime = target_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    availability_index.ensure_fresh()
+    driver_index.ensure_fresh()
+    if driver_id is None:
+        driver_ids = driver_index.indexed_ids()
+        busy_driver_ids = get_busy_driver_ids(target_datetime)
+        response = {
+            'target_datetime': target_datetime_str,
+            'free_driver_ids': [driver_id for driver_id in driver_ids if driver_id not in busy_driver_ids],
+            'busy_driver_ids': [driver_id for driver_id in driver_ids if driver_id in busy_driver_ids]
+        }
+        return Response(response, status = status.HTTP_200_OK)
+    if driver_index.indexed_position(driver_id) is None:
+        error_dict = get_error_dict("Driver not found.")
+        return Response(error_dict, status = status.HTTP_404_NOT_FOUND)
+    next_free_datetime = get_next_free_datetime(driver_id, target_datetime)
+    response = {
+        'driver': driver_id,
+        'target_datetime': target_datetime_str,
+        'free': next_free_datetime == target_datetime,
+        'next_free_datetime': next_free_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+    }
+    return Response(response, status = status.HTTP_200_OK)
+
+def format_slots(slots: list[tuple[datetime.datetime, datetime.datetime]]) -> list[dict[str, str]]:
+    """The free slots as the earliest and latest pickup datetimes (DEFAULT_DATETIME_FORMAT) of each one."""
+    return [{
+        'earliest_pickup_datetime': earliest_pickup_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+        'latest_pickup_datetime': latest_pickup_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+    } for earliest_pickup_datetime, latest_pickup_datetime in slots]
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def free_slots(request: Request, *args, **kwargs) -> Response:
+    """Consult the free slots of a driver between two datetimes: the ranges of pickup datetimes 
+    that schedule_order accepts for the driver. Without a driver, consult the free slots of the drivers 
+    of a zone (lat, lng and radius query parameters), the drivers with the earliest slot first.
+
+    The range is received on the start_datetime (now by default) and end_datetime 
+    (start_datetime + FREE_SLOTS_DEFAULT_RANGE by default) query parameters, and the duration 
+    of the order in minutes on the duration query parameter (DEFAULT_ORDER_DURATION by default).
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Raises:
+    -------
+        Exception: When a query parameter is missing or not valid, the start_datetime is a past time,
+            the range is longer than FREE_SLOTS_MAX_RANGE or the duration longer than MAX_ORDER_DURATION.
+
+    Returns:
+    --------
+        Response: The free slots of the driver, or of each driver of the zone.
+    """
+    driver_id = kwargs.get("driver_id")
+    now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+    try:
+        filters = parse_query_filters(request.query_params, int_names = ['lat', 'lng', 'radius', 'duration'], 
+                                      datetime_names = ['start_datetime', 'end_datetime'])
+        duration = datetime.timedelta(minutes = filters['duration']) if 'duration' in filters else settings.DEFAULT_ORDER_DURATION
+        if not datetime.timedelta(0) < duration <= settings.MAX_ORDER_DURATION:
+            raise Exception(f"The duration must be positive and not longer than {settings.MAX_ORDER_DURATION}.")
+        start_datetime = filters.get('start_datetime', now)
+        # If the start_datetime is lower than current datetime, raise an exception. 
+        if start_datetime < now:
+            raise Exception("It is not possible to search free slots for a past time.")
+        end_datetime = filters.get('end_datetime', start_datetime + settings.FREE_SLOTS_DEFAULT_RANGE)
+        # The slots start on the next second at the earliest, as schedule_order rejects the past pickups.
+        start_datetime = max(start_datetime, now + datetime.timedelta(seconds = 1))
+        if not start_datetime <= end_datetime <= start_datetime + settings.FREE_SLOTS_MAX_RANGE:
+            raise Exception(f"The end_datetime must be after the start_datetime, by {settings.FREE_SLOTS_MAX_RANGE} at most.")
+        if driver_id is None and ('lat' not in filters or 'lng' not in filters):
+            raise Exception("Missing parameters. Fields ['lat', 'lng'] needed without a driver.")
+    except Exception as error:
+        error_dict = get_error_dict(str(error))
+        return Response(error_dict, status = status.HTTP_400_BAD_REQUEST)
+    availability_index.ensure_fresh()
+    driver_index.ensure_fresh()
+    if driver_id is not None:
+        if driver_index.indexed_position(driver_id) is None:
+            error_dict = get_error_dict("Driver not found.")
+            return Response(error_dict, status = status.HTTP_404_NOT_FOUND)
+        response = {
+            'driver': driver_id,
+            'slots': format_slots(get_free_slots(driver_id, start_datetime, end_datetime, duration = duration))
+        }
+        return Response(response, status = status.HTTP_200_OK)
+    # An invalid page_size raises a ValidationError (400).
+    drivers_slots = get_zone_free_slots(filters['lat'], filters['lng'], 
+                                        filters.get('radius', settings.FREE_SLOTS_DEFAULT_RADIUS), 
+                                        start_datetime, end_datetime, get_page_size(request), duration = duration)
+    response = [{'driver': driver_id, 'distance': distance, 'slots': format_slots(slots)} 
+                for driver_id, distance, slots in drivers_slots]
+    return Response(response, status = status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def closest_driver_cache_stats(request: Request) -> Response:
+    """Consult the hits and misses of the closest-driver results cache on this process.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Returns:
+    -------
+        Response: The hits, misses and hit rate counters.
+    """
+    return Response(closest_driver_cache.stats(), status = status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def request_metrics(request: Request) -> Response:
+    """Consult the per-endpoint request metrics of this process: totals since it started and 
+    the percentiles of the last requests. Only for the REQUEST_METRICS_ALLOWED_IPS clients.
+
+    Args:
+    -----
+        request (Request): The API request object.
+
+    Returns:
+    -------
+        Response: The metrics of each endpoint.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.REQUEST_METRICS_ALLOWED_IPS:
+        error_dict = get_error_dict("The metrics are only available to local clients.")
+        return Response(error_dict, status = status.HTTP_403_FORBIDDEN)
+    return Response(metrics_registry.summary(), status = status.HTTP_200_OK)
+
+########## ASYNC API VIEWS ##########
+# Served by the ASGI application (orders_challenge.asgi). Django 4.0 has no async ORM, so the
+# database work runs through sync_to_async while the event loop keeps serving the other requests.
+# It only reads, so it runs on the threads of the executor (thread_sensitive = False) instead of
+# queuing on the thread shared by the sync code.
+
+def read_only_sync_to_async(function):
+    """sync_to_async on the threads of the executor, for the read-only database work of the async views.
+    Each thread opens its own connection, which is closed after the call: the request_finished signal only
+    closes the connections of the thread shared by the sync code. The reads do not see the uncommitted
+    writes of that thread."""
+    def call(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return sync_to_async(call, thread_sensitive = False)
+
+def render_json(data, status_code: int = status.HTTP_200_OK) -> HttpResponse:
+    """A JSON response rendered as the DRF views do, so both versions of an endpoint return the same bytes."""
+    return HttpResponse(JSONRenderer().render(data), status = status_code, content_type = 'application/json')
+
+async def async_get_closest_driver(request: HttpRequest) -> HttpResponse:
+    """Async version of get_closest_driver. It receives the same JSON body and returns the same response.
+
+    Args:
+    -----
+        request (HttpRequest): The request object.
+
+    Returns:
+    -------
+        HttpResponse: The nearest (about distance and time) found driver.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        target_datetime, lat, lng = parse_closest_driver_point(json.loads(request.body or b'{}'))
+    except Exception as error:
+        return render_json(get_error_dict(str(error)), status.HTTP_400_BAD_REQUEST)
+    selected_driver_id = await read_only_sync_to_async(get_closest_driver_id)(target_datetime, lat, lng)
+    if selected_driver_id is None:
+        return render_json(get_error_dict("Active drivers not found."), status.HTTP_500_INTERNAL_SERVER_ERROR)
+    selected_driver = await read_only_sync_to_async(driver_values_serializer.data)(Driver.objects.filter(pk = selected_driver_id))
+    return render_json(selected_driver[0])
+
+async def async_filter_orders(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+    """Async version of filter_orders, with the same all-at-once and paginated responses.
+    The NDJSON stream is only served by filter_orders: Django 4.0 iterates the streamed responses 
+    inside the event loop, where the database can not be queried.
+
+    Args:
+    -----
+        request (HttpRequest): The request object.
+
+    Returns:
+    --------
+        HttpResponse: The filtered orders.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        filter_date = parse_filter_date(kwargs.get("date"))
+        if request.GET.get('stream', '').lower() in ('1', 'true'):
+            raise Exception("The orders stream is served by /api/filter_orders/.")
+    except Exception as error:
+        return render_json(get_error_dict(str(error)), status.HTTP_400_BAD_REQUEST)
+    try:
+        data = await read_only_sync_to_async(get_filtered_orders_data)(Request(request), filter_date, kwargs.get("driver_id"))
+    except ValidationError as error:
+        return render_json(error.detail, status.HTTP_400_BAD_REQUEST)
+    return render_json(data)
+
+# The async views are not DRF views, which are exempt from the CSRF check by default.
+async_get_closest_driver.csrf_exempt = True
+async_filter_orders.csrf_exempt = True
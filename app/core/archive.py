@@ -0,0 +1,84 @@
+import datetime
+from typing import Union
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from core.models import ArchivedOrder, Order
+from core.signals import bulk_deleted
+
+
+# The columns copied from the Order table to the archive, the id included.
+ARCHIVED_FIELDS = [field.attname for field in ArchivedOrder._meta.concrete_fields]
+
+def get_archived_through() -> Union[datetime.date, None]:
+    """The last day whose orders are archived. None if the archive is empty.
+    The archive holds whole days, so every order of that day and the previous ones is archived.
+    Served by the (pickup_datetime) index of the archive.
+    """
+    value = ArchivedOrder.objects.aggregate(value = Max('pickup_datetime'))['value']
+    return value.astimezone(settings.TIME_ZONE_PYTZ).date() if value is not None else None
+
+def is_archived_date(value: datetime.date) -> bool:
+    """If the orders of a day are on the archive instead of the Order table.
+    The days that can still have active orders are never archived, so they skip the query.
+    """
+    if value >= (timezone.now() - settings.MAX_ORDER_DURATION).astimezone(settings.TIME_ZONE_PYTZ).date():
+        return False
+    archived_through = get_archived_through()
+    return archived_through is not None and value <= archived_through
+
+def get_archive_cutoff(days: int) -> datetime.date:
+    """The first day kept on the Order table when the orders older than some days are archived.
+    It is moved back if needed, so no order of the archived days can still be active.
+    """
+    now = timezone.now().astimezone(settings.TIME_ZONE_PYTZ)
+    return min(now.date() - datetime.timedelta(days = days), (now - settings.MAX_ORDER_DURATION).date())
+
+def _delete_orders(order_ids: list[int]) -> None:
+    """Delete some orders with a single DELETE, without loading them again nor sending a post_delete per order."""
+    queryset = Order.objects.filter(pk__in = order_ids)
+    queryset._raw_delete(queryset.db)
+
+def archive_orders(cutoff_date: datetime.date, batch_size: Union[int, None] = None) -> int:
+    """Move the orders picked up before a day from the Order table to the archive, oldest day first.
+    Each day is moved in its own transaction, so the archive always holds whole days (see get_archived_through),
+    even when a run is interrupted. Its orders are copied and deleted in batches, and bulk_deleted is sent with
+    the moved orders so the in-memory indexes and the drivers states drop them.
+
+    Args:
+    -----
+        cutoff_date (datetime.date): The first day kept on the Order table.
+        batch_size (Union[int, None]): The orders copied and deleted per statement. ORDER_ARCHIVE_BATCH_SIZE by default.
+
+    Raises:
+    -------
+        Exception: When an order picked up before the cutoff_date can still be active.
+
+    Returns:
+    --------
+        int: The number of archived orders.
+    """
+    cutoff_datetime = datetime.datetime.combine(cutoff_date, datetime.time.min).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    if cutoff_datetime > timezone.now() - settings.MAX_ORDER_DURATION:
+        raise Exception(f"The orders picked up before {cutoff_date} can still be active.")
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    archived = 0
+    # Served by the (pickup_datetime) index.
+    queryset = Order.objects.filter(pickup_datetime__lt = cutoff_datetime).order_by('pickup_datetime', 'id')
+    while (first_pickup_datetime := queryset.values_list('pickup_datetime', flat = True).first()) is not None:
+        day = first_pickup_datetime.astimezone(settings.TIME_ZONE_PYTZ).date()
+        day_end_datetime = datetime.datetime.combine(day + datetime.timedelta(days = 1), 
+                                                     datetime.time.min).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        with transaction.atomic():
+            while rows := list(queryset.filter(pickup_datetime__lt = day_end_datetime).values(*ARCHIVED_FIELDS)[:batch_size]):
+                ArchivedOrder.objects.bulk_create([ArchivedOrder(**row) for row in rows])
+                _delete_orders([row['id'] for row in rows])
+                # Sent inside the transaction, so the drivers states are committed with the move.
+                bulk_deleted.send(sender = Order, instances = [Order(**row) for row in rows], archived = True)
+                archived += len(rows)
+    return archived
+
+def archive_completed_orders(days: Union[int, None] = None) -> int:
+    """Archive the orders older than some days (ORDER_ARCHIVE_AFTER_DAYS by default). Returns the number of archived orders."""
+    return archive_orders(get_archive_cutoff(settings.ORDER_ARCHIVE_AFTER_DAYS if days is None else days))
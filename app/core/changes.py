@@ -0,0 +1,55 @@
+import datetime
+import secrets
+from typing import Iterable, Union
+from django.conf import settings
+from django.utils import timezone
+from core.models import TableChange
+
+
+def record_table_changes(model, row_ids: Iterable[Union[int, None]]) -> dict[tuple[int, int], Union[int, None]]:
+    """Append some written (or deleted) rows to the changes log of their table (see core.models.TableChange).
+    It runs in the transaction of the write, so the entries are committed (or rolled back) with it.
+
+    Args:
+    -----
+        model: The written model.
+        row_ids (Iterable[Union[int, None]]): The ids of the written rows. None for rows whose ids are unknown
+            (e.g. created by bulk_create on a database backend that does not return them).
+
+    Returns:
+    --------
+        dict[tuple[int, int], Union[int, None]]: The row_id of each appended entry, by (id, batch). Empty when 
+            the database backend does not return the ids of the entries.
+    """
+    table = model._meta.db_table
+    batch = secrets.randbits(62)
+    changes = TableChange.objects.bulk_create([TableChange(table = table, row_id = row_id, batch = batch) 
+                                               for row_id in set(row_ids)])
+    return {(change.id, batch): change.row_id for change in changes if change.id is not None}
+
+def get_last_table_change_id(model) -> int:
+    """The id of the last entry of the changes log of the table of a model. 0 if there is none.
+    Served by the (table, id) index."""
+    return TableChange.objects.filter(table = model._meta.db_table).order_by('-id').values_list('id', flat = True).first() or 0
+
+def get_table_changes(model, after_id: int) -> list[tuple[int, Union[int, None], int]]:
+    """The (id, row_id, batch) of the entries of the changes log of the table of a model after an entry, in order.
+    Served by the (table, id) index."""
+    return list(TableChange.objects.filter(table = model._meta.db_table, id__gt = after_id).order_by('id')
+                .values_list('id', 'row_id', 'batch'))
+
+def get_table_change_batches(change_ids: Iterable[int]) -> dict[int, int]:
+    """The batch of the visible entries of the changes log among some, by id. The rolled back ones are missing, 
+    or hold the entry of another write."""
+    return dict(TableChange.objects.filter(id__in = list(change_ids)).values_list('id', 'batch'))
+
+def prune_table_changes(max_age: Union[datetime.timedelta, None] = None) -> int:
+    """Delete the entries of the changes log older than max_age (twice the MATCHING_INDEX_MAX_AGE by default).
+    The indexes are rebuilt after MATCHING_INDEX_MAX_AGE, so no index can still need them.
+
+    Returns:
+    --------
+        int: The number of deleted entries.
+    """
+    max_age = max_age if max_age is not None else 2 * settings.MATCHING_INDEX_MAX_AGE
+    return TableChange.objects.filter(created_at__lt = timezone.now() - max_age).delete()[0]
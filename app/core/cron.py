@@ -1,22 +1,110 @@
 from django.conf import settings
-import requests
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import datetime
+import itertools
+import time
+from typing import Iterable
+from core.feed import FeedNotModified, get_feed, iter_feed_chunks, iter_feed_drivers, save_feed_validators
 from core.models import Driver
+from core.signals import bulk_saved
 
 
+def parse_feed_datetime(value: str) -> datetime.datetime:
+    """Parse a 'lastUpdate' value of the drivers feed to an aware datetime."""
+    parsed_datetime = parse_datetime(value)
+    if parsed_datetime is None:
+        raise ValueError(f"Invalid lastUpdate value: {value}")
+    if timezone.is_naive(parsed_datetime):
+        parsed_datetime = parsed_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    return parsed_datetime
+
+def sync_drivers_location(drivers_list: list) -> dict[str, int]:
+    """Save or update the Drivers of the feed on Database with bulk operations.
+    The Drivers whose lastUpdate is not newer than the saved last_update are skipped.
+
+    Args:
+    -----
+        drivers_list (list): The drivers of the feed, with id, lat, lng and lastUpdate.
+
+    Returns:
+    --------
+        dict[str, int]: The received, created, updated and unchanged drivers counts.
+    """
+    # The last entry of a driver wins, as it did updating them one by one.
+    incoming_drivers = {}
+    for driver in drivers_list:
+        incoming_drivers[int(driver['id'])] = (int(driver['lat']), int(driver['lng']),
+                                               parse_feed_datetime(driver['lastUpdate']))
+    drivers_to_create = []
+    drivers_to_update = []
+    with transaction.atomic():
+        current_drivers = Driver.objects.in_bulk(list(incoming_drivers))
+        for driver_id, (lat, lng, last_update) in incoming_drivers.items():
+            driver = current_drivers.get(driver_id)
+            if driver is None:
+                drivers_to_create.append(Driver(id = driver_id, lat = lat, lng = lng, last_update = last_update))
+            elif last_update > driver.last_update:
+                driver.lat, driver.lng, driver.last_update = lat, lng, last_update
+                drivers_to_update.append(driver)
+        Driver.objects.bulk_create(drivers_to_create, batch_size = settings.DRIVERS_SYNC_BATCH_SIZE)
+        Driver.objects.bulk_update(drivers_to_update, ['lat', 'lng', 'last_update'],
+                                   batch_size = settings.DRIVERS_SYNC_BATCH_SIZE)
+        # Sent inside the transaction, so the drivers states are committed with the positions.
+        bulk_saved.send(sender = Driver, instances = drivers_to_create + drivers_to_update)
+    return {
+        'received': len(drivers_list),
+        'created': len(drivers_to_create),
+        'updated': len(drivers_to_update),
+        'unchanged': len(incoming_drivers) - len(drivers_to_create) - len(drivers_to_update)
+    }
+
+def sync_drivers_location_in_chunks(drivers: Iterable[dict], chunk_size: int = None) -> dict[str, int]:
+    """Save or update the Drivers of the feed in fixed-size chunks, as they are received.
+
+    Args:
+    -----
+        drivers (Iterable[dict]): The drivers of the feed, with id, lat, lng and lastUpdate.
+        chunk_size (int): The drivers per chunk. DRIVERS_SYNC_CHUNK_SIZE by default.
+
+    Returns:
+    --------
+        dict[str, int]: The received, created, updated and unchanged drivers counts.
+    """
+    chunk_size = chunk_size or settings.DRIVERS_SYNC_CHUNK_SIZE
+    drivers = iter(drivers)
+    counts = {'received': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+    while drivers_chunk := list(itertools.islice(drivers, chunk_size)):
+        for name, count in sync_drivers_location(drivers_chunk).items():
+            counts[name] += count
+    return counts
+
 def fetch_drivers_location():
     """Fetch the Drivers data from external system. 
     Then save or update the Driver on Database.
+    The fetch is a conditional request, so a not modified feed is neither downloaded nor saved.
+    With DRIVERS_LOCATION_STREAMING, the feed is parsed and saved in chunks while it is downloaded.
     """
-    response = requests.get(settings.DRIVERS_LOCATION_URL, verify = False)
-    data = response.json()
-    drivers_list: list = data['alfreds']
-    print("Fetched at: ", datetime.datetime.now(), " - ", drivers_list)
-    for driver in drivers_list:
-        # Update or create the Driver object
-        defaults = {
-            "lat": driver['lat'], 
-            "lng": driver['lng'], 
-            "last_update": driver['lastUpdate']
-        }
-        driver, created = Driver.objects.update_or_create(id = driver['id'], defaults = defaults)
+    start_time = time.monotonic()
+    url = settings.DRIVERS_LOCATION_URL
+    try:
+        if settings.DRIVERS_LOCATION_STREAMING:
+            response_headers = {}
+            drivers = iter_feed_drivers(iter_feed_chunks(url, response_headers = response_headers))
+            counts = sync_drivers_location_in_chunks(drivers)
+        else:
+            response = get_feed(url)
+            response_headers = response.headers
+            data = response.json()
+            drivers_list: list = data['alfreds']
+            counts = sync_drivers_location(drivers_list)
+    except FeedNotModified:
+        print("Fetched at: ", datetime.datetime.now(), " - not modified", 
+              f" - fetch: {time.monotonic() - start_time:.3f}s")
+        return
+    # The validators are saved once the feed is processed, so a failed sync is fetched again.
+    save_feed_validators(url, response_headers)
+    print("Fetched at: ", datetime.datetime.now(), " - ", 
+          ", ".join(f"{name}: {count}" for name, count in counts.items()), 
+          f" - fetch and sync: {time.monotonic() - start_time:.3f}s")
@@ -0,0 +1,142 @@
+import json
+import re
+from pathlib import Path
+from typing import Iterable, Iterator
+from urllib.parse import urlparse
+from django.conf import settings
+from django.core.cache import caches
+import requests
+
+
+class FeedNotModified(Exception):
+    """The drivers feed did not change since the last fetch (HTTP 304)."""
+
+
+# Persistent session, so the connections to the feed are pooled and reused between fetches.
+feed_session = requests.Session()
+feed_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = 4))
+feed_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = 4))
+
+FEED_LIST_START = re.compile(r'"alfreds"\s*:\s*\[')
+JSON_DECODER = json.JSONDecoder()
+WHITESPACE_AND_COMMAS = ' \t\n\r,'
+
+def get_conditional_headers(url: str) -> dict[str, str]:
+    """The If-None-Match and If-Modified-Since headers of the last processed fetch of a feed url."""
+    validators = caches[settings.DRIVERS_LOCATION_CACHE].get(f'feed_validators:{url}', {})
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def save_feed_validators(url: str, response_headers) -> None:
+    """Save the ETag and Last-Modified of a processed fetch, to send a conditional request next time.
+
+    Args:
+    -----
+        url (str): The feed url.
+        response_headers: The headers of the processed response.
+    """
+    validators = {'etag': response_headers.get('ETag'), 'last_modified': response_headers.get('Last-Modified')}
+    caches[settings.DRIVERS_LOCATION_CACHE].set(f'feed_validators:{url}', validators, timeout = None)
+
+def get_feed(url: str, stream: bool = False) -> requests.Response:
+    """Conditional GET of the drivers feed, using the pooled session.
+
+    Raises:
+    -------
+        FeedNotModified: When the feed did not change since the last processed fetch.
+    """
+    response = feed_session.get(url, verify = False, stream = stream, headers = get_conditional_headers(url),
+                                timeout = settings.DRIVERS_FEED_TIMEOUT)
+    if response.status_code == 304:
+        response.close()
+        raise FeedNotModified()
+    response.raise_for_status()
+    return response
+
+def iter_feed_chunks(url: str, read_size: int = None, response_headers: dict = None) -> Iterator[str]:
+    """Read the drivers feed in text chunks, without loading it whole in memory.
+
+    Args:
+    -----
+        url (str): The feed url. A file:// url or a local path reads a local file.
+        read_size (int): The size of the chunks. DRIVERS_FEED_READ_SIZE by default.
+        response_headers (dict): If given, it is filled with the headers of the HTTP response.
+
+    Raises:
+    -------
+        FeedNotModified: When the feed did not change since the last processed fetch.
+
+    Yields:
+    -------
+        Iterator[str]: The text chunks of the feed.
+    """
+    read_size = read_size or settings.DRIVERS_FEED_READ_SIZE
+    parsed_url = urlparse(url)
+    if parsed_url.scheme in ('http', 'https'):
+        with get_feed(url, stream = True) as response:
+            if response_headers is not None:
+                response_headers.update(response.headers)
+            response.encoding = response.encoding or 'utf-8'
+            yield from response.iter_content(chunk_size = read_size, decode_unicode = True)
+    else:
+        path = Path(parsed_url.path if parsed_url.scheme == 'file' else url)
+        with path.open(encoding = 'utf-8') as feed_file:
+            while chunk := feed_file.read(read_size):
+                yield chunk
+
+def iter_feed_drivers(chunks: Iterable[str]) -> Iterator[dict]:
+    """Parse incrementally the 'alfreds' list of the drivers feed.
+    Only the chunk being parsed is kept in memory.
+
+    Args:
+    -----
+        chunks (Iterable[str]): The text chunks of the feed.
+
+    Raises:
+    -------
+        ValueError: When the feed has no 'alfreds' list or it is truncated or invalid.
+
+    Yields:
+    -------
+        Iterator[dict]: The drivers of the feed.
+    """
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+
+    def read_more() -> bool:
+        # Drop the parsed text and append the next chunk.
+        nonlocal buffer, position
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    # Skip everything up to the start of the drivers list.
+    while (list_start := FEED_LIST_START.search(buffer)) is None:
+        if not read_more():
+            raise ValueError("The drivers feed has no 'alfreds' list.")
+    position = list_start.end()
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE_AND_COMMAS:
+            position += 1
+        if position == len(buffer):
+            if not read_more():
+                raise ValueError("The drivers feed is truncated.")
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            driver, position = JSON_DECODER.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The driver is not complete yet, read the next chunk and try again.
+            if not read_more():
+                raise ValueError("The drivers feed is truncated or invalid.")
+            continue
+        yield driver
@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Iterable
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from core.archive import archive_completed_orders
+from core.changes import prune_table_changes
+from core.cron import parse_feed_datetime, sync_drivers_location_in_chunks
+from core.feed import FeedNotModified, iter_feed_chunks, iter_feed_drivers, save_feed_validators
+
+
+logger = logging.getLogger(__name__)
+
+
+class DriversLocationIngestor:
+    """Long-running ingestion of the drivers location feed.
+
+    The feed is polled every poll_interval seconds (a conditional request, so a not modified feed
+    costs one round trip). The received updates are coalesced per driver while the feed is parsed,
+    keeping the newest lastUpdate, and flushed to the database every flush_interval seconds or when
+    batch_size drivers are pending (also in the middle of a feed). The database writes share
+    core.cron.sync_drivers_location with the cron job. A failed poll or flush is logged and retried
+    after a backoff that doubles up to DRIVERS_LOCATION_MAX_BACKOFF seconds. Every MATCHING_INDEX_MAX_AGE,
+    the old entries of the tables changes log are pruned (see core.changes), and once a day, from
+    ORDER_ARCHIVE_HOUR on, the completed orders are archived (see core.archive).
+    """
+
+    def __init__(self, url: str = None, poll_interval: float = None, flush_interval: float = None, 
+                 batch_size: int = None):
+        self.url = url or settings.DRIVERS_LOCATION_URL
+        self.poll_interval = poll_interval if poll_interval is not None else settings.DRIVERS_LOCATION_POLL_INTERVAL
+        self.flush_interval = flush_interval if flush_interval is not None else settings.DRIVERS_LOCATION_FLUSH_INTERVAL
+        self.batch_size = batch_size or settings.DRIVERS_SYNC_CHUNK_SIZE
+        # Driver id -> (lastUpdate, feed driver).
+        self._pending: dict[int, tuple[datetime.datetime, dict]] = {}
+        # The validators of the polled responses, saved once their drivers are flushed.
+        self._pending_response_headers = None
+        self._last_flush = time.monotonic()
+        self._last_prune = time.monotonic()
+        # The local day of the last archive run.
+        self._archived_on = None
+        self.totals = {'polls': 0, 'not_modified': 0, 'errors': 0, 'flushes': 0, 
+                       'received': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'pruned_changes': 0, 
+                       'archived_orders': 0}
+
+    def _poll(self) -> None:
+        """Fetch the feed and coalesce its drivers while it is parsed, so only the pending drivers are kept
+        in memory. They are flushed whenever batch_size of them are pending."""
+        response_headers = {}
+        try:
+            for driver in iter_feed_drivers(iter_feed_chunks(self.url, response_headers = response_headers)):
+                try:
+                    self.coalesce([driver])
+                except (KeyError, TypeError, ValueError):
+                    # A malformed driver does not stop the rest of the feed.
+                    logger.warning("Skipped an invalid driver of the drivers location feed: %r", driver)
+                    continue
+                if len(self._pending) >= self.batch_size:
+                    self._flush()
+        except FeedNotModified:
+            self.totals['not_modified'] += 1
+            return
+        self._pending_response_headers = response_headers
+
+    def coalesce(self, drivers: Iterable[dict]) -> None:
+        """Keep the newest update of each driver."""
+        for driver in drivers:
+            last_update = parse_feed_datetime(driver['lastUpdate'])
+            pending = self._pending.get(int(driver['id']))
+            if pending is None or last_update >= pending[0]:
+                self._pending[int(driver['id'])] = (last_update, driver)
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        drivers_list = [driver for _, driver in self._pending.values()]
+        counts = sync_drivers_location_in_chunks(drivers_list, self.batch_size)
+        # Kept until they are saved, so a failed flush is retried with the next one.
+        self._pending = {}
+        if self._pending_response_headers is not None:
+            save_feed_validators(self.url, self._pending_response_headers)
+            self._pending_response_headers = None
+        self.totals['flushes'] += 1
+        for name, count in counts.items():
+            self.totals[name] += count
+
+    async def flush(self) -> None:
+        """Save the pending drivers on Database."""
+        await sync_to_async(self._flush)()
+
+    async def prune(self) -> None:
+        """Delete the old entries of the tables changes log."""
+        self._last_prune = time.monotonic()
+        self.totals['pruned_changes'] += await sync_to_async(prune_table_changes)()
+
+    async def archive(self) -> None:
+        """Move the completed orders to the archive."""
+        self._archived_on = timezone.now().astimezone(settings.TIME_ZONE_PYTZ).date()
+        self.totals['archived_orders'] += await sync_to_async(archive_completed_orders)()
+
+    def _archive_is_due(self) -> bool:
+        now = timezone.now().astimezone(settings.TIME_ZONE_PYTZ)
+        return now.date() != self._archived_on and now.hour >= settings.ORDER_ARCHIVE_HOUR
+
+    async def _poll_and_flush(self) -> None:
+        # Run where the flushes run, so the polls can flush the pending drivers too.
+        await sync_to_async(self._poll)()
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+        if time.monotonic() - self._last_prune >= settings.MATCHING_INDEX_MAX_AGE.total_seconds():
+            await self.prune()
+        if self._archive_is_due():
+            await self.archive()
+
+    async def run(self, max_polls: int = None) -> None:
+        """Poll the feed until cancelled, or max_polls times. The errors do not stop it."""
+        backoff = 0
+        try:
+            while max_polls is None or self.totals['polls'] < max_polls:
+                poll_start = time.monotonic()
+                self.totals['polls'] += 1
+                try:
+                    await self._poll_and_flush()
+                except Exception:
+                    self.totals['errors'] += 1
+                    backoff = min(max(backoff * 2, self.poll_interval, 0.1), settings.DRIVERS_LOCATION_MAX_BACKOFF)
+                    logger.exception("Drivers location ingestion failed, retrying in %.1fs.", backoff)
+                    await asyncio.sleep(backoff)
+                    continue
+                backoff = 0
+                await asyncio.sleep(max(0, self.poll_interval - (time.monotonic() - poll_start)))
+        finally:
+            await self.flush()
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.archive import archive_orders, get_archive_cutoff
+
+
+class Command(BaseCommand):
+    help = ("Move the orders of the completed days older than --days from the Order table (hot) to the "
+            "archive (cold), one day per transaction. filter_orders reads the archived days from the archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type = int, default = settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help = "Archive the days older than this number of days.")
+        parser.add_argument('--batch-size', type = int, default = settings.ORDER_ARCHIVE_BATCH_SIZE,
+                            help = "Orders copied and deleted per statement (each day is moved in one transaction).")
+
+    def handle(self, *args, **options):
+        cutoff_date = get_archive_cutoff(options['days'])
+        archived = archive_orders(cutoff_date, batch_size = options['batch_size'])
+        self.stdout.write(f"archived orders: {archived} (picked up before {cutoff_date})")
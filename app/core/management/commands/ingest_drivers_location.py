@@ -0,0 +1,26 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from core.ingest import DriversLocationIngestor
+
+
+class Command(BaseCommand):
+    help = "Poll the drivers location feed and save the coalesced updates in batches, until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help = "The feed url. DRIVERS_LOCATION_URL by default.")
+        parser.add_argument('--interval', type = float, 
+                            help = "Seconds between polls. DRIVERS_LOCATION_POLL_INTERVAL by default.")
+        parser.add_argument('--flush-interval', type = float, 
+                            help = "Max seconds between database flushes. DRIVERS_LOCATION_FLUSH_INTERVAL by default.")
+        parser.add_argument('--batch-size', type = int, 
+                            help = "Pending drivers that force a flush. DRIVERS_SYNC_CHUNK_SIZE by default.")
+        parser.add_argument('--polls', type = int, help = "Stop after this number of polls.")
+
+    def handle(self, *args, **options):
+        ingestor = DriversLocationIngestor(url = options['url'], poll_interval = options['interval'], 
+                                           flush_interval = options['flush_interval'], batch_size = options['batch_size'])
+        try:
+            asyncio.run(ingestor.run(max_polls = options['polls']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in ingestor.totals.items()))
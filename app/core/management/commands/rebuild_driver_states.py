@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from core.states import rebuild_driver_states
+
+
+class Command(BaseCommand):
+    help = ("Recompute the DriverState table (last known position, busy until and last delivery coordinates "
+            "of every driver) from the Driver and Order tables, e.g. to backfill it.")
+
+    def handle(self, *args, **options):
+        states = rebuild_driver_states()
+        self.stdout.write(f"driver states: {states}")
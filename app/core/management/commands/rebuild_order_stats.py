@@ -0,0 +1,18 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.stats import rebuild_order_stats
+
+
+class Command(BaseCommand):
+    help = ("Recompute the daily, driver daily and hourly order stats from the Order and ArchivedOrder tables, "
+            "e.g. to backfill them. Only the days of --date, if received.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', action = 'append', dest = 'dates',
+                            type = lambda value: datetime.datetime.strptime(value, settings.DEFAULT_DATE_FORMAT).date(),
+                            help = f"A day ({settings.DEFAULT_DATE_FORMAT}) to recompute. It can be repeated.")
+
+    def handle(self, *args, **options):
+        days = rebuild_order_stats(options['dates'])
+        self.stdout.write(f"days with orders: {days}")
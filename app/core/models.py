@@ -1,10 +1,82 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+
+def get_default_order_duration():
+    """The duration of the orders scheduled without one (DEFAULT_ORDER_DURATION setting)."""
+    return settings.DEFAULT_ORDER_DURATION
+
+class OrderEndDateTimeField(models.DateTimeField):
+    """The end of an order: its pickup_datetime + duration, computed on every write (bulk_create included, 
+    QuerySet.update and bulk_update through OrderQuerySet)."""
+
+    def pre_save(self, model_instance, add):
+        pickup_datetime = self.to_python(model_instance.pickup_datetime)
+        duration = model_instance.duration
+        value = pickup_datetime + duration if pickup_datetime is not None and duration is not None else None
+        setattr(model_instance, self.attname, value)
+        return value
+
+class OrderQuerySet(models.QuerySet):
+    """Keeps end_datetime in sync on the writes that skip pre_save: QuerySet.update and bulk_update. Both send 
+    core.signals.bulk_saved with the updated orders and their previous values, as they send no post_save."""
+    # The values of the orders sent with bulk_saved, read by its receivers.
+    signal_fields = ('id', 'driver_id', 'pickup_datetime', 'end_datetime', 'delivery_lat', 'delivery_lng')
+
+    def _get_signal_instances(self, order_ids: list[int]) -> list:
+        return [self.model(**row) for row in self.model._base_manager.filter(pk__in = order_ids).values(*self.signal_fields)]
+
+    def update(self, **kwargs):
+        # Imported here, core.signals imports the models.
+        from core.signals import bulk_saved
+        if 'pickup_datetime' in kwargs or 'duration' in kwargs:
+            # The right-hand sides of an UPDATE read the previous values of the row, so the new ones are used.
+            values = []
+            for name in ('pickup_datetime', 'duration'):
+                value = kwargs.get(name, models.F(name))
+                if not hasattr(value, 'resolve_expression'):
+                    value = models.Value(value, output_field = self.model._meta.get_field(name))
+                values.append(value)
+            kwargs['end_datetime'] = models.ExpressionWrapper(values[0] + values[1], output_field = models.DateTimeField())
+        with transaction.atomic(using = self.db):
+            previous_instances = [self.model(**row) for row in self.values(*self.signal_fields)]
+            order_ids = [instance.id for instance in previous_instances]
+            rows = super().update(**kwargs) if order_ids else 0
+            if order_ids:
+                # Read back by id, as the update can change the filtered fields.
+                bulk_saved.send(sender = self.model, instances = self._get_signal_instances(order_ids), 
+                                previous_instances = previous_instances)
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size = None):
+        from core.signals import bulk_saved
+        fields = list(fields)
+        objs = list(objs)
+        if ('pickup_datetime' in fields or 'duration' in fields) and 'end_datetime' not in fields:
+            end_datetime_field = self.model._meta.get_field('end_datetime')
+            for obj in objs:
+                end_datetime_field.pre_save(obj, False)
+            fields.append('end_datetime')
+        with transaction.atomic(using = self.db):
+            previous_instances = self._get_signal_instances([obj.pk for obj in objs])
+            # On a plain QuerySet, as bulk_update runs QuerySet.update, which would send bulk_saved too.
+            rows = models.QuerySet(self.model, using = self.db).bulk_update(objs, fields, batch_size = batch_size)
+            if objs:
+                # Read back, the objs can hold only some of the fields.
+                bulk_saved.send(sender = self.model, instances = self._get_signal_instances([obj.pk for obj in objs]),
+                                previous_instances = previous_instances)
+        return rows
 
 class Driver(models.Model):
     id = models.AutoField(primary_key = True)
     lat = models.IntegerField()
     lng = models.IntegerField()
-    last_update = models.DateTimeField()
+    last_update = models.DateTimeField(db_index = True)
+
+    class Meta:
+        indexes = [
+            # The bounding box filter of the drivers list.
+            models.Index(fields = ['lat', 'lng'], name = 'driver_position_idx'),
+        ]
 
     def __str__(self):
         return f"Driver ID: {self.id}"
@@ -17,6 +89,140 @@ class Order(models.Model):
     pickup_lng = models.IntegerField()
     delivery_lat = models.IntegerField()
     delivery_lng = models.IntegerField()
+    duration = models.DurationField(default = get_default_order_duration)
+    end_datetime = OrderEndDateTimeField(editable = False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The overlap check of a driver schedule and the orders of a driver on a day.
+            models.Index(fields = ['driver', 'pickup_datetime'], name = 'order_driver_pickup_idx'),
+            # The end of the schedule of a driver (DriverState.busy_until).
+            models.Index(fields = ['driver', 'end_datetime'], name = 'order_driver_end_idx'),
+            # The time window queries of the closest-driver search and the orders on a day.
+            models.Index(fields = ['pickup_datetime'], name = 'order_pickup_idx'),
+        ]
 
     def __str__(self):
         return f"Order: {self.id} - {self.pickup_datetime}"
+
+class ArchivedOrder(models.Model):
+    """The cold partition of the orders: the orders of the completed days, moved out of the Order table (the hot
+    partition) by 'manage.py archive_orders' with their ids. Only filter_orders reads it (see core.archive), the
+    matching and scheduling logic only reads the Order table.
+    """
+    id = models.IntegerField(primary_key = True)
+    driver = models.ForeignKey(Driver, on_delete = models.PROTECT, related_name = 'archived_orders')
+    pickup_datetime = models.DateTimeField()
+    pickup_lat = models.IntegerField()
+    pickup_lng = models.IntegerField()
+    delivery_lat = models.IntegerField()
+    delivery_lng = models.IntegerField()
+    duration = models.DurationField()
+    end_datetime = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # The orders of a driver on a day.
+            models.Index(fields = ['driver', 'pickup_datetime'], name = 'archived_driver_pickup_idx'),
+            # The orders on a day and the last archived day.
+            models.Index(fields = ['pickup_datetime'], name = 'archived_pickup_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived Order: {self.id} - {self.pickup_datetime}"
+
+class DriverState(models.Model):
+    """Denormalized live state of a driver: its last known position and its scheduled orders.
+    Kept in sync with the Driver and Order writes (see core.states), rebuilt with 'manage.py rebuild_driver_states'.
+    """
+    driver = models.OneToOneField(Driver, primary_key = True, on_delete = models.CASCADE, related_name = 'state')
+    lat = models.IntegerField()
+    lng = models.IntegerField()
+    last_update = models.DateTimeField()
+    # The latest end_datetime of the orders of the driver.
+    busy_until = models.DateTimeField(null = True)
+    # Delivery coordinates of its last order (by pickup_datetime), where the driver will be.
+    last_delivery_lat = models.IntegerField(null = True)
+    last_delivery_lng = models.IntegerField(null = True)
+    # The [pickup_datetime, end_datetime] of its orders that had not ended when the state was refreshed, as
+    # microseconds from the epoch, sorted: the closest-driver searches read if the driver is busy from it.
+    schedule = models.JSONField(default = list)
+
+    class Meta:
+        indexes = [
+            # The bounding box of the closest-driver search by starting zone.
+            models.Index(fields = ['lat', 'lng'], name = 'driver_state_position_idx'),
+            models.Index(fields = ['busy_until'], name = 'driver_state_busy_until_idx'),
+        ]
+
+    def __str__(self):
+        return f"Driver State: {self.driver_id} - busy until {self.busy_until}"
+
+class TableChange(models.Model):
+    """Append-only log of the written rows of the tables that the in-memory indexes of every process depend on
+    (see api.indexes). Every Driver and Order write appends the ids of its rows, in the transaction of the write,
+    and the indexes apply the rows changed after the last entry they applied on their next lookup. The entries
+    are only inserted, so the writes never wait on each other for them. The ones older than twice the
+    MATCHING_INDEX_MAX_AGE are pruned by the drivers location ingestor (see core.changes).
+    """
+    id = models.BigAutoField(primary_key = True)
+    table = models.CharField(max_length = 64)
+    # None when the written rows are unknown, the indexes are rebuilt then.
+    row_id = models.IntegerField(null = True)
+    # Random number of the write. The ids of the rolled back entries can be reused, so an entry of a
+    # write is told apart by its id and batch.
+    batch = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    class Meta:
+        indexes = [
+            # The changes of a table after the last one applied by an index.
+            models.Index(fields = ['table', 'id'], name = 'table_change_idx'),
+            # The pruning of the old entries.
+            models.Index(fields = ['created_at'], name = 'table_change_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Table Change: {self.id} - {self.table} {self.row_id}"
+
+class DailyOrderStats(models.Model):
+    """Materialized number of orders picked up on a day (in TIME_ZONE), the archived ones included.
+    Kept in sync with the Order writes (see core.stats), rebuilt with 'manage.py rebuild_order_stats'.
+    """
+    date = models.DateField(primary_key = True)
+    orders = models.IntegerField(default = 0)
+
+    def __str__(self):
+        return f"Daily Order Stats: {self.date} - {self.orders} orders"
+
+class DriverDailyOrderStats(models.Model):
+    """Materialized number of orders of a driver picked up on a day (see DailyOrderStats)."""
+    date = models.DateField()
+    driver = models.ForeignKey(Driver, on_delete = models.CASCADE, related_name = 'daily_order_stats')
+    orders = models.IntegerField(default = 0)
+
+    class Meta:
+        constraints = [
+            # Also serves the drivers of a day.
+            models.UniqueConstraint(fields = ['date', 'driver'], name = 'driver_daily_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f"Driver Daily Order Stats: {self.date} - driver {self.driver_id} - {self.orders} orders"
+
+class HourlyOrderStats(models.Model):
+    """Materialized number of orders picked up on an hour (0 to 23) of a day (see DailyOrderStats)."""
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    orders = models.IntegerField(default = 0)
+
+    class Meta:
+        constraints = [
+            # Also serves the hours of a day.
+            models.UniqueConstraint(fields = ['date', 'hour'], name = 'hourly_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f"Hourly Order Stats: {self.date} {self.hour}h - {self.orders} orders"
@@ -0,0 +1,88 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from core.models import Driver, Order
+from core.states import refresh_driver_states
+from core.stats import get_order_bucket, rebuild_order_stats, update_order_stats
+
+
+# Sent after writing many rows with bulk_create or bulk_update, which do not send post_save.
+# Arguments: sender (the model class), instances (the written instances), created (optional, True
+# when all of them are new rows) and previous_instances (optional, unsaved instances with the values of
+# the updated rows before the write).
+bulk_saved = Signal()
+# Sent after deleting many rows with a single query, which does not send post_delete.
+# Arguments: sender (the model class), instances (unsaved instances with the values of the deleted rows)
+# and archived (optional, True when the rows were moved to the archive).
+bulk_deleted = Signal()
+
+
+@receiver(pre_save, sender = Order)
+def remember_previous_order(sender, instance, **kwargs):
+    """Keep the driver and pickup_datetime of an updated order, so the states of both drivers are refreshed
+    and the order is moved between the stats buckets."""
+    if instance.pk is not None:
+        instance._previous_driver_id, instance._previous_pickup_datetime = Order.objects.filter(
+            pk = instance.pk).values_list('driver_id', 'pickup_datetime').first() or (None, None)
+
+@receiver(post_save, sender = Driver)
+@receiver(post_save, sender = Order)
+@receiver(post_delete, sender = Order)
+def refresh_states(sender, instance, **kwargs):
+    """Refresh the DriverState of the saved Driver, or of the driver of the saved or deleted Order."""
+    if sender is Driver:
+        refresh_driver_states([instance.id])
+    else:
+        refresh_driver_states({instance.driver_id, getattr(instance, '_previous_driver_id', None)} - {None})
+
+@receiver(bulk_saved)
+def refresh_states_on_bulk_save(sender, instances, previous_instances = None, **kwargs):
+    """Refresh the DriverState of the drivers written by bulk_create or bulk_update, or of the drivers of
+    their orders (before and after the write)."""
+    if sender is Driver:
+        refresh_driver_states(instance.id for instance in instances if instance.id is not None)
+    elif sender is Order:
+        refresh_driver_states({instance.driver_id for instance in [*instances, *(previous_instances or [])]})
+
+@receiver(bulk_deleted)
+def refresh_states_on_bulk_delete(sender, instances, **kwargs):
+    """Refresh the DriverState of the drivers of the orders deleted in bulk (e.g. archived)."""
+    if sender is Order:
+        refresh_driver_states(instance.driver_id for instance in instances)
+
+@receiver(post_save, sender = Order)
+def update_stats(sender, instance, created, **kwargs):
+    """Count the saved Order on the stats of its day, moving it from its previous bucket if it changed."""
+    previous_driver_id = getattr(instance, '_previous_driver_id', None)
+    if not created and previous_driver_id is not None:
+        previous_pickup_datetime = instance._previous_pickup_datetime
+        if (previous_driver_id, previous_pickup_datetime) == (instance.driver_id, instance.pickup_datetime):
+            return
+        update_order_stats([(previous_driver_id, previous_pickup_datetime)], -1)
+    update_order_stats([(instance.driver_id, instance.pickup_datetime)], 1)
+
+@receiver(post_delete, sender = Order)
+def update_stats_on_delete(sender, instance, **kwargs):
+    """Discount the deleted Order from the stats of its day."""
+    update_order_stats([(instance.driver_id, instance.pickup_datetime)], -1)
+
+@receiver(bulk_saved)
+def update_stats_on_bulk_save(sender, instances, created = False, previous_instances = None, **kwargs):
+    """Count the orders created by bulk_create, and move the orders written by bulk_update from the buckets
+    of their previous values to the ones of their new values. Without the previous values, the days of
+    the new values are recomputed once the write commits."""
+    if sender is not Order:
+        return
+    if created or previous_instances is not None:
+        if previous_instances:
+            update_order_stats([(instance.driver_id, instance.pickup_datetime) for instance in previous_instances], -1)
+        update_order_stats([(instance.driver_id, instance.pickup_datetime) for instance in instances], 1)
+    else:
+        dates = {get_order_bucket(instance.pickup_datetime)[0] for instance in instances}
+        transaction.on_commit(lambda: rebuild_order_stats(dates))
+
+@receiver(bulk_deleted)
+def update_stats_on_bulk_delete(sender, instances, archived = False, **kwargs):
+    """Discount the orders deleted in bulk. The archived orders are still counted on their days."""
+    if sender is Order and not archived:
+        update_order_stats([(instance.driver_id, instance.pickup_datetime) for instance in instances], -1)
@@ -0,0 +1,68 @@
+import datetime
+import itertools
+from collections import defaultdict
+from typing import Iterable
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from core.models import Driver, DriverState, Order
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo = datetime.timezone.utc)
+# The fields of a DriverState recomputed by refresh_driver_states.
+STATE_FIELDS = ['lat', 'lng', 'last_update', 'busy_until', 'last_delivery_lat', 'last_delivery_lng', 'schedule']
+
+def to_microseconds(value: datetime.datetime) -> int:
+    """Exact number of microseconds from the epoch to an aware datetime."""
+    return (value - EPOCH) // datetime.timedelta(microseconds = 1)
+
+def refresh_driver_states(driver_ids: Iterable[int]) -> int:
+    """Recompute the DriverState rows of some drivers from the Driver and Order tables.
+    It runs in the transaction of the caller, so the states are committed (or rolled back) with the write.
+    The existing rows are updated in place (one UPDATE per batch) and the missing ones created.
+
+    Args:
+    -----
+        driver_ids (Iterable[int]): The ids of the drivers. The ones that no longer exist are skipped.
+
+    Returns:
+    --------
+        int: The number of refreshed states.
+    """
+    driver_ids = iter(sorted(set(driver_ids)))
+    refreshed = 0
+    while batch_ids := list(itertools.islice(driver_ids, settings.DRIVER_STATE_BATCH_SIZE)):
+        # The last order of each driver and its latest end, served by the (driver, pickup_datetime)
+        # and (driver, end_datetime) indexes.
+        last_orders = Order.objects.filter(driver = OuterRef('pk')).order_by('-pickup_datetime', '-id')
+        latest_ends = Order.objects.filter(driver = OuterRef('pk')).order_by('-end_datetime')
+        rows = Driver.objects.filter(id__in = batch_ids).annotate(
+            busy_until = Subquery(latest_ends.values('end_datetime')[:1]),
+            last_delivery_lat = Subquery(last_orders.values('delivery_lat')[:1]),
+            last_delivery_lng = Subquery(last_orders.values('delivery_lng')[:1])
+        ).values_list('id', 'lat', 'lng', 'last_update', 'busy_until', 'last_delivery_lat', 'last_delivery_lng')
+        # The orders that have not ended, served by the (driver, end_datetime) index.
+        schedules = defaultdict(list)
+        upcoming_orders = Order.objects.filter(driver_id__in = batch_ids, end_datetime__gte = timezone.now()).values_list(
+            'driver_id', 'pickup_datetime', 'end_datetime').order_by('pickup_datetime', 'id')
+        for driver_id, pickup_datetime, end_datetime in upcoming_orders:
+            schedules[driver_id].append([to_microseconds(pickup_datetime), to_microseconds(end_datetime)])
+        states = [
+            DriverState(driver_id = driver_id, lat = lat, lng = lng, last_update = last_update, busy_until = busy_until,
+                        last_delivery_lat = last_delivery_lat, last_delivery_lng = last_delivery_lng, 
+                        schedule = schedules[driver_id])
+            for driver_id, lat, lng, last_update, busy_until, last_delivery_lat, last_delivery_lng in rows
+        ]
+        existing_ids = set(DriverState.objects.filter(driver_id__in = batch_ids).values_list('driver_id', flat = True))
+        with transaction.atomic():
+            DriverState.objects.bulk_update([state for state in states if state.driver_id in existing_ids], STATE_FIELDS)
+            DriverState.objects.bulk_create([state for state in states if state.driver_id not in existing_ids])
+        refreshed += len(states)
+    return refreshed
+
+def rebuild_driver_states() -> int:
+    """Recompute the DriverState of every driver. Returns the number of states."""
+    with transaction.atomic():
+        DriverState.objects.exclude(driver_id__in = Driver.objects.values('id')).delete()
+        return refresh_driver_states(Driver.objects.values_list('id', flat = True).iterator())
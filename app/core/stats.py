@@ -0,0 +1,127 @@
+import datetime
+from collections import Counter
+from typing import Iterable, Union
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+from core.models import ArchivedOrder, DailyOrderStats, DriverDailyOrderStats, HourlyOrderStats, Order
+
+
+def get_order_bucket(pickup_datetime: datetime.datetime) -> tuple[datetime.date, int]:
+    """The day (in TIME_ZONE) and hour of a pickup_datetime."""
+    if timezone.is_naive(pickup_datetime):
+        pickup_datetime = pickup_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ)
+    pickup_datetime = pickup_datetime.astimezone(settings.TIME_ZONE_PYTZ)
+    return pickup_datetime.date(), pickup_datetime.hour
+
+def add_to_stats(model, counts: Counter, key_names: tuple[str, ...]) -> None:
+    """Add some counts to the orders of the stats rows of a model, one UPDATE per row.
+    The missing rows are created, unless the count is negative (the stats were never built for them).
+    """
+    for key, count in counts.items():
+        if not count:
+            continue
+        lookup = dict(zip(key_names, key))
+        if model.objects.filter(**lookup).update(orders = F('orders') + count) or count < 0:
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(orders = count, **lookup)
+        except IntegrityError:
+            # Created by a concurrent write since the UPDATE.
+            model.objects.filter(**lookup).update(orders = F('orders') + count)
+
+def update_order_stats(orders: Iterable[tuple[int, datetime.datetime]], delta: int) -> None:
+    """Add (or remove) some orders to the daily, driver daily and hourly stats.
+    The counts are added once the transaction of the caller commits (right away outside of one), each UPDATE
+    in its own transaction, so the writes of orders never hold the locks of the shared stats rows. They are
+    dropped if the transaction rolls back, and lost if the process stops in between: rebuild_order_stats
+    recomputes them.
+
+    Args:
+    -----
+        orders (Iterable[tuple[int, datetime.datetime]]): The driver id and pickup_datetime of each order.
+        delta (int): 1 to add the orders, -1 to remove them.
+    """
+    daily, driver_daily, hourly = Counter(), Counter(), Counter()
+    for driver_id, pickup_datetime in orders:
+        date, hour = get_order_bucket(pickup_datetime)
+        daily[(date,)] += delta
+        driver_daily[(date, driver_id)] += delta
+        hourly[(date, hour)] += delta
+
+    def add_counts():
+        add_to_stats(DailyOrderStats, daily, ('date',))
+        add_to_stats(DriverDailyOrderStats, driver_daily, ('date', 'driver_id'))
+        add_to_stats(HourlyOrderStats, hourly, ('date', 'hour'))
+
+    transaction.on_commit(add_counts)
+
+def rebuild_order_stats(dates: Union[Iterable[datetime.date], None] = None) -> int:
+    """Recompute the stats of some days (every day by default) from the Order and ArchivedOrder tables.
+
+    Args:
+    -----
+        dates (Union[Iterable[datetime.date], None]): The days to recompute. All the days by default.
+
+    Returns:
+    --------
+        int: The number of days with orders.
+    """
+    day_filter = Q()
+    if dates is not None:
+        dates = set(dates)
+        for date in dates:
+            start_datetime = datetime.datetime.combine(date, datetime.time.min).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+            day_filter |= Q(pickup_datetime__gte = start_datetime, pickup_datetime__lt = start_datetime + datetime.timedelta(days = 1))
+    daily, driver_daily, hourly = Counter(), Counter(), Counter()
+    for model in (Order, ArchivedOrder):
+        # Grouped by the database, served by the (pickup_datetime) indexes.
+        rows = model.objects.filter(day_filter).values(
+            'driver_id', date = TruncDate('pickup_datetime', tzinfo = settings.TIME_ZONE_PYTZ),
+            hour = ExtractHour('pickup_datetime', tzinfo = settings.TIME_ZONE_PYTZ)
+        ).annotate(orders = Count('id')).order_by().values_list('driver_id', 'date', 'hour', 'orders')
+        for driver_id, date, hour, orders in rows:
+            daily[date] += orders
+            driver_daily[(date, driver_id)] += orders
+            hourly[(date, hour)] += orders
+    with transaction.atomic():
+        for stats_model in (DailyOrderStats, DriverDailyOrderStats, HourlyOrderStats):
+            queryset = stats_model.objects.all() if dates is None else stats_model.objects.filter(date__in = dates)
+            queryset.delete()
+        DailyOrderStats.objects.bulk_create(
+            [DailyOrderStats(date = date, orders = orders) for date, orders in daily.items()])
+        DriverDailyOrderStats.objects.bulk_create(
+            [DriverDailyOrderStats(date = date, driver_id = driver_id, orders = orders)
+             for (date, driver_id), orders in driver_daily.items()])
+        HourlyOrderStats.objects.bulk_create(
+            [HourlyOrderStats(date = date, hour = hour, orders = orders) for (date, hour), orders in hourly.items()])
+    return len(daily)
+
+def get_order_stats(date: datetime.date, driver_id: Union[int, None] = None) -> dict:
+    """The orders of a day, read from the stats tables: one primary key or unique index lookup per table.
+
+    Args:
+    -----
+        date (datetime.date): The day.
+        driver_id (Union[int, None]): The id of a driver. All the drivers by default.
+
+    Returns:
+    --------
+        dict: The orders of the day, per hour (24 counts) and per driver id. Only the orders of the driver,
+            if received.
+    """
+    if driver_id is not None:
+        orders = DriverDailyOrderStats.objects.filter(date = date, driver_id = driver_id).values_list('orders', flat = True).first()
+        return {'driver': driver_id, 'orders': orders or 0}
+    hours = [0] * 24
+    for hour, orders in HourlyOrderStats.objects.filter(date = date).values_list('hour', 'orders'):
+        hours[hour] = orders
+    drivers = DriverDailyOrderStats.objects.filter(date = date, orders__gt = 0).values_list('driver_id', 'orders')
+    return {
+        'orders': DailyOrderStats.objects.filter(date = date).values_list('orders', flat = True).first() or 0,
+        'hours': hours,
+        'drivers': {driver_id: orders for driver_id, orders in drivers.order_by('driver_id')}
+    }
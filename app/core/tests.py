@@ -1,11 +1,37 @@
 import json
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
 from core.models import Driver
 from core.models import Order
+from core.models import DriverState
+from core.models import ArchivedOrder
+from core.models import DailyOrderStats, DriverDailyOrderStats, HourlyOrderStats
+from core.archive import archive_orders, get_archived_through
+from core.stats import get_order_stats, rebuild_order_stats
+from core.states import rebuild_driver_states
+from core.cron import fetch_drivers_location, sync_drivers_location
+from core.signals import bulk_deleted
+from core.feed import iter_feed_chunks, iter_feed_drivers
+from core.ingest import DriversLocationIngestor
+from api.indexes import availability_index, driver_index, order_index
+from io import StringIO
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
 import datetime
+import logging
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 class DriverTestCase(TestCase):
     def setUp(self):
@@ -171,6 +197,28 @@ class ScheduleOrderTestCaseRestframework(TestCase):
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         self.assertIn("The driver is busy", json.loads(response.content)["error"])
 
+    def test_schedule_order_endpoint_durations(self):
+        """Test that an order is checked against the other orders of the driver during its whole duration."""
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        client = APIClient()
+
+        def schedule(hours: float, duration: str):
+            pickup_datetime = now + datetime.timedelta(hours = hours)
+            data = {"driver": 1, "pickup_datetime": pickup_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), 
+                    "pickup_lat": 33, "pickup_lng": 1, "delivery_lat": 98, "delivery_lng": 98, "duration": duration}
+            return client.post('/api/schedule_order/', data, format = 'json')
+
+        response = schedule(3.5, "03:00:00")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.content)["duration"], "03:00:00")
+        self.assertEqual(Order.objects.get(driver = 1, duration = datetime.timedelta(hours = 3)).end_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), 
+                         (now + datetime.timedelta(hours = 6.5)).strftime(settings.DEFAULT_DATETIME_FORMAT))
+        self.assertEqual(schedule(6, "00:30:00").status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(schedule(0.5, "02:00:00").status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(schedule(0.5, "01:00:00").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(schedule(20, "13:00:00").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(schedule(20, "00:00:00").status_code, status.HTTP_400_BAD_REQUEST)
+
 class FilterOrderTestCaseRestframework(TestCase):
     def setUp(self):
         driver_1 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
@@ -220,6 +268,181 @@ class FilterOrderTestCaseRestframework(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Missing parameters. Fields", json.loads(response.content)["error"])
         
+class FilterOrderPaginationTestCaseRestframework(TestCase):
+    def setUp(self):
+        self.test_date = datetime.date.today() + datetime.timedelta(days = 1)
+        pickup_datetime = datetime.datetime.combine(self.test_date, datetime.time(12)).replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        drivers = [Driver.objects.create(last_update = pickup_datetime, lat = 0, lng = 0) for _ in range(2)]
+        # Several orders share each pickup_datetime, so the pages split the ties.
+        for position in range(25):
+            Order.objects.create(driver = drivers[position % 2], pickup_datetime = pickup_datetime + datetime.timedelta(minutes = position // 3), 
+                                 pickup_lat = position, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+        self.url = f'/api/filter_orders/{self.test_date.strftime(settings.DEFAULT_DATE_FORMAT)}/'
+
+    def test_filter_order_endpoint_pages(self):
+        """Test the pages return every order of the day once, most recent first"""
+        client = APIClient()
+        orders = []
+        params = {'page_size': 4}
+        while True:
+            response = client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = json.loads(response.content)
+            self.assertLessEqual(len(page['results']), 4)
+            orders += page['results']
+            if page['next_cursor'] is None:
+                self.assertIsNone(page['next'])
+                break
+            self.assertIn(page['next_cursor'], page['next'])
+            params = {'page_size': 4, 'cursor': page['next_cursor']}
+        self.assertEqual(sorted(order['pickup_lat'] for order in orders), list(range(25)))
+        pickup_datetimes = [order['pickup_datetime'] for order in orders]
+        self.assertEqual(pickup_datetimes, sorted(pickup_datetimes, reverse = True))
+
+    def test_filter_order_endpoint_pages_by_driver(self):
+        """Test the pages of a driver only return its orders"""
+        response = APIClient().get(f'{self.url}1/', {'page_size': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        page = json.loads(response.content)
+        self.assertEqual(len(page['results']), 13)
+        self.assertIsNone(page['next_cursor'])
+
+    def test_filter_order_endpoint_stream(self):
+        """Test the orders of the day are streamed as NDJSON"""
+        response = APIClient().get(self.url, {'stream': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        orders = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(orders, json.loads(APIClient().get(self.url).content))
+
+    def test_filter_order_endpoint_bad_request_pagination(self):
+        """Test filter order raise an exception when the cursor or the page_size are not valid"""
+        client = APIClient()
+        for params in ({'cursor': 'invalid'}, {'page_size': 0}, {'page_size': 'ten'}):
+            response = client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', json.loads(response.content))
+
+class ListRoutesTestCaseRestframework(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.now = now
+        self.drivers = [Driver.objects.create(last_update = now - datetime.timedelta(minutes = position), 
+                                              lat = position, lng = 100 - position) for position in range(30)]
+        for position in range(60):
+            Order.objects.create(driver = self.drivers[position % 3], pickup_datetime = now + datetime.timedelta(minutes = 10 * (position // 2)), 
+                                 pickup_lat = position, pickup_lng = position, delivery_lat = 0, delivery_lng = 0)
+
+    def get_all_pages(self, url: str, params: dict) -> list:
+        """Follow the next links of a list route and return every result."""
+        client = APIClient()
+        results = []
+        response = client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = json.loads(response.content)
+            results += page['results']
+            if page['next'] is None:
+                return results
+            response = client.get(page['next'])
+
+    def test_list_routes_pages(self):
+        """Test the drivers and orders list routes return every row once, in pages"""
+        drivers = self.get_all_pages('/api/drivers/', {'page_size': 7})
+        self.assertEqual([driver['id'] for driver in drivers], [driver.id for driver in self.drivers])
+        orders = self.get_all_pages('/api/orders/', {'page_size': 7})
+        self.assertEqual(sorted(order['pickup_lat'] for order in orders), list(range(60)))
+        pickup_datetimes = [order['pickup_datetime'] for order in orders]
+        self.assertEqual(pickup_datetimes, sorted(pickup_datetimes, reverse = True))
+
+    def test_list_routes_constant_queries_per_page(self):
+        """Test each page of the list routes is loaded with a single query, whatever its size"""
+        client = APIClient()
+        for page_size in (1, 10, 1000):
+            with self.assertNumQueries(1):
+                client.get('/api/drivers/', {'page_size': page_size})
+            with self.assertNumQueries(1):
+                response = client.get('/api/orders/', {'page_size': page_size})
+            with self.assertNumQueries(1):
+                client.get(json.loads(response.content)['next'] or '/api/orders/')
+
+    def test_list_routes_filters(self):
+        """Test the drivers and orders list routes filters"""
+        drivers = self.get_all_pages('/api/drivers/', {'min_lat': 5, 'max_lat': 20, 'min_lng': 85})
+        self.assertEqual([driver['lat'] for driver in drivers], list(range(5, 16)))
+        updated_from = (self.now - datetime.timedelta(minutes = 3)).strftime(settings.DEFAULT_DATETIME_FORMAT)
+        self.assertEqual(len(self.get_all_pages('/api/drivers/', {'updated_from': updated_from})), 4)
+        pickup_to = (self.now + datetime.timedelta(minutes = 50)).strftime(settings.DEFAULT_DATETIME_FORMAT)
+        orders = self.get_all_pages('/api/orders/', {'driver': self.drivers[0].id, 'pickup_to': pickup_to})
+        self.assertEqual(sorted(order['pickup_lat'] for order in orders), [0, 3, 6, 9])
+        orders = self.get_all_pages('/api/orders/', {'min_lat': 10, 'max_lat': 12, 'max_lng': 11})
+        self.assertEqual(sorted(order['pickup_lat'] for order in orders), [10, 11])
+
+    def test_list_routes_bad_request_filters(self):
+        """Test the list routes raise an exception when a filter or the page_size are not valid"""
+        client = APIClient()
+        for url, params in (('/api/drivers/', {'min_lat': 'north'}), ('/api/orders/', {'pickup_from': '2022-01-01'}), 
+                            ('/api/orders/', {'page_size': 5000}), ('/api/orders/', {'cursor': 'invalid'})):
+            response = client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', json.loads(response.content))
+
+class AsyncReadEndpointsTestCase(TransactionTestCase):
+    # The async views read on the connections of the executor threads, which only see the committed rows.
+    def setUp(self):
+        # The rows flushed after the previous test cases are not on the changes log.
+        for index in (driver_index, order_index, availability_index):
+            index.invalidate()
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.target_datetime = now + datetime.timedelta(days = 1)
+        drivers = [Driver.objects.create(last_update = now, lat = position * 10, lng = position * 10) for position in range(4)]
+        for position in range(12):
+            Order.objects.create(driver = drivers[position % 4], pickup_datetime = self.target_datetime - datetime.timedelta(hours = 1 + position % 5), 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = position * 3, delivery_lng = position * 5)
+
+    async def assertSameResponse(self, method: str, path: str, data: dict):
+        """Assert the async version of an endpoint returns the same status and bytes as the sync one."""
+        if method == 'post':
+            sync_response = await sync_to_async(APIClient().post)(f'/api/{path}', data, format = 'json')
+            async_response = await self.async_client.post(f'/api/async/{path}', data, content_type = 'application/json')
+        else:
+            sync_response = await sync_to_async(APIClient().get)(f'/api/{path}', data)
+            async_response = await self.async_client.get(f'/api/async/{path}', data)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # The next page links point to the route of each version.
+        self.assertEqual(async_response.content.replace(b'/api/async/', b'/api/'), sync_response.content)
+        return async_response
+
+    async def test_async_get_closest_driver(self):
+        """Test the async closest driver endpoint returns the same responses as the sync one"""
+        target_datetime_str = self.target_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+        for lat, lng in ((0, 0), (15, 40), (100, 100)):
+            response = await self.assertSameResponse('post', 'get_closest_driver/', 
+                                                     {'target_datetime': target_datetime_str, 'lat': lat, 'lng': lng})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.assertSameResponse('post', 'get_closest_driver/', {'lat': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_filter_orders(self):
+        """Test the async filter orders endpoint returns the same responses as the sync one"""
+        date_str = (self.target_datetime - datetime.timedelta(hours = 3)).strftime(settings.DEFAULT_DATE_FORMAT)
+        await self.assertSameResponse('get', f'filter_orders/{date_str}/', {})
+        await self.assertSameResponse('get', f'filter_orders/{date_str}/1/', {})
+        response = await self.assertSameResponse('get', f'filter_orders/{date_str}/', {'page_size': 5})
+        await self.assertSameResponse('get', f'filter_orders/{date_str}/', 
+                                      {'page_size': 5, 'cursor': json.loads(response.content)['next_cursor']})
+        response = await self.assertSameResponse('get', 'filter_orders/not-a-date/', {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.assertSameResponse('get', f'filter_orders/{date_str}/', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_views_methods(self):
+        """Test the async endpoints reject the other HTTP methods"""
+        response = await self.async_client.get('/api/async/get_closest_driver/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = await self.async_client.post('/api/async/filter_orders/2022-01-01/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 class SearchClosestDriverTestCaseRestframework(TestCase):
     def setUp(self):
         test_datetime_3h = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) + datetime.timedelta(hours = 3)
@@ -290,3 +513,808 @@ class SearchClosestDriverSpecialTestCaseRestframework(TestCase):
         response = client.post('/api/get_closest_driver/', data, format = 'json')
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         self.assertIn("Active drivers not found", json.loads(response.content)["error"])
+
+class DriverAvailabilityTestCaseRestframework(TestCase):
+    def setUp(self):
+        self.test_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 1)
+        self.driver_1 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
+        self.driver_2 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 5, lng = 63)
+        # The driver 1 is busy from 30 minutes before the test datetime until 30 minutes after it.
+        Order.objects.create(driver = self.driver_1, pickup_datetime = (self.test_datetime - datetime.timedelta(minutes = 30)).replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                             pickup_lat = 15, pickup_lng = 25, delivery_lat = 5, delivery_lng = 63)
+        self.test_datetime_str = self.test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+
+    def test_free_drivers(self):
+        """Test the free and busy drivers on a datetime"""
+        response = APIClient().get(f'/api/availability/{self.test_datetime_str}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'target_datetime': self.test_datetime_str,
+            'free_driver_ids': [self.driver_2.id],
+            'busy_driver_ids': [self.driver_1.id]
+        })
+
+    def test_driver_next_free_datetime(self):
+        """Test a busy driver is free one second after its order ends, and a free driver at once"""
+        client = APIClient()
+        response = client.get(f'/api/availability/{self.test_datetime_str}/{self.driver_1.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        next_free_datetime = self.test_datetime + datetime.timedelta(minutes = 30, seconds = 1)
+        self.assertEqual(response.json(), {
+            'driver': self.driver_1.id,
+            'target_datetime': self.test_datetime_str,
+            'free': False,
+            'next_free_datetime': next_free_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+        })
+        response = client.get(f'/api/availability/{self.test_datetime_str}/{self.driver_2.id}/')
+        self.assertTrue(response.json()['free'])
+        self.assertEqual(response.json()['next_free_datetime'], self.test_datetime_str)
+
+    def test_availability_follows_order_updates(self):
+        """Test QuerySet.update and bulk_update of a pickup time move the busy interval of its driver, for the 
+        availability and the closest driver search"""
+        client = APIClient()
+        closest_driver_data = {"target_datetime": self.test_datetime_str, "lat": 15, "lng": 25}
+        def assertBusyDriver(busy_driver: Driver, free_driver: Driver):
+            response = client.get(f'/api/availability/{self.test_datetime_str}/')
+            self.assertEqual(response.json()['busy_driver_ids'], [busy_driver.id] if busy_driver else [])
+            response = client.post('/api/get_closest_driver/', closest_driver_data, format = 'json')
+            self.assertEqual(json.loads(response.content)["id"], free_driver.id)
+
+        assertBusyDriver(self.driver_1, self.driver_2)
+        Order.objects.filter(driver = self.driver_1).update(pickup_datetime = F('pickup_datetime') + datetime.timedelta(hours = 3))
+        assertBusyDriver(None, self.driver_1)
+        orders = list(Order.objects.filter(driver = self.driver_1))
+        for order in orders:
+            order.pickup_datetime -= datetime.timedelta(hours = 3)
+        Order.objects.bulk_update(orders, ['pickup_datetime'])
+        assertBusyDriver(self.driver_1, self.driver_2)
+
+    def test_availability_bad_requests(self):
+        """Test the invalid or past datetimes and the unknown drivers are rejected"""
+        client = APIClient()
+        response = client.get('/api/availability/2022-13-01T00:00:00/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        past_datetime_str = (datetime.datetime.now() - datetime.timedelta(hours = 1)).strftime(settings.DEFAULT_DATETIME_FORMAT)
+        response = client.get(f'/api/availability/{past_datetime_str}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("past time", response.json()["error"])
+        response = client.get(f'/api/availability/{self.test_datetime_str}/999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class FreeSlotsTestCaseRestframework(TestCase):
+    def setUp(self):
+        self.start_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 1)
+        self.driver_1 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
+        self.driver_2 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 18, lng = 25)
+        self.driver_3 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 90, lng = 90)
+        # The driver 1 has an order 2 hours after the start of the searched range.
+        self.pickup_datetime = self.start_datetime + datetime.timedelta(hours = 2)
+        Order.objects.create(driver = self.driver_1, pickup_datetime = self.pickup_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ), 
+                             pickup_lat = 15, pickup_lng = 25, delivery_lat = 5, delivery_lng = 63)
+        self.query_params = {
+            'start_datetime': self.start_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+            'end_datetime': (self.start_datetime + datetime.timedelta(hours = 4)).strftime(settings.DEFAULT_DATETIME_FORMAT)
+        }
+
+    def format(self, value: datetime.datetime) -> str:
+        return value.strftime(settings.DEFAULT_DATETIME_FORMAT)
+
+    def test_driver_free_slots(self):
+        """Test the free slots of a driver leave room for its order, and schedule_order accepts them"""
+        client = APIClient()
+        response = client.get(f'/api/free_slots/{self.driver_1.id}/', self.query_params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        separation = settings.DEFAULT_ORDER_DURATION + datetime.timedelta(seconds = 1)
+        self.assertEqual(response.json(), {
+            'driver': self.driver_1.id,
+            'slots': [
+                {'earliest_pickup_datetime': self.format(self.start_datetime), 
+                 'latest_pickup_datetime': self.format(self.pickup_datetime - separation)},
+                {'earliest_pickup_datetime': self.format(self.pickup_datetime + separation), 
+                 'latest_pickup_datetime': self.query_params['end_datetime']}
+            ]
+        })
+        data = {
+            "driver": self.driver_1.id,
+            "pickup_datetime": self.format(self.pickup_datetime + separation),
+            "pickup_lat": 0, "pickup_lng": 0, "delivery_lat": 0, "delivery_lng": 0
+        }
+        self.assertEqual(client.post('/api/schedule_order/', data, format = 'json').status_code, status.HTTP_201_CREATED)
+        data["pickup_datetime"] = self.format(self.pickup_datetime - separation + datetime.timedelta(seconds = 1))
+        self.assertEqual(client.post('/api/schedule_order/', data, format = 'json').status_code, 
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_driver_free_slots_of_a_duration(self):
+        """Test the free slots before an order leave room for the requested duration"""
+        response = APIClient().get(f'/api/free_slots/{self.driver_1.id}/', {**self.query_params, 'duration': 30})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['slots'][0]['latest_pickup_datetime'], 
+                         self.format(self.pickup_datetime - datetime.timedelta(minutes = 30, seconds = 1)))
+
+    def test_zone_free_slots(self):
+        """Test the drivers of a zone are returned with the earliest free slot first"""
+        query_params = {**self.query_params, 'lat': 15, 'lng': 25, 'radius': 5}
+        query_params['start_datetime'] = self.format(self.pickup_datetime)
+        response = APIClient().get('/api/free_slots/', query_params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([driver['driver'] for driver in response.json()], [self.driver_2.id, self.driver_1.id])
+        self.assertEqual([driver['distance'] for driver in response.json()], [3, 0])
+
+    def test_free_slots_bad_requests(self):
+        """Test the past, inverted or invalid ranges and durations, the missing zone and the unknown drivers are rejected"""
+        client = APIClient()
+        past_datetime_str = self.format(datetime.datetime.now() - datetime.timedelta(hours = 1))
+        for query_params in ({'start_datetime': past_datetime_str}, {'start_datetime': '2022-13-01T00:00:00'},
+                             {**self.query_params, 'duration': 0}, {**self.query_params, 'duration': 13 * 60},
+                             {**self.query_params, 'end_datetime': self.format(self.start_datetime - datetime.timedelta(hours = 1))}):
+            response = client.get(f'/api/free_slots/{self.driver_1.id}/', query_params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = client.get('/api/free_slots/', self.query_params)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = client.get('/api/free_slots/999/', self.query_params)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class SearchClosestDriversTestCaseRestframework(TestCase):
+    def setUp(self):
+        test_datetime_3h = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) + datetime.timedelta(hours = 3)
+        test_datetime_2d = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) + datetime.timedelta(days = 2)
+        test_datetime_12h = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) + datetime.timedelta(hours = 12)
+        driver_1 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
+        driver_2 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 5, lng = 63)
+        Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 98, lng = 98)
+        Order.objects.create(driver = driver_1, pickup_datetime = test_datetime_3h, pickup_lat = 15, pickup_lng = 25, delivery_lat = 5, delivery_lng = 63)
+        Order.objects.create(driver = driver_2, pickup_datetime = test_datetime_2d, pickup_lat = 33, pickup_lng = 12, delivery_lat = 44, delivery_lng = 45)
+        Order.objects.create(driver = driver_2, pickup_datetime = test_datetime_12h, pickup_lat = 15, pickup_lng = 25, delivery_lat = 99, delivery_lng = 95)
+
+    def test_search_drivers_endpoint_matches_single_search(self):
+        """Test the batch search finds the same drivers as one search per point"""
+        client = APIClient()
+        points = []
+        for hours, lat, lng in [(50, 47, 47), (12, 90, 93), (13, 90, 93), (20, 10, 20)]:
+            test_datetime = datetime.datetime.now() + datetime.timedelta(hours = hours, minutes = 2)
+            points.append({"target_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), "lat": lat, "lng": lng})
+        response = client.post('/api/get_closest_drivers/', {"points": points}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        single_responses = [client.post('/api/get_closest_driver/', point, format = 'json') for point in points]
+        self.assertEqual([driver["id"] for driver in json.loads(response.content)], 
+                         [json.loads(single_response.content)["id"] for single_response in single_responses])
+
+    def test_search_drivers_endpoint_consistent_assignment(self):
+        """Test that with consistent assignment a driver is not returned for overlapping points"""
+        test_datetime = datetime.datetime.now() + datetime.timedelta(hours = 20)
+        test_datetime_str = test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT)
+        points = [{"target_datetime": test_datetime_str, "lat": 10, "lng": 20} for _ in range(4)]
+        client = APIClient()
+        response = client.post('/api/get_closest_drivers/', {"points": points, "consistent_assignment": True}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = json.loads(response.content)
+        self.assertEqual(sorted(result["id"] for result in results[:3]), [1, 2, 3])
+        self.assertIn("Active drivers not found", results[3]["error"])
+
+    def test_search_drivers_endpoint_invalid_point(self):
+        """Test that an invalid point returns its error without failing the other points"""
+        test_datetime = datetime.datetime.now() + datetime.timedelta(hours = 20)
+        points = [
+            {"target_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), "lat": 10, "lng": 20},
+            {"target_datetime": "wrong_date_format", "lat": 10, "lng": 20}
+        ]
+        client = APIClient()
+        response = client.post('/api/get_closest_drivers/', {"points": points}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = json.loads(response.content)
+        self.assertEqual(results[0]["id"], 1)
+        self.assertIn("error", results[1])
+
+    def test_search_drivers_endpoint_missing_points(self):
+        """Test the batch search raise an exception when the points are missing"""
+        client = APIClient()
+        response = client.post('/api/get_closest_drivers/', {}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Missing parameters", json.loads(response.content)["error"])
+
+    def test_search_drivers_endpoint_consistent_assignment_parsing(self):
+        """Test the consistent assignment flag is parsed as a boolean: "false" and "0" turn it off"""
+        test_datetime = datetime.datetime.now() + datetime.timedelta(hours = 20)
+        points = [{"target_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), "lat": 10, "lng": 20} for _ in range(2)]
+        client = APIClient()
+        for value, expected_ids in (("false", [1, 1]), ("0", [1, 1]), (0, [1, 1]), ("true", [1, 2]), ("1", [1, 2])):
+            response = client.post('/api/get_closest_drivers/', {"points": points, "consistent_assignment": value}, format = 'json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(sorted(result["id"] for result in json.loads(response.content)), expected_ids)
+        response = client.post('/api/get_closest_drivers/', {"points": points, "consistent_assignment": "yes please"}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("consistent_assignment", json.loads(response.content)["error"])
+
+    @override_settings(API_MAX_PAGE_SIZE = 3)
+    def test_search_drivers_endpoint_too_many_points(self):
+        """Test the batch search rejects more points than API_MAX_PAGE_SIZE"""
+        test_datetime = datetime.datetime.now() + datetime.timedelta(hours = 20)
+        points = [{"target_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), "lat": 10, "lng": 20} for _ in range(4)]
+        client = APIClient()
+        response = client.post('/api/get_closest_drivers/', {"points": points}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Too many points", json.loads(response.content)["error"])
+        response = client.post('/api/get_closest_drivers/', {"points": points[:3]}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class ScheduleOrdersTestCaseRestframework(TestCase):
+    def setUp(self):
+        test_datetime = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ) + datetime.timedelta(hours = 2)
+        driver_1 = Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
+        Driver.objects.create(last_update = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ), lat = 5, lng = 63)
+        Order.objects.create(driver = driver_1, pickup_datetime = test_datetime, 
+                             pickup_lat = 15, pickup_lng = 25, delivery_lat = 5, delivery_lng = 63)
+
+    def get_order_data(self, driver_id: int, delta: datetime.timedelta) -> dict:
+        test_datetime = datetime.datetime.now() + delta
+        return {
+            "driver": driver_id,
+            "pickup_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+            "pickup_lat": 33,
+            "pickup_lng": 1,
+            "delivery_lat": 98,
+            "delivery_lng": 98
+        }
+
+    def test_schedule_orders_endpoint(self):
+        """Test the accepted and rejected orders of a bulk scheduling"""
+        orders = [
+            # Accepted.
+            self.get_order_data(1, datetime.timedelta(hours = 3, minutes = 30)),
+            # Busy driver on the database.
+            self.get_order_data(1, datetime.timedelta(hours = 2, minutes = 30)),
+            # Busy driver because of the first order of the request.
+            self.get_order_data(1, datetime.timedelta(hours = 4)),
+            # Accepted.
+            self.get_order_data(2, datetime.timedelta(hours = 2, minutes = 30)),
+            # Past time.
+            self.get_order_data(2, -datetime.timedelta(hours = 2)),
+            # Invalid data type.
+            dict(self.get_order_data(2, datetime.timedelta(hours = 8)), delivery_lng = "wrong_data_type")
+        ]
+        client = APIClient()
+        response = client.post('/api/schedule_orders/', {"orders": orders}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = json.loads(response.content)
+        self.assertEqual([result["accepted"] for result in results], [True, False, False, True, False, False])
+        self.assertIn("The driver is busy", results[1]["errors"]["error"])
+        self.assertIn("The driver is busy", results[2]["errors"]["error"])
+        self.assertIn("past time", results[4]["errors"]["error"])
+        self.assertIn("A valid integer is required", results[5]["errors"]["delivery_lng"][0])
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_schedule_orders_endpoint_missing_orders(self):
+        """Test the bulk scheduling raise an exception when the orders are missing"""
+        client = APIClient()
+        response = client.post('/api/schedule_orders/', {}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Missing parameters", json.loads(response.content)["error"])
+
+    @override_settings(API_MAX_PAGE_SIZE = 3)
+    def test_schedule_orders_endpoint_too_many_orders(self):
+        """Test the bulk scheduling rejects more orders than API_MAX_PAGE_SIZE"""
+        orders = [self.get_order_data(2, datetime.timedelta(hours = 3 + hours)) for hours in range(4)]
+        client = APIClient()
+        response = client.post('/api/schedule_orders/', {"orders": orders}, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Too many orders", json.loads(response.content)["error"])
+        self.assertEqual(Order.objects.count(), 1)
+
+class DriverStateTestCase(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.driver_1 = Driver.objects.create(last_update = self.now, lat = 15, lng = 25)
+        self.driver_2 = Driver.objects.create(last_update = self.now, lat = 5, lng = 63)
+
+    def create_order(self, driver: Driver, hours: int, delivery_lat: int = 0, delivery_lng: int = 0) -> Order:
+        return Order.objects.create(driver = driver, pickup_datetime = self.now + datetime.timedelta(hours = hours), 
+                                    pickup_lat = 0, pickup_lng = 0, delivery_lat = delivery_lat, delivery_lng = delivery_lng)
+
+    def state(self, driver: Driver) -> tuple:
+        state = DriverState.objects.get(driver = driver)
+        return (state.lat, state.lng, state.busy_until, state.last_delivery_lat, state.last_delivery_lng)
+
+    def test_state_follows_order_writes(self):
+        """Test the state holds the end and delivery coordinates of the last order, after saves, moves and deletes"""
+        self.assertEqual(self.state(self.driver_1), (15, 25, None, None, None))
+        self.create_order(self.driver_1, 5, 70, 80)
+        order = self.create_order(self.driver_1, 8, 10, 20)
+        self.assertEqual(self.state(self.driver_1), 
+                         (15, 25, self.now + datetime.timedelta(hours = 8) + settings.DEFAULT_ORDER_DURATION, 10, 20))
+        order.driver = self.driver_2
+        order.save()
+        self.assertEqual(self.state(self.driver_1)[2:], (self.now + datetime.timedelta(hours = 5) + settings.DEFAULT_ORDER_DURATION, 70, 80))
+        self.assertEqual(self.state(self.driver_2)[2:], (self.now + datetime.timedelta(hours = 8) + settings.DEFAULT_ORDER_DURATION, 10, 20))
+        order.delete()
+        self.assertEqual(self.state(self.driver_2), (5, 63, None, None, None))
+
+    def test_state_busy_until_is_the_latest_end(self):
+        """Test the state is busy until the latest end of the orders, even when it is not the last order's"""
+        order = self.create_order(self.driver_1, 2)
+        order.duration = datetime.timedelta(hours = 10)
+        order.save()
+        self.create_order(self.driver_1, 5, 70, 80)
+        self.assertEqual(self.state(self.driver_1)[2:], (self.now + datetime.timedelta(hours = 12), 70, 80))
+
+    def test_state_schedule_holds_the_orders_not_ended(self):
+        """Test the state schedule holds the pickup and end of the orders not ended yet, sorted by pickup"""
+        self.create_order(self.driver_1, 8)
+        self.create_order(self.driver_1, -5)
+        self.create_order(self.driver_1, 3)
+        microseconds = lambda value: int(value.timestamp()) * 1000000
+        self.assertEqual(DriverState.objects.get(driver = self.driver_1).schedule, [
+            [microseconds(self.now + datetime.timedelta(hours = hours)), 
+             microseconds(self.now + datetime.timedelta(hours = hours) + settings.DEFAULT_ORDER_DURATION)]
+            for hours in (3, 8)
+        ])
+
+    def test_state_follows_api_writes(self):
+        """Test the state is updated by schedule_orders and the drivers location sync"""
+        pickup_datetime = datetime.datetime.now().replace(microsecond = 0) + datetime.timedelta(days = 1)
+        data = {'orders': [{
+            "driver": self.driver_2.id, "pickup_datetime": pickup_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+            "pickup_lat": 0, "pickup_lng": 0, "delivery_lat": 33, "delivery_lng": 44
+        }]}
+        APIClient().post('/api/schedule_orders/', data, format = 'json')
+        self.assertEqual(self.state(self.driver_2)[2:], 
+                         (pickup_datetime.replace(tzinfo = settings.TIME_ZONE_PYTZ) + settings.DEFAULT_ORDER_DURATION, 33, 44))
+        last_update = (self.now + datetime.timedelta(minutes = 1)).isoformat()
+        sync_drivers_location([{'id': self.driver_2.id, 'lat': 1, 'lng': 2, 'lastUpdate': last_update}, 
+                               {'id': 99, 'lat': 3, 'lng': 4, 'lastUpdate': last_update}])
+        self.assertEqual(self.state(self.driver_2)[:2], (1, 2))
+        self.assertEqual(DriverState.objects.get(driver_id = 99).lat, 3)
+
+    def test_state_is_rolled_back_with_the_write(self):
+        """Test the state changes are rolled back with the order write"""
+        try:
+            with transaction.atomic():
+                self.create_order(self.driver_1, 5)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertIsNone(self.state(self.driver_1)[2])
+
+    def test_rebuild_driver_states(self):
+        """Test the rebuild command backfills the missing or outdated states"""
+        self.create_order(self.driver_1, 5, 70, 80)
+        expected = self.state(self.driver_1)
+        DriverState.objects.all().delete()
+        output = StringIO()
+        call_command('rebuild_driver_states', stdout = output)
+        self.assertIn("driver states: 2", output.getvalue())
+        self.assertEqual(self.state(self.driver_1), expected)
+        self.assertEqual(rebuild_driver_states(), 2)
+
+class ArchiveOrdersTestCase(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.old_datetime = self.now - datetime.timedelta(days = 40)
+        self.driver_1 = Driver.objects.create(last_update = self.now, lat = 15, lng = 25)
+        self.driver_2 = Driver.objects.create(last_update = self.now, lat = 5, lng = 63)
+        for driver, pickup_datetime in ((self.driver_1, self.old_datetime), (self.driver_2, self.old_datetime), 
+                                        (self.driver_1, self.now - datetime.timedelta(days = 35)), 
+                                        (self.driver_1, self.now + datetime.timedelta(hours = 1))):
+            Order.objects.create(driver = driver, pickup_datetime = pickup_datetime, 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = 33, delivery_lng = 44)
+        self.old_date_str = self.old_datetime.strftime(settings.DEFAULT_DATE_FORMAT)
+
+    def get_filter_orders(self, path: str, params: dict = {}):
+        response = APIClient().get(f'/api/filter_orders/{path}/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_archive_orders_command(self):
+        """Test the command moves the orders of the old days in batches, and filter_orders returns them the same"""
+        paths = [self.old_date_str, f'{self.old_date_str}/{self.driver_2.id}']
+        expected = [self.get_filter_orders(path, params) for path in paths for params in ({}, {'stream': 1})]
+        output = StringIO()
+        call_command('archive_orders', '--batch-size', '2', stdout = output)
+        self.assertIn("archived orders: 3", output.getvalue())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertEqual(get_archived_through(), (self.now - datetime.timedelta(days = 35)).date())
+        self.assertEqual([self.get_filter_orders(path, params) for path in paths for params in ({}, {'stream': 1})], 
+                         expected)
+        # Nothing else to archive.
+        call_command('archive_orders', stdout = output)
+        self.assertIn("archived orders: 0", output.getvalue())
+
+    def test_interrupted_archive_never_splits_a_day(self):
+        """Test a run interrupted in the middle of a day leaves the whole day on the Order table"""
+        expected = self.get_filter_orders(self.old_date_str)
+        sent = []
+        def interrupt(sender, instances, **kwargs):
+            sent.append(instances)
+            if len(sent) == 2:
+                raise RuntimeError("interrupted")
+        bulk_deleted.connect(interrupt, sender = Order)
+        try:
+            with self.assertRaises(RuntimeError):
+                archive_orders((self.now - datetime.timedelta(days = 30)).date(), batch_size = 1)
+        finally:
+            bulk_deleted.disconnect(interrupt, sender = Order)
+        self.assertEqual(ArchivedOrder.objects.count(), 0)
+        self.assertIsNone(get_archived_through())
+        self.assertEqual(self.get_filter_orders(self.old_date_str), expected)
+        self.assertEqual(archive_orders((self.now - datetime.timedelta(days = 30)).date(), batch_size = 1), 3)
+        self.assertEqual(self.get_filter_orders(self.old_date_str), expected)
+
+    def test_archived_orders_leave_the_drivers_states(self):
+        """Test the drivers states only keep the orders left on the Order table"""
+        self.assertEqual(DriverState.objects.get(driver = self.driver_2).last_delivery_lat, 33)
+        archive_orders((self.now - datetime.timedelta(days = 30)).date())
+        state = DriverState.objects.get(driver = self.driver_2)
+        self.assertEqual((state.busy_until, state.last_delivery_lat), (None, None))
+        self.assertEqual(DriverState.objects.get(driver = self.driver_1).busy_until, 
+                         self.now + datetime.timedelta(hours = 1) + settings.DEFAULT_ORDER_DURATION)
+
+    def test_archive_orders_rejects_active_orders(self):
+        """Test the active orders can not be archived and the archived days can not get new orders"""
+        with self.assertRaises(Exception):
+            archive_orders(self.now.date() + datetime.timedelta(days = 1))
+        self.assertEqual(ArchivedOrder.objects.count(), 0)
+        archive_orders((self.now - datetime.timedelta(days = 30)).date())
+        data = {"driver": self.driver_1.id, "pickup_datetime": self.old_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), 
+                "pickup_lat": 0, "pickup_lng": 0, "delivery_lat": 1, "delivery_lng": 1}
+        response = APIClient().post('/api/orders/', data, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pickup_datetime', json.loads(response.content))
+
+class OrderStatsTestCase(TransactionTestCase):
+    # The stats are updated once the writes commit.
+    def setUp(self):
+        self.now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        self.day_datetime = (self.now + datetime.timedelta(days = 2)).replace(hour = 10, minute = 0, second = 0)
+        self.date_str = self.day_datetime.strftime(settings.DEFAULT_DATE_FORMAT)
+        self.driver_1 = Driver.objects.create(last_update = self.now, lat = 15, lng = 25)
+        self.driver_2 = Driver.objects.create(last_update = self.now, lat = 5, lng = 63)
+
+    def create_order(self, driver: Driver, pickup_datetime: datetime.datetime) -> Order:
+        return Order.objects.create(driver = driver, pickup_datetime = pickup_datetime, 
+                                    pickup_lat = 0, pickup_lng = 0, delivery_lat = 0, delivery_lng = 0)
+
+    def get_stats(self, path: str) -> dict:
+        response = APIClient().get(f'/api/order_stats/{path}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_stats_follow_order_writes(self):
+        """Test the stats are updated by the order saves, moves and deletes"""
+        order = self.create_order(self.driver_1, self.day_datetime)
+        self.create_order(self.driver_2, self.day_datetime + datetime.timedelta(minutes = 30))
+        self.create_order(self.driver_2, self.day_datetime + datetime.timedelta(hours = 3))
+        stats = self.get_stats(self.date_str)
+        self.assertEqual(stats['orders'], 3)
+        self.assertEqual((stats['hours'][10], stats['hours'][13], sum(stats['hours'])), (2, 1, 3))
+        self.assertEqual(stats['drivers'], {str(self.driver_1.id): 1, str(self.driver_2.id): 2})
+        self.assertEqual(self.get_stats(f'{self.date_str}/{self.driver_2.id}'), 
+                         {'date': self.date_str, 'driver': self.driver_2.id, 'orders': 2})
+        order.driver = self.driver_2
+        order.pickup_datetime += datetime.timedelta(days = 1)
+        order.save()
+        self.assertEqual(self.get_stats(self.date_str)['drivers'], {str(self.driver_2.id): 2})
+        next_date_str = order.pickup_datetime.strftime(settings.DEFAULT_DATE_FORMAT)
+        self.assertEqual(self.get_stats(f'{next_date_str}/{self.driver_2.id}')['orders'], 1)
+        order.delete()
+        self.assertEqual(self.get_stats(next_date_str)['orders'], 0)
+
+    def test_stats_follow_api_writes(self):
+        """Test the stats are updated by schedule_order, schedule_orders and the orders view set"""
+        order_data = {"driver": self.driver_1.id, "pickup_datetime": self.day_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT), 
+                      "pickup_lat": 0, "pickup_lng": 0, "delivery_lat": 1, "delivery_lng": 1}
+        client = APIClient()
+        client.post('/api/schedule_order/', order_data, format = 'json')
+        later_data = dict(order_data, driver = self.driver_2.id)
+        client.post('/api/schedule_orders/', {'orders': [later_data]}, format = 'json')
+        response = client.post('/api/orders/', dict(order_data, pickup_datetime = (self.day_datetime + datetime.timedelta(hours = 5))
+                                                    .strftime(settings.DEFAULT_DATETIME_FORMAT)), format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order_id = Order.objects.latest('id').id
+        self.assertEqual(self.get_stats(self.date_str)['orders'], 3)
+        client.delete(f'/api/orders/{order_id}/')
+        stats = self.get_stats(self.date_str)
+        self.assertEqual((stats['orders'], stats['hours'][15]), (2, 0))
+
+    def test_stats_follow_bulk_updates(self):
+        """Test an order moved to another day by a bulk update leaves the stats of its previous day"""
+        order = self.create_order(self.driver_1, self.day_datetime)
+        order.driver = self.driver_2
+        order.pickup_datetime += datetime.timedelta(days = 1, hours = 2)
+        with transaction.atomic():
+            Order.objects.bulk_update([order], ['driver', 'pickup_datetime'])
+            # Not counted until the write commits.
+            self.assertEqual(self.get_stats(self.date_str)['orders'], 1)
+        self.assertEqual(self.get_stats(self.date_str), {'date': self.date_str, 'orders': 0, 'hours': [0] * 24, 'drivers': {}})
+        next_date_str = order.pickup_datetime.strftime(settings.DEFAULT_DATE_FORMAT)
+        stats = self.get_stats(next_date_str)
+        self.assertEqual((stats['orders'], stats['hours'][12], stats['drivers']), (1, 1, {str(self.driver_2.id): 1}))
+
+    def test_stats_keep_the_archived_orders(self):
+        """Test the archived orders are still counted, also by the rebuild"""
+        old_datetime = self.now - datetime.timedelta(days = 40)
+        self.create_order(self.driver_1, old_datetime)
+        archive_orders((self.now - datetime.timedelta(days = 30)).date())
+        self.assertEqual(get_order_stats(old_datetime.date())['orders'], 1)
+        self.assertEqual(rebuild_order_stats(), 1)
+        self.assertEqual(get_order_stats(old_datetime.date())['orders'], 1)
+
+    def test_rebuild_order_stats(self):
+        """Test the rebuild command backfills the stats, and the endpoint answers with a query per table"""
+        self.create_order(self.driver_1, self.day_datetime)
+        self.create_order(self.driver_2, self.day_datetime + datetime.timedelta(days = 1))
+        expected = self.get_stats(self.date_str)
+        DailyOrderStats.objects.all().delete()
+        DriverDailyOrderStats.objects.all().delete()
+        HourlyOrderStats.objects.update(orders = 7)
+        output = StringIO()
+        call_command('rebuild_order_stats', '--date', self.date_str, stdout = output)
+        self.assertIn("days with orders: 1", output.getvalue())
+        self.assertEqual(self.get_stats(self.date_str), expected)
+        call_command('rebuild_order_stats', stdout = output)
+        self.assertIn("days with orders: 2", output.getvalue())
+        with self.assertNumQueries(3):
+            get_order_stats(self.day_datetime.date())
+
+    def test_stats_bad_request_date_format(self):
+        """Test bad request when the date does not match the format"""
+        response = APIClient().get('/api/order_stats/2022-13-45/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class SyncDriversLocationTestCase(TestCase):
+    def setUp(self):
+        Driver.objects.create(id = 1, last_update = datetime.datetime(2022, 11, 1, 10, 0, tzinfo = settings.TIME_ZONE_PYTZ), lat = 15, lng = 25)
+        Driver.objects.create(id = 2, last_update = datetime.datetime(2022, 11, 1, 10, 0, tzinfo = settings.TIME_ZONE_PYTZ), lat = 5, lng = 63)
+
+    def test_sync_drivers_location(self):
+        """Test the feed drivers are created, updated or skipped when they did not change"""
+        drivers_list = [
+            {"id": 1, "lat": 15, "lng": 25, "lastUpdate": "2022-11-01T10:00:00Z"},
+            {"id": 2, "lat": 7, "lng": 60, "lastUpdate": "2022-11-01T10:01:00Z"},
+            {"id": 3, "lat": 98, "lng": 98, "lastUpdate": "2022-11-01T10:01:00Z"}
+        ]
+        counts = sync_drivers_location(drivers_list)
+        self.assertEqual(counts, {'received': 3, 'created': 1, 'updated': 1, 'unchanged': 1})
+        driver_2 = Driver.objects.get(id = 2)
+        self.assertEqual((driver_2.lat, driver_2.lng), (7, 60))
+        self.assertEqual(driver_2.last_update, datetime.datetime(2022, 11, 1, 10, 1, tzinfo = settings.TIME_ZONE_PYTZ))
+        self.assertTrue(Driver.objects.filter(id = 3, lat = 98, lng = 98).exists())
+        # A second sync of the same feed changes nothing.
+        self.assertEqual(sync_drivers_location(drivers_list), {'received': 3, 'created': 0, 'updated': 0, 'unchanged': 3})
+
+    def test_sync_drivers_location_skips_not_newer_updates(self):
+        """Test the feed drivers whose lastUpdate is not newer than the saved one are skipped"""
+        drivers_list = [
+            {"id": 1, "lat": 50, "lng": 50, "lastUpdate": "2022-11-01T10:00:00Z"},
+            {"id": 2, "lat": 50, "lng": 50, "lastUpdate": "2022-11-01T09:59:00Z"}
+        ]
+        self.assertEqual(sync_drivers_location(drivers_list), {'received': 2, 'created': 0, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(Driver.objects.filter(lat = 50).count(), 0)
+
+    def test_sync_drivers_location_updates_closest_driver(self):
+        """Test the closest driver search uses the synced locations"""
+        sync_drivers_location([{"id": 2, "lat": 90, "lng": 93, "lastUpdate": "2022-11-01T10:01:00Z"}])
+        test_datetime = datetime.datetime.now() + datetime.timedelta(hours = 12)
+        data = {
+            "target_datetime": test_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+            "lat": 90,
+            "lng": 93
+        }
+        response = APIClient().post('/api/get_closest_driver/', data, format = 'json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["id"], 2)
+
+class StreamDriversLocationTestCase(TestCase):
+    def setUp(self):
+        self.drivers_list = [{"id": driver_id, "lat": driver_id % 100, "lng": driver_id % 37, 
+                              "lastUpdate": "2022-11-01T10:00:00Z"} for driver_id in range(1, 5001)]
+        self.feed = json.dumps({"alfreds": self.drivers_list, "total": len(self.drivers_list)}, indent = 1)
+
+    def test_parse_feed_in_chunks(self):
+        """Test the feed is parsed the same for any chunk size"""
+        for read_size in [1, 7, 100, 64 * 1024]:
+            chunks = (self.feed[start:start + read_size] for start in range(0, len(self.feed), read_size))
+            self.assertEqual(list(iter_feed_drivers(chunks)), self.drivers_list)
+
+    def test_parse_truncated_feed(self):
+        """Test a truncated feed raise an exception"""
+        with self.assertRaises(ValueError):
+            list(iter_feed_drivers([self.feed[:len(self.feed) // 2]]))
+        with self.assertRaises(ValueError):
+            list(iter_feed_drivers(['{"drivers": []}']))
+
+    def test_fetch_drivers_location_from_file(self):
+        """Test the streamed sync of a local feed file"""
+        with tempfile.NamedTemporaryFile('w', suffix = '.json') as feed_file:
+            feed_file.write(self.feed)
+            feed_file.flush()
+            with self.settings(DRIVERS_LOCATION_URL = f"file://{feed_file.name}", DRIVERS_SYNC_CHUNK_SIZE = 700, 
+                               DRIVERS_FEED_READ_SIZE = 1000):
+                fetch_drivers_location()
+        self.assertEqual(Driver.objects.count(), len(self.drivers_list))
+        self.assertEqual(Driver.objects.get(id = 4321).lat, 21)
+
+    def test_fetch_drivers_location_from_http(self):
+        """Test the streamed sync of a feed served by a local HTTP server"""
+        feed_bytes = self.feed.encode()
+
+        class FeedHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(feed_bytes)))
+                self.end_headers()
+                self.wfile.write(feed_bytes)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/points.json"
+            self.assertEqual(list(iter_feed_drivers(iter_feed_chunks(url, read_size = 999))), self.drivers_list)
+            with self.settings(DRIVERS_LOCATION_URL = url, DRIVERS_SYNC_CHUNK_SIZE = 700):
+                fetch_drivers_location()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(Driver.objects.count(), len(self.drivers_list))
+
+class ConditionalFetchDriversLocationTestCase(TestCase):
+    def setUp(self):
+        caches[settings.DRIVERS_LOCATION_CACHE].clear()
+        self.requests_headers = []
+        self.feed = {"alfreds": [{"id": 1, "lat": 15, "lng": 25, "lastUpdate": "2022-11-01T10:00:00Z"}]}
+        test_case = self
+
+        class FeedHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                test_case.requests_headers.append(dict(self.headers))
+                feed_bytes = json.dumps(test_case.feed).encode()
+                etag = f'"{hash(feed_bytes)}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(feed_bytes)))
+                self.end_headers()
+                self.wfile.write(feed_bytes)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/points.json"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        caches[settings.DRIVERS_LOCATION_CACHE].clear()
+
+    def test_fetch_drivers_location_conditional_request(self):
+        """Test a not modified feed is not downloaded nor saved again"""
+        for streaming in [True, False]:
+            with self.settings(DRIVERS_LOCATION_URL = self.url, DRIVERS_LOCATION_STREAMING = streaming):
+                caches[settings.DRIVERS_LOCATION_CACHE].clear()
+                fetch_drivers_location()
+                Driver.objects.filter(id = 1).update(lat = 0)
+                # The feed did not change, so the driver is not saved again.
+                fetch_drivers_location()
+                self.assertEqual(Driver.objects.get(id = 1).lat, 0)
+                self.assertIsNotNone(self.requests_headers[-1].get('If-None-Match'))
+                # The feed changed.
+                self.feed["alfreds"][0].update(lat = 16, lastUpdate = "2022-11-01T10:01:00Z" if streaming else "2022-11-01T10:02:00Z")
+                fetch_drivers_location()
+                self.assertEqual(Driver.objects.get(id = 1).lat, 16)
+
+class IngestDriversLocationTestCase(TransactionTestCase):
+    def test_coalesce_keeps_newest_update(self):
+        """Test the ingestor keeps the newest update of each driver"""
+        ingestor = DriversLocationIngestor(url = "unused.json")
+        ingestor.coalesce([{"id": 1, "lat": 1, "lng": 1, "lastUpdate": "2022-11-01T10:01:00Z"}])
+        ingestor.coalesce([{"id": 1, "lat": 2, "lng": 2, "lastUpdate": "2022-11-01T10:00:00Z"}, 
+                           {"id": 2, "lat": 3, "lng": 3, "lastUpdate": "2022-11-01T10:00:00Z"}])
+        self.assertEqual({driver_id: driver["lat"] for driver_id, (_, driver) in ingestor._pending.items()}, {1: 1, 2: 3})
+
+    def test_ingest_drivers_location_command(self):
+        """Test the ingestor command polls the feed and saves the drivers in batches"""
+        drivers_list = [{"id": driver_id, "lat": driver_id % 100, "lng": driver_id % 37, 
+                         "lastUpdate": "2022-11-01T10:00:00Z"} for driver_id in range(1, 251)]
+        with tempfile.NamedTemporaryFile('w', suffix = '.json') as feed_file:
+            json.dump({"alfreds": drivers_list}, feed_file)
+            feed_file.flush()
+            stdout = StringIO()
+            call_command('ingest_drivers_location', '--url', feed_file.name, '--polls', '3', '--interval', '0.01', 
+                         '--flush-interval', '0', '--batch-size', '100', stdout = stdout)
+        self.assertEqual(Driver.objects.count(), len(drivers_list))
+        self.assertIn("polls: 3", stdout.getvalue())
+        self.assertIn("created: 250", stdout.getvalue())
+
+    @override_settings(DRIVERS_LOCATION_MAX_BACKOFF = 0.01)
+    def test_ingestor_keeps_polling_after_errors(self):
+        """Test a failed poll or an invalid driver do not stop the ingestor"""
+        with tempfile.TemporaryDirectory() as directory:
+            feed_path = Path(directory) / 'feed.json'
+            ingestor = DriversLocationIngestor(url = str(feed_path), poll_interval = 0.01, flush_interval = 0)
+            # The feed does not exist yet.
+            with self.assertLogs('core.ingest', level = 'ERROR'):
+                asyncio.run(ingestor.run(max_polls = 2))
+            self.assertEqual((ingestor.totals['polls'], ingestor.totals['errors']), (2, 2))
+            feed_path.write_text(json.dumps({"alfreds": [{"id": 1, "lat": 1}, 
+                                                         {"id": 2, "lat": 3, "lng": 4, "lastUpdate": "2022-11-01T10:00:00Z"}]}))
+            with self.assertLogs('core.ingest', level = 'WARNING'):
+                asyncio.run(ingestor.run(max_polls = 3))
+        self.assertEqual(ingestor.totals['errors'], 2)
+        self.assertEqual(list(Driver.objects.values_list('id', 'lat', 'lng')), [(2, 3, 4)])
+
+    @override_settings(ORDER_ARCHIVE_HOUR = 0)
+    def test_ingestor_archives_the_orders_once_a_day(self):
+        """Test the ingestor archives the completed orders on its first poll, and not again the same day"""
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ, microsecond = 0)
+        driver = Driver.objects.create(last_update = now, lat = 15, lng = 25)
+        for pickup_datetime in (now - datetime.timedelta(days = 40), now + datetime.timedelta(hours = 1)):
+            Order.objects.create(driver = driver, pickup_datetime = pickup_datetime, 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = 33, delivery_lng = 44)
+        with tempfile.TemporaryDirectory() as directory:
+            feed_path = Path(directory) / 'feed.json'
+            feed_path.write_text(json.dumps({"alfreds": []}))
+            ingestor = DriversLocationIngestor(url = str(feed_path), poll_interval = 0.01, flush_interval = 0)
+            asyncio.run(ingestor.run(max_polls = 2))
+            self.assertEqual(ingestor.totals['archived_orders'], 1)
+            Order.objects.create(driver = driver, pickup_datetime = now - datetime.timedelta(days = 40, hours = 1), 
+                                 pickup_lat = 0, pickup_lng = 0, delivery_lat = 33, delivery_lng = 44)
+            asyncio.run(ingestor.run(max_polls = 4))
+        self.assertEqual(ingestor.totals['archived_orders'], 1)
+        self.assertEqual((Order.objects.count(), ArchivedOrder.objects.count()), (2, 1))
+
+class ConcurrentScheduleOrderTestCase(TransactionTestCase):
+    threads = 8
+    requests_per_thread = 12
+    # Far below the throughput of any machine, it only catches the schedulings serialized on a lock wait.
+    min_requests_per_second = 10
+
+    def setUp(self):
+        now = datetime.datetime.now().replace(tzinfo = settings.TIME_ZONE_PYTZ)
+        self.drivers = [Driver.objects.create(last_update = now, lat = 0, lng = 0) for _ in range(2)]
+        self.start_datetime = (now + datetime.timedelta(days = 1)).replace(minute = 0, second = 0, microsecond = 0)
+
+    def schedule(self, thread_number: int, responses: list) -> None:
+        """Post overlapping orders: every thread requests the same pickup datetimes of the same drivers."""
+        client = APIClient()
+        try:
+            for position in range(self.requests_per_thread):
+                pickup_datetime = self.start_datetime + datetime.timedelta(minutes = 20 * (position // 2))
+                data = {
+                    "driver": self.drivers[(position + thread_number) % 2].id,
+                    "pickup_datetime": pickup_datetime.strftime(settings.DEFAULT_DATETIME_FORMAT),
+                    "pickup_lat": 0, "pickup_lng": 0, "delivery_lat": 0, "delivery_lng": 0
+                }
+                responses.append(client.post('/api/schedule_order/', data, format = 'json').status_code)
+        finally:
+            connection.close()
+
+    def test_parallel_schedule_order_never_double_books(self):
+        """Test parallel schedule_order requests never book a driver twice at the same time"""
+        responses = []
+        workers = [threading.Thread(target = self.schedule, args = (thread_number, responses)) 
+                   for thread_number in range(self.threads)]
+        start_time = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        requests_per_second = len(responses) / (time.perf_counter() - start_time)
+        logger.info("schedule_order: %d parallel requests, %.0f requests/s", len(responses), requests_per_second)
+        self.assertGreater(requests_per_second, self.min_requests_per_second)
+        self.assertEqual(len(responses), self.threads * self.requests_per_thread)
+        self.assertEqual(set(responses), {status.HTTP_201_CREATED, status.HTTP_500_INTERNAL_SERVER_ERROR})
+        for driver in self.drivers:
+            pickup_datetimes = list(Order.objects.filter(driver = driver).order_by('pickup_datetime')
+                                    .values_list('pickup_datetime', flat = True))
+            for previous, following in zip(pickup_datetimes, pickup_datetimes[1:]):
+                self.assertGreater(following - previous, settings.DEFAULT_ORDER_DURATION)
+        self.assertEqual(responses.count(status.HTTP_201_CREATED), Order.objects.count())
@@ -0,0 +1,12 @@
+# Gunicorn configuration of the production server (gunicorn orders_challenge.asgi:application).
+# https://docs.gunicorn.org/en/stable/settings.html
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+# One worker per CPU by default. Each one keeps its own in-memory matching indexes, which load only the
+# rows written by the other workers (see core.models.TableChange).
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# ASGI workers: the async views (/api/async/) run on the event loop of each worker.
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+accesslog = '-'
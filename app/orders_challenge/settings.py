@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 
 from pathlib import Path
 import datetime
+import os
+import tempfile
 import pytz 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the recorded time covers the other middlewares.
+    'api.metrics.request_metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +87,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {
+            # A file instead of the shared in-memory database, so the concurrency tests get the
+            # database locking of a real deployment (waits on busy instead of "table is locked"). One per
+            # test run (process id), so concurrent runs on the same machine do not share it.
+            'NAME': Path(tempfile.gettempdir()) / f'orders_challenge_test_db_{os.getpid()}.sqlite3',
+        }
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'drivers_location': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'orders_challenge' / 'drivers_location',
+    },
+    'closest_driver': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'closest_driver',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
     }
 }
 
@@ -150,12 +182,97 @@ REST_FRAMEWORK = {
 # https://gist.github.com/jeithc/96681e4ac7e2b99cfe9a08ebc093787c
 DRIVERS_LOCATION_URL = "https://gist.githubusercontent.com/jeithc/96681e4ac7e2b99cfe9a08ebc093787c/raw/813c02c8138a34986e5dade83c503f3e4da3b78c/points.json"
 
-# Order default duration
+# Timeout (in seconds) of the drivers location feed requests
+DRIVERS_FEED_TIMEOUT = 30
+# Cache alias where the ETag and Last-Modified of the drivers location feed are saved.
+# It must be shared by the processes that run the cron job.
+DRIVERS_LOCATION_CACHE = 'drivers_location'
+# Parse and save the drivers location feed in chunks while it is downloaded
+DRIVERS_LOCATION_STREAMING = True
+# Size (in characters) of the chunks read from the drivers location feed
+DRIVERS_FEED_READ_SIZE = 64 * 1024
+# Drivers saved per transaction when the feed is streamed
+DRIVERS_SYNC_CHUNK_SIZE = 1000
+# Seconds between polls of the drivers location ingestor (manage.py ingest_drivers_location)
+DRIVERS_LOCATION_POLL_INTERVAL = 0.5
+# Max seconds the ingestor keeps the coalesced updates before saving them
+DRIVERS_LOCATION_FLUSH_INTERVAL = 1.0
+# Max seconds the ingestor waits to retry after a failed poll or flush (the wait doubles on each failure)
+DRIVERS_LOCATION_MAX_BACKOFF = 60.0
+# Max rows per query when the drivers location is saved with bulk operations
+DRIVERS_SYNC_BATCH_SIZE = 500
+
+# Drivers whose DriverState is recomputed per query (core.states)
+DRIVER_STATE_BATCH_SIZE = 500
+
+# Orders archive (core.archive): the orders of the days older than ORDER_ARCHIVE_AFTER_DAYS are moved
+# from the Order table to the ArchivedOrder table, one day per transaction and ORDER_ARCHIVE_BATCH_SIZE orders per statement
+ORDER_ARCHIVE_AFTER_DAYS = 30
+ORDER_ARCHIVE_BATCH_SIZE = 1000
+# Local hour from which the drivers location ingestor archives the orders, once a day
+ORDER_ARCHIVE_HOUR = 3
+
+# Rows per page of the paginated responses (page_size query parameter): the drivers and orders
+# list routes, and filter_orders with page_size or cursor
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+# Orders read from the database per query when filter_orders streams the orders (stream query parameter)
+FILTER_ORDERS_STREAM_CHUNK_SIZE = 2000
+
+# Per-endpoint request metrics (api.metrics): queries, database time, Python time and response size
+REQUEST_METRICS_ENABLED = True
+# Add the Server-Timing header (db, app and total durations) to the responses
+REQUEST_METRICS_SERVER_TIMING = True
+# Last requests per endpoint kept for the percentiles of the metrics endpoint
+REQUEST_METRICS_SAMPLES = 1000
+# Client addresses allowed to consult the metrics endpoint (api/metrics/)
+REQUEST_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Order default duration, for the orders scheduled without one
 DEFAULT_ORDER_DURATION = datetime.timedelta(hours = 1)
+# Order max duration. It bounds the pickup_datetime range of the overlap and busy checks.
+MAX_ORDER_DURATION = datetime.timedelta(hours = 12)
+
+# Free slots search (api/free_slots/)
+# Searched pickup_datetime range when no end_datetime is received, and the max one
+FREE_SLOTS_DEFAULT_RANGE = datetime.timedelta(days = 1)
+FREE_SLOTS_MAX_RANGE = datetime.timedelta(days = 31)
+# Max distance (in lat/lng units) of the searched drivers to the zone when no radius is received
+FREE_SLOTS_DEFAULT_RADIUS = 10
+
+# Closest-driver search engine: 'index' (api.indexes), 'numpy' or 'database' (api.matching).
+# The 'numpy' engine falls back to 'index' when NumPy is not installed. The 'database' engine keeps
+# nothing in memory and skips the closest-driver results cache. Also set by the CLOSEST_DRIVER_ENGINE
+# environment variable.
+CLOSEST_DRIVER_ENGINE = os.environ.get('CLOSEST_DRIVER_ENGINE', 'index')
+# Half side (in lat/lng units) of the square around the point where the 'database' engine searches
+# the drivers first, using the (lat, lng) index.
+DATABASE_ENGINE_SEARCH_RADIUS = 50
+
+# In-memory matching indexes (api.indexes)
+# Size (in lat/lng units) of the cells of the drivers grid index.
+DRIVER_GRID_CELL_SIZE = 10
+# Size (in lat/lng units) of the delivery coordinates cells of the orders timeline index.
+ORDER_TIMELINE_CELL_SIZE = 10
+# Max age of an index before it is rebuilt from the database.
+MATCHING_INDEX_MAX_AGE = datetime.timedelta(minutes = 5)
+
+# Closest-driver results cache (api.cache)
+# Cache alias of the closest-driver results. None disables the cache.
+CLOSEST_DRIVER_CACHE = 'closest_driver'
+# Size (in lat/lng units) of the coordinates quantum of the cache keys. 1 caches the exact coordinates.
+CLOSEST_DRIVER_CACHE_COORDINATES_QUANTUM = 1
+# Time quantum of the cache keys. The target datetimes have seconds precision, so 1 second is exact.
+CLOSEST_DRIVER_CACHE_TIME_QUANTUM = datetime.timedelta(seconds = 1)
+# Target datetimes that share an invalidation generation when an order is written.
+CLOSEST_DRIVER_CACHE_BUCKET = datetime.timedelta(minutes = 5)
 
 # django-crontab
 CRON_LOGFILE = '/cron/django_cron.log'
 
+# Installed by 'manage.py crontab add', they only run where the cron daemon runs. The Docker image does not
+# start it: the drivers location ingestor replaces both jobs (see ORDER_ARCHIVE_HOUR and the README).
 CRONJOBS = [
     ('* * * * *', 'core.cron.fetch_drivers_location', '>> /cron/django_cron.log 2>&1'),
+    ('0 3 * * *', 'core.archive.archive_completed_orders', '>> /cron/django_cron.log 2>&1'),
 ]